@@ -7,7 +7,7 @@ load_dotenv('.env')
 
 api_id = int(os.getenv('TELEGRAM_API_ID'))
 api_hash = os.getenv('TELEGRAM_API_HASH')
-session_name = 'tg_session'
+session_name = os.getenv('TELEGRAM_SESSION', 'tg_session')
 
 async def main():
     client = TelegramClient(session_name, api_id, api_hash)
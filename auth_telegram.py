@@ -20,7 +20,7 @@ async def main():
         print("❌ Заполните TELEGRAM_API_ID, TELEGRAM_API_HASH, TELEGRAM_PHONE в .env")
         return
     
-    client = TelegramClient("tg_session", api_id, api_hash)
+    client = TelegramClient(os.getenv("TELEGRAM_SESSION", "tg_session"), api_id, api_hash)
     
     try:
         await client.connect()
@@ -0,0 +1,240 @@
+"""Загрузка истории канала из экспорта Telegram Desktop (result.json) без опроса Telegram.
+
+python backfill.py path/to/result.json --channel username [--replace] [--dry-run]
+
+Файл читается потоково (сообщения разбираются по одному), быстрая проверка идёт
+в пуле процессов, прошедшие её посты — в LLM с ограниченной параллельностью.
+Результаты сохраняются в processed_posts пачками, события — в список событий бота,
+уведомления не рассылаются.
+Курсор канала сдвигается на последний загруженный пост, поэтому сервис продолжит
+опрос с этого места. --replace перепроверяет уже сохранённые посты (например,
+после изменения промпта), не трогая отметку об отправке.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from database.db import init_db, close_db, get_db, run_db, WriteBatch
+from detectors.first_pass import quick_check
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger("backfill")
+
+READ_CHUNK = 1 << 20
+# Сколько сообщений отправлять в пул процессов за раз и сколько строк копить до записи в БД
+CHECK_CHUNK = 5000
+FLUSH_EVERY = 1000
+
+Post = Tuple[int, str, str]
+
+
+def iter_export_messages(path: str) -> Iterator[Dict[str, Any]]:
+    """Сообщения из массива "messages" экспорта — по одному, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        # Ищем начало массива сообщений
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                raise ValueError(f"{path}: в файле нет массива \"messages\" (нужен экспорт одного чата)")
+            buffer += chunk
+            key = buffer.find('"messages"')
+            start = buffer.find("[", key) if key >= 0 else -1
+            if start >= 0:
+                buffer = buffer[start + 1:]
+                break
+            # Ключ мог разрезаться границей чанка — оставляем хвост
+            buffer = buffer[key:] if key >= 0 else buffer[-16:]
+
+        pos = 0
+        eof = False
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError("нужны данные", buffer, pos)
+                message, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"{path}: файл обрывается внутри массива сообщений")
+                chunk = f.read(READ_CHUNK)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield message
+
+
+def flatten_text(text: Any) -> str:
+    """Текст сообщения экспорта: строка или список из строк и фрагментов с разметкой"""
+    if isinstance(text, str):
+        return text
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else str(part.get("text", "")) for part in text)
+    return ""
+
+
+def iter_posts(path: str) -> Iterator[Post]:
+    """(id, текст, дата) непустых сообщений канала; служебные сообщения пропускаются"""
+    for message in iter_export_messages(path):
+        if message.get("type") != "message":
+            continue
+        text = flatten_text(message.get("text"))
+        if text:
+            yield int(message["id"]), text, str(message.get("date", ""))
+
+
+def _check_chunk(texts: List[str]) -> List[bool]:
+    # Выполняется в дочернем процессе
+    return [quick_check(text) for text in texts]
+
+
+def _known_post_ids(channel: str) -> set:
+    cur = get_db().execute("SELECT post_id FROM processed_posts WHERE channel_username = ?", (channel,))
+    return {row["post_id"] for row in cur}
+
+
+class Backfill:
+    def __init__(self, channel: str, replace: bool, dry_run: bool, concurrency: int):
+        self.channel = channel
+        self.replace = replace
+        self.dry_run = dry_run
+        self.concurrency = concurrency
+        self.batch = WriteBatch()
+        self.stats = {"read": 0, "skipped": 0, "first_pass": 0, "llm": 0, "events": 0}
+        self.max_id: Optional[int] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 4)
+
+    async def _save(self, post: Post, is_event: bool, data: Dict[str, Any]) -> None:
+        from pipeline.stages import has_useful_data, with_event_at
+
+        post_id, text, date = post
+        if is_event:
+            data = with_event_at(data, text, date)
+        self.batch.add_processed_post(self.channel, post_id, date, text, is_event, data, replace=self.replace)
+        if is_event and has_useful_data(data):
+            self.batch.add_event(self.channel, post_id, date, data)
+        if len(self.batch) >= FLUSH_EVERY:
+            # Записываем накопленное отдельной пачкой: новые строки идут уже в следующую
+            batch, self.batch = self.batch, WriteBatch()
+            await batch.flush_async()
+
+    async def _llm_worker(self) -> None:
+        from detectors.second_pass import llm_detect_async
+
+        while True:
+            post = await self._queue.get()
+            try:
+                result = await llm_detect_async(post[1])
+                self.stats["llm"] += 1
+                self.stats["events"] += bool(result.get("is_event"))
+                await self._save(post, bool(result.get("is_event")), result)
+            except Exception as exc:
+                logger.error(f"Пост {post[0]}: ошибка LLM: {exc}")
+            finally:
+                self._queue.task_done()
+
+    async def _handle_checked(self, chunk: List[Post], passed: "asyncio.Future") -> None:
+        for post, ok in zip(chunk, await passed):
+            if not ok:
+                if not self.dry_run:
+                    await self._save(post, False, {})
+                continue
+            self.stats["first_pass"] += 1
+            if not self.dry_run:
+                # Очередь ограничена: чтение файла ждёт, пока LLM разберёт накопленное
+                await self._queue.put(post)
+
+    async def run(self, path: str, workers: int) -> None:
+        known = set() if self.replace else await run_db(_known_post_ids, self.channel)
+        llm_workers = [asyncio.create_task(self._llm_worker()) for _ in range(self.concurrency)]
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # Несколько пачек в пуле одновременно, результаты разбираются по порядку
+                in_flight: Deque[Tuple[List[Post], asyncio.Future]] = deque()
+                chunk: List[Post] = []
+                for post in iter_posts(path):
+                    self.stats["read"] += 1
+                    self.max_id = max(post[0], self.max_id or post[0])
+                    if post[0] in known:
+                        self.stats["skipped"] += 1
+                        continue
+                    chunk.append(post)
+                    if len(chunk) >= CHECK_CHUNK:
+                        in_flight.append((chunk, loop.run_in_executor(pool, _check_chunk, [p[1] for p in chunk])))
+                        chunk = []
+                        if len(in_flight) >= workers * 2:
+                            await self._handle_checked(*in_flight.popleft())
+                            self._log_progress(started)
+                if chunk:
+                    in_flight.append((chunk, loop.run_in_executor(pool, _check_chunk, [p[1] for p in chunk])))
+                while in_flight:
+                    await self._handle_checked(*in_flight.popleft())
+            await self._queue.join()
+        finally:
+            for task in llm_workers:
+                task.cancel()
+            await asyncio.gather(*llm_workers, return_exceptions=True)
+        if not self.dry_run:
+            if self.max_id is not None:
+                # Дальше сервис читает канал с последнего поста экспорта
+                self.batch.set_cursor(self.channel, self.max_id)
+            await self.batch.flush_async()
+        self._log_progress(started)
+
+    def _log_progress(self, started: float) -> None:
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Прочитано {self.stats['read']} (уже были: {self.stats['skipped']}), "
+            f"прошли first_pass: {self.stats['first_pass']}, проверено LLM: {self.stats['llm']}, "
+            f"событий: {self.stats['events']} — {self.stats['read'] / max(elapsed, 1e-9):.0f} сообщ./с"
+        )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from detectors.second_pass import close_llm_client
+
+    backfill = Backfill(args.channel.lstrip("@"), args.replace, args.dry_run, args.concurrency)
+    try:
+        await backfill.run(args.export, args.workers)
+    finally:
+        await close_llm_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("export", help="result.json из Telegram Desktop (экспорт одного канала в JSON)")
+    parser.add_argument("--channel", required=True, help="username канала (для ссылок и курсора)")
+    parser.add_argument("--replace", action="store_true", help="перепроверить уже сохранённые посты")
+    parser.add_argument("--dry-run", action="store_true", help="только first_pass, без LLM и записи в БД")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="процессов для first_pass")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных запросов к LLM")
+    args = parser.parse_args()
+
+    if not load_dotenv():
+        load_dotenv("env.sample")
+    # Параллельность запросов к LLM ограничена семафором second_pass
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+    init_db()
+    try:
+        asyncio.run(_main(args))
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    main()
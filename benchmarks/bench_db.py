@@ -0,0 +1,97 @@
+"""Накладные расходы БД на один пост: старый способ (соединение на каждый вызов)
+против постоянного соединения в WAL и пачки записей за цикл канала.
+
+Запуск: python benchmarks/bench_db.py --posts 2000 --batch 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from database import db  # noqa: E402
+
+
+def _legacy_connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def run_legacy(path: str, posts: int) -> float:
+    """Как было: is_post_processed + add_processed_post + mark_as_sent, каждый со своим соединением"""
+    started = time.perf_counter()
+    for post_id in range(posts):
+        conn = _legacy_connect(path)
+        conn.execute(
+            "SELECT 1 FROM processed_posts WHERE channel_username = ? AND post_id = ?",
+            ("legacy", post_id),
+        ).fetchone()
+        conn.close()
+
+        conn = _legacy_connect(path)
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO processed_posts (
+                channel_username, post_id, post_date, post_text, is_event, extracted_data, sent_to_bot
+            ) VALUES (?, ?, ?, ?, ?, ?, 0)
+            """,
+            ("legacy", post_id, "2024-01-01T00:00:00", "текст поста", 1, json.dumps({"is_event": True})),
+        )
+        conn.commit()
+        conn.close()
+
+        conn = _legacy_connect(path)
+        conn.execute(
+            "UPDATE processed_posts SET sent_to_bot = 1 WHERE channel_username = ? AND post_id = ?",
+            ("legacy", post_id),
+        )
+        conn.commit()
+        conn.close()
+    return time.perf_counter() - started
+
+
+def run_batched(posts: int, batch_size: int) -> float:
+    """Постоянное соединение + WriteBatch: одна транзакция на цикл канала.
+
+    Проверка «уже обработан» не нужна — повтор отсекает INSERT OR IGNORE, а отметка
+    об отправке ставится вместе с постановкой в исходящие, как в конвейере.
+    """
+    started = time.perf_counter()
+    batch = db.WriteBatch()
+    for post_id in range(posts):
+        batch.add_processed_post("batched", post_id, "2024-01-01T00:00:00", "текст поста", True, {"is_event": True})
+        batch.enqueue_delivery("batched", post_id, [1], "текст поста")
+        if (post_id + 1) % batch_size == 0:
+            batch.flush()
+    batch.flush()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=10, help="постов в одном цикле канала")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = str(Path(tmp) / "bench.db")
+        db.init_db()
+
+        legacy = run_legacy(os.environ["DATABASE_PATH"], args.posts)
+        batched = run_batched(args.posts, args.batch)
+        db.close_db()
+
+    print(f"Постов: {args.posts}, пачка: {args.batch}")
+    print(f"  соединение на вызов: {legacy / args.posts * 1e6:8.1f} мкс/пост")
+    print(f"  WAL + пачки:         {batched / args.posts * 1e6:8.1f} мкс/пост")
+    print(f"  ускорение:           {legacy / batched:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
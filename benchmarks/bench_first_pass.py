@@ -0,0 +1,129 @@
+"""Микробенчмарк first_pass: прежняя проверка (подстроки + re.search на каждый паттерн)
+против скомпилированного матчера detectors.first_pass.
+
+Корпус — посты из processed_posts (если есть база) и синтетические посты.
+Запуск: python benchmarks/bench_first_pass.py --posts 50000 [--db database.db]
+"""
+import argparse
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from detectors.first_pass import quick_check, match_rules  # noqa: E402
+
+LEGACY_KEYWORDS = [
+    "митап", "конференция", "лекция", "воркшоп", "встреча", "вечеринка", "семинар", "тренинг",
+    "хакатон", "фестиваль", "форум", "саммит", "выставка", "презентация", "демо-день", "демодень",
+    "концерт", "шоу", "турнир", "чемпионат", "круглый стол", "дискуссия", "панель", "дебаты",
+    "мастер-класс", "мастеркласс", "event", "meetup", "workshop", "party", "conference", "lecture",
+    "seminar", "training", "hackathon", "festival", "forum", "summit", "exhibition", "presentation",
+    "demo day", "concert", "show", "tournament", "championship", "round table", "discussion",
+    "panel", "debate", "master class", "masterclass",
+]
+
+LEGACY_DATE_PATTERNS = [
+    r"\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b",
+    r"\b\d{4}-\d{2}-\d{2}\b",
+    r"\bсегодня\b",
+    r"\bзавтра\b",
+    r"\bпонедельник|\bвторник|\bсреда|\bчетверг|\bпятница|\bсуббота|\bвоскресенье",
+    r"\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)",
+]
+
+
+def legacy_quick_check(text: str) -> bool:
+    lower = text.lower()
+    if any(k in lower for k in LEGACY_KEYWORDS):
+        return True
+    if any(re.search(pat, lower) for pat in LEGACY_DATE_PATTERNS):
+        return True
+    return False
+
+
+FILLER = (
+    "разбираем новую модель для генерации кода и делимся результатами тестов "
+    "подписывайтесь на канал чтобы не пропустить обзор проекта и интервью с командой "
+    "в статье рассказали как мы ускорили обучение в три раза на тех же видеокартах "
+    "new release brings faster inference better docs and a redesigned api"
+).split()
+EVENT_PHRASES = [
+    "приглашаем на митап 15 марта",
+    "в субботу пройдёт мастер-класс по рисованию",
+    "join our workshop next week",
+    "регистрация на конференцию открыта",
+    "круглый стол о карьере в IT",
+]
+# Слова, на которых поиск подстрок срабатывает ложно
+DECOY_PHRASES = [
+    "showcase нового продукта",
+    "открыли шоурум партнёров",
+    "самопрезентация для резюме",
+    "eventually it works",
+]
+
+
+def _synthetic_corpus(size: int, seed: int = 42) -> List[str]:
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = rnd.choices(FILLER, k=rnd.randint(20, 150))
+        roll = rnd.random()
+        if roll < 0.2:
+            words.insert(rnd.randrange(len(words)), rnd.choice(EVENT_PHRASES))
+        elif roll < 0.3:
+            words.insert(rnd.randrange(len(words)), rnd.choice(DECOY_PHRASES))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def _db_corpus(path: str) -> List[str]:
+    if not path or not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT post_text FROM processed_posts WHERE post_text IS NOT NULL").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def _timed(check, corpus: List[str]) -> float:
+    started = time.perf_counter()
+    for text in corpus:
+        check(text)
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=50000, help="размер синтетического корпуса")
+    parser.add_argument("--db", default=os.getenv("DATABASE_PATH", "database.db"))
+    args = parser.parse_args()
+
+    corpus = _db_corpus(args.db) + _synthetic_corpus(args.posts)
+    total_chars = sum(len(t) for t in corpus)
+
+    legacy = _timed(legacy_quick_check, corpus)
+    compiled = _timed(quick_check, corpus)
+    legacy_hits = sum(legacy_quick_check(t) for t in corpus)
+    compiled_hits = sum(quick_check(t) for t in corpus)
+    only_legacy = [t for t in corpus if legacy_quick_check(t) and not quick_check(t)]
+
+    print(f"Постов: {len(corpus)}, символов: {total_chars}")
+    print(f"  прежний quick_check:  {legacy:6.3f} с ({legacy / len(corpus) * 1e6:6.1f} мкс/пост), прошло {legacy_hits}")
+    print(f"  скомпилированный:     {compiled:6.3f} с ({compiled / len(corpus) * 1e6:6.1f} мкс/пост), прошло {compiled_hits}")
+    print(f"  ускорение:            {legacy / compiled:6.2f}x")
+    print(f"  отсеяно ложных срабатываний подстрок: {len(only_legacy)}")
+    if only_legacy:
+        sample = only_legacy[0]
+        substrings = [k for k in LEGACY_KEYWORDS if k in sample.lower()]
+        print(f"  пример: подстроки {substrings}, правила нового матчера {match_rules(sample)}")
+
+
+if __name__ == "__main__":
+    main()
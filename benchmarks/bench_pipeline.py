@@ -0,0 +1,214 @@
+"""Сквозной бенчмарк конвейера: опрос каналов → проверка → рассылка без сети.
+
+Telethon, polza.ai и бот заменены локальными подделками (benchmarks/fakes.py,
+benchmarks/llm_stub.py), всё остальное — настоящий код сервиса: ChannelPoller,
+process_channel, Pipeline, SQLite. Отчёт: посты в секунду, p50/p99 по стадиям
+и память; --json сохраняет итоги для сравнения между запусками.
+
+Запуск: python benchmarks/bench_pipeline.py --channels 200 --posts 100 --llm-latency-ms 800
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.fakes import FakeBot, FakeTelethonClient  # noqa: E402
+from benchmarks import llm_stub  # noqa: E402
+
+
+def _configure_env(args: argparse.Namespace, base_url: str, db_path: str) -> None:
+    os.environ.update({
+        "DATABASE_PATH": db_path,
+        "POLZA_API_BASE": base_url,
+        "POLZA_AI_API_KEY": "stub",
+        "LLM_MAX_CONCURRENCY": str(args.llm_concurrency),
+        "LLM_MAX_RETRIES": str(args.llm_retries),
+        "LLM_BATCH_MODE": "1" if args.batch_mode else "0",
+        "LLM_STREAMING": "1" if args.streaming else "0",
+        # Быстрая модель каскада отвечает той же заглушкой
+        "LLM_CASCADE_MODEL": "stub-small" if args.cascade else "",
+        "LLM_CACHE_ENABLED": "1" if args.cache else "0",
+        "SCORING_ENABLED": "1" if args.gate else "0",
+        # Лимиты Telegram в бенчмарке не интересны — измеряем сам конвейер
+        "TELEGRAM_REQUESTS_PER_MINUTE": "1000000",
+        "TELEGRAM_REQUESTS_BURST": "1000000",
+        "BROADCAST_MESSAGES_PER_SECOND": str(args.send_rate),
+        "BROADCAST_PER_CHAT_PER_SECOND": str(args.send_rate),
+        "PIPELINE_CLASSIFY_WORKERS": str(args.classify_workers),
+        "PIPELINE_DELIVERY_WORKERS": str(args.delivery_workers),
+    })
+
+
+async def _drain(pipeline_backlog, timeout: float) -> bool:
+    """Дождаться, пока все очереди конвейера опустеют"""
+    from database.db import run_db
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        backlog = await run_db(pipeline_backlog)
+        if not any(backlog.values()):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from database.db import init_db, close_db, add_bot_user, get_pipeline_backlog, WriteBatch
+    from detectors.second_pass import close_llm_client
+    from monitoring import metrics
+    from pipeline.stages import Pipeline
+    import main as service
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    init_db()
+    for chat_id in range(1, args.users + 1):
+        add_bot_user(chat_id)
+
+    client = FakeTelethonClient(latency=args.fetch_latency_ms / 1000)
+    if args.replay:
+        client.load_replay(args.replay)
+    else:
+        channels = [f"bench_channel_{i}" for i in range(args.channels)]
+        client.add_synthetic(channels, args.posts)
+    channels = list(client.channels)
+    # Курсор 0: читаем всю историю каналов, а не только последние 10 постов
+    batch = WriteBatch()
+    for channel in channels:
+        batch.set_cursor(channel, 0)
+    batch.flush()
+
+    bot = FakeBot(latency=args.send_latency_ms / 1000)
+    pipeline = Pipeline(bot)
+    await pipeline.start()
+    poller = service.ChannelPoller(client, pipeline, args.concurrency)
+
+    total_posts = sum(len(messages) for messages in client.channels.values())
+    started = time.perf_counter()
+    for cycle in range(args.cycles):
+        if cycle:
+            for channel in channels:
+                client.publish(channel, args.new_per_cycle)
+            total_posts += args.new_per_cycle * len(channels)
+        cycle_started = time.perf_counter()
+        await poller.run_cycle(channels)
+        metrics.CYCLE_SECONDS.observe(time.perf_counter() - cycle_started)
+    ingested = time.perf_counter() - started
+    drained = await _drain(get_pipeline_backlog, args.timeout)
+    elapsed = time.perf_counter() - started
+
+    await pipeline.stop()
+    await close_llm_client()
+    close_db()
+
+    stages = {
+        "fetch": metrics.FETCH_SECONDS,
+        "first_pass": metrics.FIRST_PASS_SECONDS,
+        "llm": metrics.LLM_SECONDS,
+        "db": metrics.DB_SECONDS,
+        "send": metrics.SEND_SECONDS,
+    }
+    report: Dict[str, Any] = {
+        "posts": total_posts,
+        "channels": len(channels),
+        "elapsed_seconds": round(elapsed, 3),
+        "ingest_seconds": round(ingested, 3),
+        "posts_per_second": round(total_posts / elapsed, 1),
+        "drained": drained,
+        "sends": bot.sent,
+        "outcomes": {k[0]: int(v) for k, v in metrics.POSTS_CLASSIFIED.items().items()},
+        "llm_requests": {"/".join(k): int(v) for k, v in metrics.LLM_REQUESTS.items().items()},
+        "stages": {},
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    for name, histogram in stages.items():
+        _, total, count = histogram.merged()
+        p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+        report["stages"][name] = {
+            "count": count,
+            "total_seconds": round(total, 3),
+            "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+        }
+    if tracemalloc.is_tracing():
+        report["python_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    return report
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"Каналов: {report['channels']}, постов: {report['posts']}, отправок: {report['sends']}")
+    print(
+        f"  всего {report['elapsed_seconds']:.2f} с (опрос {report['ingest_seconds']:.2f} с), "
+        f"{report['posts_per_second']:.1f} постов/с" + ("" if report["drained"] else "  [очереди не разобраны!]")
+    )
+    print(f"  итоги проверки: {report['outcomes']}")
+    print(f"  запросы к LLM: {report['llm_requests']}")
+    print(f"  {'стадия':<11}{'число':>9}{'сумма, с':>11}{'p50, мс':>11}{'p99, мс':>11}")
+    for name, stage in report["stages"].items():
+        p50 = f"{stage['p50_ms']:.2f}" if stage["p50_ms"] is not None else "-"
+        p99 = f"{stage['p99_ms']:.2f}" if stage["p99_ms"] is not None else "-"
+        print(f"  {name:<11}{stage['count']:>9}{stage['total_seconds']:>11.2f}{p50:>11}{p99:>11}")
+    memory = f"  память: max RSS {report['max_rss_mb']} МБ"
+    if "python_peak_mb" in report:
+        memory += f", пик Python-объектов {report['python_peak_mb']} МБ"
+    print(memory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=100, help="постов в истории каждого канала")
+    parser.add_argument("--replay", help="JSONL с записанными постами вместо синтетических")
+    parser.add_argument("--cycles", type=int, default=1, help="циклов опроса")
+    parser.add_argument("--new-per-cycle", type=int, default=5, help="новых постов на канал между циклами")
+    parser.add_argument("--users", type=int, default=3, help="получателей рассылки")
+    parser.add_argument("--concurrency", type=int, default=4, help="MAX_CONCURRENT_CHANNELS")
+    parser.add_argument("--classify-workers", type=int, default=2)
+    parser.add_argument("--delivery-workers", type=int, default=4)
+    parser.add_argument("--fetch-latency-ms", type=float, default=50, help="задержка Telethon на страницу")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--llm-retries", type=int, default=2)
+    parser.add_argument("--send-latency-ms", type=float, default=30)
+    parser.add_argument("--send-rate", type=float, default=1000, help="лимит отправок в секунду")
+    parser.add_argument("--batch-mode", action="store_true", help="LLM_BATCH_MODE=1")
+    parser.add_argument("--streaming", action="store_true", help="LLM_STREAMING=1")
+    parser.add_argument("--cascade", action="store_true", help="каскад: быстрая модель перед основной")
+    parser.add_argument("--gate", action="store_true", help="включить модель-фильтр (если обучена)")
+    parser.add_argument("--cache", action="store_true", help="включить кэш LLM")
+    parser.add_argument("--timeout", type=float, default=3600, help="сколько ждать разбора очередей, с")
+    parser.add_argument("--tracemalloc", action="store_true", help="замерить пик памяти Python (медленнее)")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    stub, base_url = llm_stub.start_in_process(
+        args.llm_latency_ms / 1000, args.llm_jitter_ms / 1000, args.llm_error_rate
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _configure_env(args, base_url, str(Path(tmp) / "bench.db"))
+            if args.tracemalloc:
+                tracemalloc.start()
+            report = asyncio.run(run(args))
+    finally:
+        stub.terminate()
+
+    _print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Подмены внешних сервисов для бенчмарков: Telethon-клиент и Bot без сети."""
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+FILLER = (
+    "разбираем новую модель для генерации кода и делимся результатами тестов "
+    "подписывайтесь на канал чтобы не пропустить обзор проекта и интервью с командой "
+    "в статье рассказали как мы ускорили обучение в три раза на тех же видеокартах "
+    "new release brings faster inference better docs and a redesigned api"
+).split()
+EVENT_PHRASES = [
+    "приглашаем на митап 15 марта, регистрация по ссылке",
+    "в субботу пройдёт мастер-класс по рисованию, регистрация открыта",
+    "join our workshop next week, registration is open",
+    "приглашаем на конференцию, регистрация на сайте",
+    "круглый стол о карьере в IT, приглашаем всех",
+]
+_SYLLABLES = ["ка", "ро", "ми", "ну", "ли", "та", "зе", "во", "пра", "сто", "ген", "лор", "дим", "шу"]
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    message: str
+    date: datetime
+
+
+def synthetic_text(rnd: random.Random, event_share: float = 0.2) -> str:
+    """Пост из общего словаря и случайных слов (чтобы посты не были почти-дубликатами)"""
+    words = [
+        rnd.choice(FILLER) if rnd.random() < 0.6 else "".join(rnd.choices(_SYLLABLES, k=rnd.randint(2, 4)))
+        for _ in range(rnd.randint(20, 150))
+    ]
+    if rnd.random() < event_share:
+        words.insert(rnd.randrange(len(words)), rnd.choice(EVENT_PHRASES))
+    return " ".join(words)
+
+
+class FakeTelethonClient:
+    """Подмена TelegramClient: каналы с синтетическими или записанными сообщениями.
+
+    Поддерживает ровно то, что использует tg_client.reader: iter_messages
+    (последние limit сообщений или все после min_id по возрастанию) и
+    add_event_handler. Задержка ответа имитирует сетевой запрос за страницу.
+    """
+
+    def __init__(self, latency: float = 0.0, seed: int = 7):
+        self.latency = latency
+        self.channels: Dict[str, List[FakeMessage]] = {}
+        self._rnd = random.Random(seed)
+
+    def add_synthetic(self, channels: List[str], posts_per_channel: int, event_share: float = 0.2) -> None:
+        for channel in channels:
+            self.publish(channel, posts_per_channel, event_share)
+
+    def publish(self, channel: str, count: int, event_share: float = 0.2) -> None:
+        """Добавить в канал `count` новых постов"""
+        messages = self.channels.setdefault(channel, [])
+        next_id = messages[-1].id + 1 if messages else 1
+        now = datetime.now(timezone.utc)
+        for i in range(count):
+            date = now - timedelta(seconds=count - i)
+            messages.append(FakeMessage(next_id + i, synthetic_text(self._rnd, event_share), date))
+
+    def load_replay(self, path: str) -> None:
+        """Загрузить записанные посты: JSONL со строками {"channel", "id", "text", "date"}"""
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                date = datetime.fromisoformat(item["date"]) if item.get("date") else datetime.now(timezone.utc)
+                self.channels.setdefault(item["channel"], []).append(FakeMessage(int(item["id"]), item["text"], date))
+        for messages in self.channels.values():
+            messages.sort(key=lambda m: m.id)
+
+    async def iter_messages(
+        self,
+        channel: str,
+        limit: Optional[int] = None,
+        min_id: Optional[int] = None,
+        reverse: bool = False,
+    ):
+        messages = self.channels.get(channel, [])
+        if min_id is not None:
+            messages = [m for m in messages if m.id > min_id]
+        messages = messages if reverse else list(reversed(messages))
+        if limit is not None:
+            messages = messages[:limit]
+        for index, message in enumerate(messages):
+            # Telethon запрашивает историю страницами по 100 сообщений
+            if index % 100 == 0 and self.latency:
+                await asyncio.sleep(self.latency)
+            yield message
+
+    def add_event_handler(self, callback, event) -> None:
+        pass
+
+
+class FakeBot:
+    """Подмена telegram.Bot: запоминает отправленные сообщения"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+        self.recipients: Dict[int, int] = {}
+
+    async def send_message(self, chat_id, text: str, **kwargs) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        self.recipients[chat_id] = self.recipients.get(chat_id, 0) + 1
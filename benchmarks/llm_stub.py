@@ -0,0 +1,221 @@
+"""Локальная заглушка OpenAI-совместимого API (POST /chat/completions).
+
+Отвечает с настраиваемой задержкой и долей ошибок; вердикт выносит по ключевым
+словам в тексте поста, поддерживает одиночный, пакетный промпт и промпт каскада. При stream=true
+отвечает потоком SSE, как рассуждающая модель: сначала <think>...</think>, затем JSON,
+задержка распределяется по фрагментам.
+
+Отдельный запуск (например, для ручной проверки сервиса без polza.ai):
+    python benchmarks/llm_stub.py --port 8089 --latency-ms 800 --error-rate 0.05
+    POLZA_API_BASE=http://127.0.0.1:8089/v1 python main.py
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+EVENT_MARKERS = ("регистрац", "приглаша", "registration", "workshop", "мастер-класс", "митап")
+
+_BATCH_ITEM_RE = re.compile(r"### id: (\d+)\n(.*?)(?=\n\n### id: |\n\nВАЖНО|\Z)", re.DOTALL)
+
+
+def _verdict(text: str) -> Dict[str, Any]:
+    lower = text.lower()
+    if any(marker in lower for marker in EVENT_MARKERS):
+        return {
+            "is_event": True,
+            "title": " ".join(text.split()[:6]),
+            "date": "15 марта",
+            "place": None,
+            "link": None,
+            "description": text[:120],
+        }
+    return {"is_event": False, "title": None, "date": None, "place": None, "link": None, "description": None}
+
+
+def _triage(text: str) -> Dict[str, Any]:
+    # Быстрая модель каскада: без маркеров, но с цифрами (похоже на дату) — не уверена
+    is_event = _verdict(text)["is_event"]
+    unsure = not is_event and any(char.isdigit() for char in text)
+    return {"is_event": is_event, "confidence": 0.6 if unsure else 0.95}
+
+
+def answer(prompt: str) -> str:
+    items = _BATCH_ITEM_RE.findall(prompt)
+    if items:
+        return json.dumps([{"id": int(i), **_verdict(text)} for i, text in items], ensure_ascii=False)
+    match = re.search(r"Текст: (.*?)\n\n(?:ВАЖНО|Оцени)", prompt, re.DOTALL)
+    text = match.group(1) if match else prompt
+    if '"confidence"' in prompt:
+        return json.dumps(_triage(text), ensure_ascii=False)
+    return json.dumps(_verdict(text), ensure_ascii=False)
+
+
+REASONING = "<think>Нужно понять, анонсирует ли пост будущее мероприятие, и извлечь поля.</think>"
+
+
+def stream_pieces(content: str, size: int = 4) -> List[str]:
+    """Ответ, нарезанный на фрагменты потока (примерно по токену)"""
+    text = REASONING + content
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class StubServer:
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int = 1, reject_schema: bool = False):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reject_schema = reject_schema
+        self._rnd = random.Random(seed)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value.strip())
+        body = await reader.readexactly(length) if length else b""
+        return request_line.decode("latin-1"), body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Клиент openai держит соединения открытыми, поэтому обслуживаем запросы в цикле
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                _, body = request
+                payload = json.loads(body or b"{}")
+                delay = max(0.0, self._rnd.gauss(self.latency, self.jitter))
+                if self.reject_schema and "response_format" in payload:
+                    await self._respond(writer, "400 Bad Request", {"error": {"message": "response_format unsupported"}})
+                elif self._rnd.random() < self.error_rate:
+                    await asyncio.sleep(delay)
+                    await self._respond(writer, "500 Internal Server Error", {"error": {"message": "stub error"}})
+                elif payload.get("stream"):
+                    await self._stream(writer, payload, delay)
+                else:
+                    await asyncio.sleep(delay)
+                    await self._respond(writer, "200 OK", self._completion(payload))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: str, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def _stream(self, writer: asyncio.StreamWriter, request: Dict[str, Any], delay: float) -> None:
+        # SSE поверх chunked: соединение остаётся открытым для следующих запросов
+        prompt, content = self._prompt_and_answer(request)
+        pieces = stream_pieces(content)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+        events = [
+            {"choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}]}
+            for piece in pieces
+        ]
+        events[-1]["choices"][0]["finish_reason"] = "stop"
+        if (request.get("stream_options") or {}).get("include_usage"):
+            events.append({"choices": [], "usage": self._usage(prompt, content)})
+        for event in events:
+            await asyncio.sleep(delay / len(pieces))
+            event.update({"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub"})
+            self._write_chunk(writer, b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            # Клиент, закрывший соединение после вердикта, прерывает генерацию здесь
+            await writer.drain()
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+
+    @staticmethod
+    def _prompt_and_answer(request: Dict[str, Any]) -> Tuple[str, str]:
+        messages: List[Dict[str, str]] = request.get("messages") or [{"content": ""}]
+        prompt = messages[-1].get("content", "")
+        return prompt, answer(prompt)
+
+    @staticmethod
+    def _usage(prompt: str, content: str) -> Dict[str, int]:
+        prompt_tokens, completion_tokens = len(prompt) // 3 + 1, len(content) // 3 + 1
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        prompt, content = self._prompt_and_answer(request)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": self._usage(prompt, content),
+        }
+
+
+async def serve(
+    host: str, port: int, latency: float, jitter: float, error_rate: float, ready=None, reject_schema: bool = False
+) -> None:
+    stub = StubServer(latency, jitter, error_rate, reject_schema=reject_schema)
+    server = await asyncio.start_server(stub.handle, host, port)
+    if ready is not None:
+        ready.put(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+def _run(host: str, port: int, latency: float, jitter: float, error_rate: float, ready) -> None:
+    asyncio.run(serve(host, port, latency, jitter, error_rate, ready))
+
+
+def start_in_process(latency: float, jitter: float, error_rate: float) -> Tuple[multiprocessing.Process, str]:
+    """Запустить заглушку в отдельном процессе (не делит GIL с измеряемым кодом); вернуть процесс и base_url"""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_run, args=("127.0.0.1", 0, latency, jitter, error_rate, ready), daemon=True
+    )
+    process.start()
+    port = ready.get(timeout=10)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-schema", action="store_true", help="отвечать 400 на response_format")
+    args = parser.parse_args()
+    print(f"Заглушка LLM: http://{args.host}:{args.port}/v1")
+    asyncio.run(serve(
+        args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate,
+        reject_schema=args.reject_schema,
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,29 @@ import os
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from database.db import get_last_events, add_bot_user
+from typing import Optional
+
+from database.db import get_events_page, get_upcoming_events, get_event, add_bot_user, run_db
+from detectors.dates import local_now
 from processors.formatter import format_event_message
 
 logger = logging.getLogger(__name__)
 
+# Событий на одной странице списка
+PAGE_SIZE = 5
+
+START_KEYBOARD = [
+    [InlineKeyboardButton("📋 Посмотреть посты", callback_data="list_posts")],
+    [InlineKeyboardButton("📅 Ближайшие мероприятия", callback_data="upcoming_events")],
+]
+
+# callback_data содержит id событий, а не позиции в списке, поэтому новое событие,
+# пришедшее между нажатиями, не сдвигает то, что видит пользователь:
+#   events_before_{id} — страница событий старше id, events_after_{id} — новее id,
+#   event_{id}_{top}   — событие id; «Назад» ведёт на страницу events_before_{top};
+#   upcoming_{id}      — предстоящие события после события id (по дате проведения),
+#   event_{id}_u       — событие из списка предстоящих, «Назад» ведёт к его началу.
+
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
@@ -14,85 +32,128 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     chat_id = update.effective_chat.id
     username = update.effective_user.username
     first_name = update.effective_user.first_name
-    add_bot_user(chat_id, username, first_name)
+    await run_db(add_bot_user, chat_id, username, first_name)
     logger.info(f"Пользователь добавлен/обновлен: chat_id={chat_id}, username={username}")
     
-    keyboard = [[InlineKeyboardButton("📋 Посмотреть посты", callback_data="list_posts")]]
+    keyboard = START_KEYBOARD
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await update.message.reply_text(
         "Йоу, блять! Я тот самый бот, который мониторит кучу Telegram каналов и ищет там мероприятия.\n\n"
         "🔔 Больше делать ничего не надо - уведомления о новых мероприятиях будут приходить сами!\n\n"
-        "📋 А по кнопке ниже можешь посмотреть последние 5 постов.\n\n"
+        "📋 А по кнопке ниже можешь полистать найденные мероприятия.\n\n"
         "Выбери действие:",
         reply_markup=reply_markup
     )
 
 
+async def _show_events_page(query, before_id: Optional[int] = None, after_id: Optional[int] = None) -> None:
+    events, has_older, has_newer = await run_db(get_events_page, before_id=before_id, after_id=after_id, limit=PAGE_SIZE)
+
+    if not events:
+        if before_id is None and after_id is None:
+            await query.edit_message_text("Пока нет сохраненных событий.")
+        else:
+            # Страница опустела (например, старые события удалены) — показываем самые новые
+            await _show_events_page(query)
+        return
+
+    # Верхняя граница страницы: по ней «Назад» из карточки события вернёт на эту же страницу
+    top = events[0]["id"] + 1
+    buttons = []
+    for event in events:
+        # Ограничиваем длину названия для кнопки (макс 60 символов)
+        title = event["title"][:57] + "..." if len(event["title"]) > 60 else event["title"]
+        buttons.append([InlineKeyboardButton(title, callback_data=f"event_{event['id']}_{top}")])
+
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"events_after_{events[0]['id']}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton("Старее ➡️", callback_data=f"events_before_{events[-1]['id']}"))
+    if navigation:
+        buttons.append(navigation)
+
+    # Добавляем кнопку "Назад"
+    buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")])
+
+    keyboard = InlineKeyboardMarkup(buttons)
+    await query.edit_message_text("Выбери мероприятие:", reply_markup=keyboard)
+
+
+async def _show_upcoming_events(query, after_id: Optional[int] = None) -> None:
+    # Предстоящие — с начала сегодняшнего дня: у события без времени event_at приходится на полночь
+    since = local_now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat(timespec="minutes")
+    events, has_more = await run_db(get_upcoming_events, since, after_id=after_id, limit=PAGE_SIZE)
+
+    if not events:
+        if after_id is None:
+            back = InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")]])
+            await query.edit_message_text("Пока нет предстоящих мероприятий с известной датой.", reply_markup=back)
+        else:
+            await _show_upcoming_events(query)
+        return
+
+    buttons = []
+    for event in events:
+        day = event["event_at"][8:10] + "." + event["event_at"][5:7]
+        title = f"{day} · {event['title']}"
+        title = title[:57] + "..." if len(title) > 60 else title
+        buttons.append([InlineKeyboardButton(title, callback_data=f"event_{event['id']}_u")])
+    if has_more:
+        buttons.append([InlineKeyboardButton("Дальше ➡️", callback_data=f"upcoming_{events[-1]['id']}")])
+    buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")])
+
+    await query.edit_message_text("Ближайшие мероприятия:", reply_markup=InlineKeyboardMarkup(buttons))
+
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на кнопки"""
     query = update.callback_query
     await query.answer()
-    
-    if query.data == "list_posts":
-        # Получаем последние 5 событий
-        events = get_last_events(limit=5)
-        
-        if not events:
-            await query.edit_message_text("Пока нет сохраненных событий.")
-            return
-        
-        # Создаем кнопки с постами (используем индекс в списке)
-        buttons = []
-        for i, event in enumerate(events):
-            # Ограничиваем длину названия для кнопки (макс 60 символов)
-            title = event["title"][:57] + "..." if len(event["title"]) > 60 else event["title"]
-            buttons.append([InlineKeyboardButton(
-                f"{i+1}. {title}",
-                callback_data=f"show_post_{i}"
-            )])
-        
-        # Добавляем кнопку "Назад"
-        buttons.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")])
-        
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.edit_message_text(
-            f"Выбери пост ({len(events)} доступно):",
-            reply_markup=keyboard
-        )
-    
-    elif query.data.startswith("show_post_"):
-        try:
-            # Получаем индекс из callback_data
-            index = int(query.data.split("_")[-1])
-            
-            # Получаем события из БД заново (чтобы гарантировать актуальность)
-            events = get_last_events(limit=5)
-            
-            if 0 <= index < len(events):
-                event = events[index]
-                # Формируем ссылку и сообщение
-                source_link = f"https://t.me/{event['channel']}/{event['post_id']}"
-                message = format_event_message(event["data"], source_link)
-                
-                # Добавляем кнопку "Назад" к сообщению
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Назад", callback_data="list_posts")]])
-                await query.edit_message_text(message, disable_web_page_preview=True, reply_markup=keyboard)
-            else:
-                await query.edit_message_text("Пост не найден.")
-        except (ValueError, IndexError, KeyError) as e:
-            logger.error(f"Ошибка парсинга callback_data: {query.data}, {e}")
-            await query.edit_message_text("Ошибка: неверный формат данных")
-    
-    elif query.data == "back_to_start":
-        # Возвращаемся к начальному экрану
-        keyboard = [[InlineKeyboardButton("📋 Посмотреть посты", callback_data="list_posts")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "Йоу, блять! Я тот самый бот, который мониторит кучу Telegram каналов и ищет там мероприятия.\n\n"
-            "Выбери действие:",
-            reply_markup=reply_markup
-        )
+
+    try:
+        if query.data == "list_posts" or query.data.startswith("show_post_"):
+            # show_post_ — кнопки из сообщений старых версий бота: открываем первую страницу
+            await _show_events_page(query)
+
+        elif query.data.startswith("events_before_"):
+            await _show_events_page(query, before_id=int(query.data.rsplit("_", 1)[-1]))
+
+        elif query.data.startswith("events_after_"):
+            await _show_events_page(query, after_id=int(query.data.rsplit("_", 1)[-1]))
+
+        elif query.data == "upcoming_events":
+            await _show_upcoming_events(query)
+
+        elif query.data.startswith("upcoming_"):
+            await _show_upcoming_events(query, after_id=int(query.data.rsplit("_", 1)[-1]))
+
+        elif query.data.startswith("event_"):
+            _, event_id, top = query.data.split("_")
+            event = await run_db(get_event, int(event_id))
+            back_to = "upcoming_events" if top == "u" else f"events_before_{int(top)}"
+            back = InlineKeyboardMarkup([[InlineKeyboardButton("◀️ Назад", callback_data=back_to)]])
+            if event is None:
+                await query.edit_message_text("Пост не найден.", reply_markup=back)
+                return
+            # Формируем ссылку и сообщение
+            source_link = f"https://t.me/{event['channel']}/{event['post_id']}"
+            message = format_event_message(event["data"], source_link)
+            await query.edit_message_text(message, disable_web_page_preview=True, reply_markup=back)
+
+        elif query.data == "back_to_start":
+            # Возвращаемся к начальному экрану
+            keyboard = START_KEYBOARD
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text(
+                "Йоу, блять! Я тот самый бот, который мониторит кучу Telegram каналов и ищет там мероприятия.\n\n"
+                "Выбери действие:",
+                reply_markup=reply_markup
+            )
+    except ValueError as e:
+        logger.error(f"Ошибка парсинга callback_data: {query.data}, {e}")
+        await query.edit_message_text("Ошибка: неверный формат данных")
 
 
 def setup_bot_handlers(application: Application) -> None:
@@ -1,7 +1,30 @@
+import asyncio
 import os
 import sqlite3
 import json
-from typing import Optional, Any, Dict, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Any, Dict, List, Callable, TypeVar, Tuple
+
+from monitoring.metrics import DB_SECONDS
+
+T = TypeVar("T")
+
+# Одно долгоживущее соединение на поток (поток event loop, поток бота, поток БД).
+# В режиме WAL читатели не блокируют писателя, а busy_timeout сглаживает
+# редкие конфликты записи между потоками.
+_local = threading.local()
+_executor: Optional[ThreadPoolExecutor] = None
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
 
 
 def _db_path() -> str:
@@ -9,11 +32,64 @@ def _db_path() -> str:
 
 
 def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(_db_path())
+    """Соединение текущего потока (создаётся один раз и переиспользуется)"""
+    path = _db_path()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path:
+        return conn
+    if conn is not None:
+        conn.close()
+    # cached_statements — кэш подготовленных выражений sqlite3
+    conn = sqlite3.connect(path, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _local.conn = conn
+    _local.path = path
     return conn
 
 
+def close_db() -> None:
+    """Закрыть соединение текущего потока и поток БД"""
+    global _executor
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+    if _executor is not None:
+        _executor.submit(_close_thread_connection).result()
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _close_thread_connection() -> None:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Выполнить синхронную функцию БД в отдельном потоке, не блокируя event loop.
+
+    Все вызовы идут через один поток, поэтому записи из event loop не конкурируют
+    друг с другом за блокировку SQLite.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(_timed_call, func, *args, **kwargs))
+
+
+def _timed_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, op=getattr(func, "__qualname__", "other"))
+
+
 def init_db() -> None:
     conn = get_db()
     cur = conn.cursor()
@@ -50,102 +126,1005 @@ def init_db() -> None:
         );
         """
     )
+    # Кэш результатов LLM (ключ — хэш нормализованного текста, промпта и модели)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        """
+    )
+    # Курсор канала: последний обработанный id сообщения (дальше читаем только новые)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_cursors (
+            channel_username TEXT PRIMARY KEY,
+            last_post_id INTEGER NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    # Каналы, обработанные до появления курсоров, продолжают с последнего сохранённого поста
+    cur.execute(
+        """
+        INSERT OR IGNORE INTO channel_cursors (channel_username, last_post_id)
+        SELECT channel_username, MAX(post_id) FROM processed_posts GROUP BY channel_username
+        """
+    )
+    # Стадия поста в конвейере: fetched (ждёт проверки) → classifying (взят в работу) → done.
+    # Посты, сохранённые до появления конвейера, считаются обработанными.
+    _ensure_column(cur, "processed_posts", "stage", "TEXT NOT NULL DEFAULT 'done'")
+    # Когда пост взят в проверку: зависшие взятия (воркер упал посреди пачки) возвращаются в очередь
+    _ensure_column(cur, "processed_posts", "claimed_at", "REAL")
+    # Неудачные проверки (LLM недоступна): пост ждёт в fetched до next_classify_at
+    _ensure_column(cur, "processed_posts", "classify_attempts", "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(cur, "processed_posts", "next_classify_at", "REAL NOT NULL DEFAULT 0")
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_processed_posts_stage
+        ON processed_posts(stage, id) WHERE stage != 'done';
+        """
+    )
+    # Исходящие сообщения: по строке на получателя, доставка с повторами переживает перезапуск
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_username TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            chat_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(channel_username, post_id, chat_id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_deliveries_due
+        ON deliveries(status, next_attempt_at);
+        """
+    )
+    # Разосланные события с разобранными полями — для просмотра в боте без разбора JSON
+    events_existed = _table_exists(cur, "events")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_username TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            title TEXT,
+            event_date TEXT,
+            place TEXT,
+            link TEXT,
+            description TEXT,
+            post_date TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(channel_username, post_id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_events_created_at
+        ON events(created_at);
+        """
+    )
+    # Начало события в локальном времени (ISO, без пояса) — для сортировки и отбора предстоящих
+    _ensure_column(cur, "events", "event_at", "TEXT")
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_events_event_at
+        ON events(event_at);
+        """
+    )
+    # Расписание адаптивного опроса: оценка частоты постов (в час), текущий интервал,
+    # время следующего опроса и счётчик ошибок подряд (для отступа)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_schedule (
+            channel_username TEXT PRIMARY KEY,
+            rate REAL,
+            interval REAL,
+            next_poll_at REAL,
+            last_poll_at REAL,
+            last_post_at REAL,
+            errors INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    # id и access_hash каналов для каждого аккаунта Telethon: по ним каналы читаются
+    # без ResolveUsernameRequest. status: ok, renamed (username сменился), missing (канал
+    # удалён, стал приватным или username не существует)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_entities (
+            session_name TEXT NOT NULL,
+            channel_username TEXT NOT NULL,
+            channel_id INTEGER,
+            access_hash INTEGER,
+            title TEXT,
+            current_username TEXT,
+            status TEXT NOT NULL DEFAULT 'ok',
+            note TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_name, channel_username)
+        );
+        """
+    )
+    # Шардирование каналов между процессами: аренда канала воркером (продлевается
+    # пульсом), живые воркеры со счётчиками и аренда роли ведущего (бот и рассылка)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_leases (
+            channel_username TEXT PRIMARY KEY,
+            worker_id TEXT NOT NULL,
+            acquired_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shard_workers (
+            worker_id TEXT PRIMARY KEY,
+            session_name TEXT,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            polls INTEGER NOT NULL DEFAULT 0,
+            posts_fetched INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shard_leader (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            worker_id TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """
+    )
+    if not events_existed:
+        # Переносим события, разосланные до появления таблицы, в порядке обработки
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO events (
+                channel_username, post_id, title, event_date, place, link, description, post_date, created_at
+            )
+            SELECT channel_username, post_id,
+                NULLIF(json_extract(extracted_data, '$.title'), ''),
+                NULLIF(json_extract(extracted_data, '$.date'), ''),
+                NULLIF(json_extract(extracted_data, '$.place'), ''),
+                NULLIF(json_extract(extracted_data, '$.link'), ''),
+                NULLIF(json_extract(extracted_data, '$.description'), ''),
+                post_date, processed_at
+            FROM processed_posts
+            WHERE is_event = 1 AND sent_to_bot = 1 AND json_valid(extracted_data)
+            ORDER BY processed_at, id
+            """
+        )
+        cur.execute(
+            """
+            DELETE FROM events
+            WHERE COALESCE(title, event_date, place, link, description) IS NULL
+            """
+        )
     conn.commit()
-    conn.close()
 
 
-def is_post_processed(channel_username: str, post_id: int) -> bool:
+def _table_exists(cur: sqlite3.Cursor, table: str) -> bool:
+    row = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def _ensure_column(cur: sqlite3.Cursor, table: str, column: str, definition: str) -> None:
+    """Добавить столбец в существующую таблицу, если его ещё нет"""
+    columns = {row["name"] for row in cur.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def get_channel_cursor(channel_username: str) -> Optional[int]:
+    """Последний обработанный id сообщения канала или None для нового канала"""
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        "SELECT 1 FROM processed_posts WHERE channel_username = ? AND post_id = ?",
-        (channel_username, post_id),
+        "SELECT last_post_id FROM channel_cursors WHERE channel_username = ?",
+        (channel_username,),
     )
     row = cur.fetchone()
-    conn.close()
-    return row is not None
+    return row["last_post_id"] if row else None
 
 
-def add_processed_post(
-    channel_username: str,
-    post_id: int,
-    post_date: str,
-    post_text: str,
-    is_event: bool,
-    extracted_data: Optional[Dict[str, Any]] = None,
-) -> None:
+def get_post_state(channel_username: str, post_id: int) -> Optional[sqlite3.Row]:
+    """Вердикт и статус отправки уже обработанного поста (или None)"""
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        """
-        INSERT OR IGNORE INTO processed_posts (
-            channel_username, post_id, post_date, post_text, is_event, extracted_data, sent_to_bot
-        ) VALUES (?, ?, ?, ?, ?, ?, 0)
-        """,
-        (
+        "SELECT is_event, sent_to_bot FROM processed_posts WHERE channel_username = ? AND post_id = ?",
+        (channel_username, post_id),
+    )
+    return cur.fetchone()
+
+
+class WriteBatch:
+    """Накопитель записей за цикл канала: всё сохраняется одной транзакцией в flush()"""
+
+    def __init__(self):
+        self._posts: List[Tuple[Any, ...]] = []
+        self._replaced: List[Tuple[Any, ...]] = []
+        self._sent: List[Tuple[str, int]] = []
+        self._cursors: Dict[str, int] = {}
+        self._staged: List[Tuple[Any, ...]] = []
+        self._restaged: List[Tuple[Any, ...]] = []
+        self._verdicts: List[Tuple[Any, ...]] = []
+        self._retries: List[Tuple[Any, ...]] = []
+        self._deliveries: List[Tuple[Any, ...]] = []
+        self._events: List[Tuple[Any, ...]] = []
+
+    def __len__(self) -> int:
+        return (
+            len(self._posts) + len(self._replaced) + len(self._sent) + len(self._cursors)
+            + len(self._staged) + len(self._restaged) + len(self._verdicts) + len(self._retries)
+            + len(self._deliveries) + len(self._events)
+        )
+
+    def add_processed_post(
+        self,
+        channel_username: str,
+        post_id: int,
+        post_date: str,
+        post_text: str,
+        is_event: bool,
+        extracted_data: Optional[Dict[str, Any]] = None,
+        replace: bool = False,
+    ) -> None:
+        """replace=True перезаписывает уже сохранённый пост (повторная проверка после редактирования)"""
+        row = (
             channel_username,
             post_id,
             post_date,
             post_text,
             1 if is_event else 0,
             json.dumps(extracted_data or {}, ensure_ascii=False),
-        ),
+        )
+        (self._replaced if replace else self._posts).append(row)
+
+    def stage_post(
+        self,
+        channel_username: str,
+        post_id: int,
+        post_date: str,
+        post_text: str,
+        replace: bool = False,
+    ) -> None:
+        """Сохранить полученный пост в очередь на проверку (стадия fetched).
+
+        replace=True сбрасывает прежний вердикт и ставит пост в очередь заново.
+        """
+        row = (channel_username, post_id, post_date, post_text)
+        (self._restaged if replace else self._staged).append(row)
+
+    def set_verdict(
+        self,
+        channel_username: str,
+        post_id: int,
+        is_event: bool,
+        extracted_data: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Записать результат проверки поста из очереди и завершить его обработку"""
+        self._verdicts.append((
+            1 if is_event else 0,
+            json.dumps(extracted_data or {}, ensure_ascii=False),
+            channel_username,
+            post_id,
+        ))
+
+    def retry_verdict(self, channel_username: str, post_id: int, next_attempt_at: float) -> None:
+        """Проверка не удалась: вернуть пост в очередь не раньше next_attempt_at"""
+        self._retries.append((next_attempt_at, channel_username, post_id))
+
+    def enqueue_delivery(self, channel_username: str, post_id: int, chat_ids: List[Any], message: str) -> None:
+        """Поставить сообщение в исходящие: по строке на каждого получателя"""
+        for chat_id in chat_ids:
+            self._deliveries.append((channel_username, post_id, str(chat_id), message))
+        self._sent.append((channel_username, post_id))
+
+    def add_event(self, channel_username: str, post_id: int, post_date: str, extracted_data: Dict[str, Any]) -> None:
+        """Сохранить событие в таблицу events (разосланное или загруженное из истории)"""
+        self._events.append(_event_row(channel_username, post_id, post_date, extracted_data))
+
+    def set_cursor(self, channel_username: str, last_post_id: int) -> None:
+        """Сдвинуть курсор канала (только вперёд) вместе с записями пачки"""
+        self._cursors[channel_username] = max(last_post_id, self._cursors.get(channel_username, last_post_id))
+
+    def flush(self) -> None:
+        if not self:
+            return
+        conn = get_db()
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO processed_posts (
+                    channel_username, post_id, post_date, post_text, is_event, extracted_data, sent_to_bot
+                ) VALUES (?, ?, ?, ?, ?, ?, 0)
+                """,
+                self._posts,
+            )
+            # Перезапись сохраняет id и отметку об отправке: уже разосланный пост не уйдёт повторно
+            conn.executemany(
+                """
+                INSERT INTO processed_posts (
+                    channel_username, post_id, post_date, post_text, is_event, extracted_data, sent_to_bot
+                ) VALUES (?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT(channel_username, post_id) DO UPDATE SET
+                    post_date = excluded.post_date,
+                    post_text = excluded.post_text,
+                    is_event = excluded.is_event,
+                    extracted_data = excluded.extracted_data,
+                    stage = 'done',
+                    claimed_at = NULL,
+                    processed_at = CURRENT_TIMESTAMP
+                """,
+                self._replaced,
+            )
+            conn.executemany(
+                """
+                INSERT INTO channel_cursors (channel_username, last_post_id, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(channel_username) DO UPDATE SET
+                    last_post_id = MAX(last_post_id, excluded.last_post_id),
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                list(self._cursors.items()),
+            )
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO processed_posts (
+                    channel_username, post_id, post_date, post_text, stage
+                ) VALUES (?, ?, ?, ?, 'fetched')
+                """,
+                self._staged,
+            )
+            conn.executemany(
+                """
+                INSERT INTO processed_posts (channel_username, post_id, post_date, post_text, stage)
+                VALUES (?, ?, ?, ?, 'fetched')
+                ON CONFLICT(channel_username, post_id) DO UPDATE SET
+                    post_date = excluded.post_date,
+                    post_text = excluded.post_text,
+                    is_event = 0,
+                    extracted_data = NULL,
+                    sent_to_bot = 0,
+                    stage = 'fetched',
+                    classify_attempts = 0,
+                    next_classify_at = 0
+                """,
+                self._restaged,
+            )
+            conn.executemany(
+                """
+                UPDATE processed_posts
+                SET is_event = ?, extracted_data = ?, stage = 'done', processed_at = CURRENT_TIMESTAMP
+                WHERE channel_username = ? AND post_id = ?
+                """,
+                self._verdicts,
+            )
+            conn.executemany(
+                """
+                UPDATE processed_posts
+                SET stage = 'fetched', claimed_at = NULL, classify_attempts = classify_attempts + 1,
+                    next_classify_at = ?
+                WHERE channel_username = ? AND post_id = ?
+                """,
+                self._retries,
+            )
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO deliveries (channel_username, post_id, chat_id, message)
+                VALUES (?, ?, ?, ?)
+                """,
+                self._deliveries,
+            )
+            # Повторная проверка поста обновляет событие на месте: id (и страницы бота) не меняются
+            conn.executemany(
+                """
+                INSERT INTO events (
+                    channel_username, post_id, title, event_date, place, link, description, post_date, event_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(channel_username, post_id) DO UPDATE SET
+                    title = excluded.title,
+                    event_date = excluded.event_date,
+                    place = excluded.place,
+                    link = excluded.link,
+                    description = excluded.description,
+                    post_date = excluded.post_date,
+                    event_at = excluded.event_at
+                """,
+                self._events,
+            )
+            # Отметка об отправке ставится вместе с постановкой в исходящие
+            conn.executemany(
+                "UPDATE processed_posts SET sent_to_bot = 1 WHERE channel_username = ? AND post_id = ?",
+                self._sent,
+            )
+        self._posts.clear()
+        self._replaced.clear()
+        self._sent.clear()
+        self._cursors.clear()
+        self._staged.clear()
+        self._restaged.clear()
+        self._verdicts.clear()
+        self._retries.clear()
+        self._deliveries.clear()
+        if self._events:
+            _invalidate_events_cache()
+            self._events.clear()
+
+    async def flush_async(self) -> None:
+        if self:
+            await run_db(self.flush)
+
+
+def claim_fetched_posts(limit: int, now: float) -> List[sqlite3.Row]:
+    """Взять в работу до `limit` постов, ожидающих проверки (стадия fetched → classifying).
+
+    Посты после неудачной проверки берутся, когда наступит их next_classify_at.
+    """
+    conn = get_db()
+    with conn:
+        rows = conn.execute(
+            """
+            SELECT id, channel_username, post_id, post_date, post_text, classify_attempts
+            FROM processed_posts
+            WHERE stage = 'fetched' AND next_classify_at <= ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE processed_posts SET stage = 'classifying', claimed_at = ? WHERE id = ?",
+            [(now, row["id"]) for row in rows],
+        )
+    return rows
+
+
+def claim_due_deliveries(limit: int, now: float) -> List[sqlite3.Row]:
+    """Взять в отправку до `limit` исходящих, срок которых наступил (pending → sending)"""
+    conn = get_db()
+    with conn:
+        rows = conn.execute(
+            """
+            SELECT id, channel_username, post_id, chat_id, message, attempts
+            FROM deliveries
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+            """,
+            (now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE deliveries SET status = 'sending', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(row["id"],) for row in rows],
+        )
+    return rows
+
+
+def complete_deliveries(
+    sent: List[int], retry: List[Tuple[int, float, str]], failed: List[Tuple[int, str]]
+) -> List[Dict[str, Any]]:
+    """Итоги попыток отправки: доставлено, повторить в момент next_attempt_at, отказ окончательный.
+
+    Возвращает сводку по постам, рассылка которых на этом завершилась (ни одного
+    исходящего в pending или sending): всего, доставлено, отказов, повторов,
+    длительность от постановки в очередь до последней отправки и недоставленные чаты.
+    """
+    conn = get_db()
+    finished_ids = list(sent) + [delivery_id for delivery_id, _ in failed]
+    with conn:
+        conn.executemany(
+            """
+            UPDATE deliveries SET status = 'sent', attempts = attempts + 1, last_error = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            [(delivery_id,) for delivery_id in sent],
+        )
+        conn.executemany(
+            """
+            UPDATE deliveries SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?,
+                last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            [(next_attempt_at, error, delivery_id) for delivery_id, next_attempt_at, error in retry],
+        )
+        conn.executemany(
+            """
+            UPDATE deliveries SET status = 'failed', attempts = attempts + 1, last_error = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            [(error, delivery_id) for delivery_id, error in failed],
+        )
+        if not finished_ids:
+            return []
+        placeholders = ", ".join("?" * len(finished_ids))
+        rows = conn.execute(
+            f"""
+            SELECT d.channel_username, d.post_id,
+                COUNT(*) AS total,
+                SUM(d.status = 'sent') AS sent,
+                SUM(d.status = 'failed') AS failed,
+                SUM(d.attempts) - COUNT(*) AS retries,
+                (julianday(MAX(d.updated_at)) - julianday(MIN(d.created_at))) * 86400 AS duration,
+                GROUP_CONCAT(CASE WHEN d.status = 'failed' THEN d.chat_id END) AS failed_chats
+            FROM deliveries d
+            JOIN (SELECT DISTINCT channel_username, post_id FROM deliveries WHERE id IN ({placeholders})) p
+                ON p.channel_username = d.channel_username AND p.post_id = d.post_id
+            GROUP BY d.channel_username, d.post_id
+            HAVING SUM(d.status IN ('pending', 'sending')) = 0
+            """,
+            finished_ids,
+        ).fetchall()
+    return [
+        {**dict(row), "failed_chats": row["failed_chats"].split(",") if row["failed_chats"] else []}
+        for row in rows
+    ]
+
+
+def reset_pipeline_claims(older_than_seconds: float = 0) -> Tuple[int, int]:
+    """Вернуть в очереди работу, прерванную остановкой процесса или зависшую.
+
+    Посты в стадии classifying снова ждут проверки, исходящие в статусе sending —
+    отправки (получатель может получить сообщение повторно, но не потеряет его).
+    older_than_seconds > 0 — только взятое в работу раньше, чем столько секунд назад.
+    """
+    conn = get_db()
+    cutoff = time.time() - older_than_seconds
+    with conn:
+        posts = conn.execute(
+            """
+            UPDATE processed_posts SET stage = 'fetched', claimed_at = NULL
+            WHERE stage = 'classifying' AND (claimed_at IS NULL OR claimed_at <= ?)
+            """,
+            (cutoff,),
+        ).rowcount
+        deliveries = conn.execute(
+            """
+            UPDATE deliveries SET status = 'pending'
+            WHERE status = 'sending' AND updated_at <= datetime(?, 'unixepoch')
+            """,
+            (cutoff,),
+        ).rowcount
+    return posts, deliveries
+
+
+def get_pipeline_backlog() -> Dict[str, int]:
+    """Размеры очередей конвейера"""
+    conn = get_db()
+    cur = conn.cursor()
+    backlog = {"fetched": 0, "classifying": 0, "pending": 0, "sending": 0}
+    for row in cur.execute(
+        "SELECT stage, COUNT(*) AS n FROM processed_posts WHERE stage != 'done' GROUP BY stage"
+    ):
+        backlog[row["stage"]] = row["n"]
+    for row in cur.execute(
+        """
+        SELECT status, COUNT(*) AS n FROM deliveries
+        WHERE status IN ('pending', 'sending') GROUP BY status
+        """
+    ):
+        backlog[row["status"]] = row["n"]
+    return backlog
+
+
+def purge_deliveries(days: int) -> int:
+    """Удалить завершённые исходящие старше N дней, вернуть число удалённых"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        DELETE FROM deliveries
+        WHERE status IN ('sent', 'failed') AND updated_at < datetime('now', ?)
+        """,
+        (f"-{int(days)} days",),
     )
+    deleted = cur.rowcount
     conn.commit()
-    conn.close()
+    return deleted
+
+
+EVENT_FIELDS = ("title", "date", "place", "link", "description")
+
+# Кэш первой страницы событий для бота (её открывает каждый /start и «Последние события»):
+# сбрасывается при каждой записи нового события. Версия защищает от гонки, когда
+# запрос начался до записи, а закончился после.
+_events_cache: Dict[int, Tuple[List[Dict[str, Any]], bool]] = {}
+_events_cache_version = 0
+_events_cache_lock = threading.Lock()
+
+
+def _invalidate_events_cache() -> None:
+    global _events_cache_version
+    with _events_cache_lock:
+        _events_cache_version += 1
+        _events_cache.clear()
+
 
+def _event_row(channel_username: str, post_id: int, post_date: str, extracted_data: Dict[str, Any]) -> Tuple[Any, ...]:
+    values = []
+    for field in EVENT_FIELDS:
+        value = extracted_data.get(field)
+        values.append(str(value) if value not in (None, "") else None)
+    return (channel_username, post_id, *values, post_date, extracted_data.get("event_at"))
 
-def mark_as_sent(channel_username: str, post_id: int) -> None:
+
+def _event_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    data = {
+        "title": row["title"],
+        "date": row["event_date"],
+        "place": row["place"],
+        "link": row["link"],
+        "description": row["description"],
+    }
+    return {
+        "id": row["id"],
+        "channel": row["channel_username"],
+        "post_id": row["post_id"],
+        "title": row["title"] or "Без названия",
+        "data": data,
+        "date": row["post_date"],
+        "event_at": row["event_at"],
+    }
+
+
+def get_events_page(
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = 5,
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """Страница событий от новых к старым по ключу id (без OFFSET).
+
+    before_id — события старше указанного id, after_id — новее; без них — самые новые
+    (эта страница отдаётся из кэша до записи следующего события).
+    Возвращает (события, есть ли более старые, есть ли более новые).
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    columns = "id, channel_username, post_id, title, event_date, place, link, description, post_date, event_at"
+    if after_id is not None:
+        cur.execute(
+            f"SELECT {columns} FROM events WHERE id > ? ORDER BY id ASC LIMIT ?",
+            (after_id, limit + 1),
+        )
+        rows = cur.fetchall()
+        has_newer = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        has_older = _event_exists("id < ?", rows[-1]["id"] if rows else after_id + 1)
+    elif before_id is None:
+        # Самые новые события — из кэша, пока не появилось новое
+        with _events_cache_lock:
+            cached = _events_cache.get(limit)
+            version = _events_cache_version
+        if cached is not None:
+            events, has_older = cached
+            return list(events), has_older, False
+        cur.execute(f"SELECT {columns} FROM events ORDER BY id DESC LIMIT ?", (limit + 1,))
+        rows = cur.fetchall()
+        has_older = len(rows) > limit
+        events = [_event_from_row(row) for row in rows[:limit]]
+        with _events_cache_lock:
+            if version == _events_cache_version:
+                _events_cache[limit] = (events, has_older)
+        return list(events), has_older, False
+    else:
+        cur.execute(
+            f"SELECT {columns} FROM events WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit + 1),
+        )
+        rows = cur.fetchall()
+        has_older = len(rows) > limit
+        rows = rows[:limit]
+        has_newer = _event_exists("id > ?", rows[0]["id"] if rows else before_id - 1)
+    return [_event_from_row(row) for row in rows], has_older, has_newer
+
+
+def get_upcoming_events(
+    since: str, after_id: Optional[int] = None, limit: int = 5
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Предстоящие события по дате проведения (event_at не раньше since), ближайшие первыми.
+
+    after_id — продолжить список после этого события (ключ — пара event_at, id).
+    События без распознанной даты сюда не попадают. Возвращает (события, есть ли ещё).
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    columns = "id, channel_username, post_id, title, event_date, place, link, description, post_date, event_at"
+    if after_id is None:
+        cur.execute(
+            f"SELECT {columns} FROM events WHERE event_at >= ? ORDER BY event_at, id LIMIT ?",
+            (since, limit + 1),
+        )
+    else:
+        cur.execute(
+            f"""
+            SELECT {columns} FROM events
+            WHERE event_at >= ? AND (event_at, id) > (SELECT event_at, id FROM events WHERE id = ?)
+            ORDER BY event_at, id
+            LIMIT ?
+            """,
+            (since, after_id, limit + 1),
+        )
+    rows = cur.fetchall()
+    return [_event_from_row(row) for row in rows[:limit]], len(rows) > limit
+
+
+def _event_exists(condition: str, event_id: int) -> bool:
+    conn = get_db()
+    row = conn.execute(f"SELECT 1 FROM events WHERE {condition} LIMIT 1", (event_id,)).fetchone()
+    return row is not None
+
+
+def get_event(event_id: int) -> Optional[Dict[str, Any]]:
+    """Событие по id или None"""
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        "UPDATE processed_posts SET sent_to_bot = 1 WHERE channel_username = ? AND post_id = ?",
-        (channel_username, post_id),
+        """
+        SELECT id, channel_username, post_id, title, event_date, place, link, description, post_date, event_at
+        FROM events
+        WHERE id = ?
+        """,
+        (event_id,),
     )
-    conn.commit()
-    conn.close()
+    row = cur.fetchone()
+    return _event_from_row(row) if row else None
+
 
+SCHEDULE_FIELDS = ("rate", "interval", "next_poll_at", "last_poll_at", "last_post_at", "errors", "last_error")
 
-def get_last_events(limit: int = 5) -> list:
-    """Получить последние N событий (постов где is_event = 1)"""
+
+def get_channel_schedules() -> List[sqlite3.Row]:
+    """Расписание опроса всех каналов (с временем последнего события), ближайшие первыми"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT s.*, CAST(strftime('%s', e.last_event) AS REAL) AS last_event_at
+        FROM channel_schedule AS s
+        LEFT JOIN (
+            SELECT channel_username, MAX(created_at) AS last_event FROM events GROUP BY channel_username
+        ) AS e ON e.channel_username = s.channel_username
+        ORDER BY s.next_poll_at
+        """
+    )
+    return cur.fetchall()
+
+
+def save_channel_schedule(channel_username: str, state: Dict[str, Any]) -> None:
+    """Сохранить состояние расписания канала (поля из SCHEDULE_FIELDS)"""
+    conn = get_db()
+    with conn:
+        conn.execute(
+            f"""
+            INSERT INTO channel_schedule (channel_username, {", ".join(SCHEDULE_FIELDS)})
+            VALUES (?, {", ".join("?" for _ in SCHEDULE_FIELDS)})
+            ON CONFLICT(channel_username) DO UPDATE SET
+                {", ".join(f"{field} = excluded.{field}" for field in SCHEDULE_FIELDS)},
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (channel_username, *(state.get(field) for field in SCHEDULE_FIELDS)),
+        )
+
+
+def get_last_event_time(channel_username: str) -> Optional[float]:
+    """Время (unix) последнего события канала или None"""
+    conn = get_db()
+    row = conn.execute(
+        "SELECT CAST(strftime('%s', MAX(created_at)) AS REAL) AS at FROM events WHERE channel_username = ?",
+        (channel_username,),
+    ).fetchone()
+    return row["at"] if row else None
+
+
+ENTITY_FIELDS = ("channel_id", "access_hash", "title", "current_username", "status", "note")
+
+
+def get_channel_entities(session_name: str) -> Dict[str, Dict[str, Any]]:
+    """Сохранённые сущности каналов аккаунта: username из channels.json -> поля"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT channel_username, {', '.join(ENTITY_FIELDS)} FROM channel_entities WHERE session_name = ?",
+        (session_name,),
+    )
+    return {row["channel_username"]: dict(row) for row in cur.fetchall()}
+
+
+def save_channel_entities(session_name: str, entities: Dict[str, Dict[str, Any]]) -> None:
+    """Сохранить сущности каналов (username -> поля из ENTITY_FIELDS) одной транзакцией"""
+    conn = get_db()
+    with conn:
+        conn.executemany(
+            f"""
+            INSERT INTO channel_entities (session_name, channel_username, {", ".join(ENTITY_FIELDS)})
+            VALUES (?, ?, {", ".join("?" for _ in ENTITY_FIELDS)})
+            ON CONFLICT(session_name, channel_username) DO UPDATE SET
+                {", ".join(f"{field} = excluded.{field}" for field in ENTITY_FIELDS)},
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            [
+                (session_name, channel, *(fields.get(field) for field in ENTITY_FIELDS))
+                for channel, fields in entities.items()
+            ],
+        )
+
+
+def sync_shard(
+    worker_id: str,
+    session_name: str,
+    channels: List[str],
+    stats: Dict[str, int],
+    started_at: float,
+    now: float,
+    ttl: float,
+) -> Tuple[List[str], bool]:
+    """Пульс воркера и перераспределение каналов; вернуть (свои каналы, ведущий ли воркер).
+
+    Всё выполняется в одной транзакции BEGIN IMMEDIATE, поэтому воркеры разных
+    процессов не захватывают один канал дважды. Каждому живому воркеру достаётся
+    около len(channels) / число_живых каналов: лишние отпускаются, свободные
+    и просроченные (воркер умер) забираются.
+    """
+    conn = get_db()
+    expires_at = now + ttl
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """
+            INSERT INTO shard_workers (worker_id, session_name, started_at, heartbeat_at, polls, posts_fetched)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(worker_id) DO UPDATE SET
+                session_name = excluded.session_name, started_at = excluded.started_at,
+                heartbeat_at = excluded.heartbeat_at, polls = excluded.polls, posts_fetched = excluded.posts_fetched
+            """,
+            (worker_id, session_name, started_at, now, stats.get("polls", 0), stats.get("posts_fetched", 0)),
+        )
+        # Воркеры, молчащие сутки, больше не показываются в shards.py
+        conn.execute("DELETE FROM shard_workers WHERE heartbeat_at < ?", (now - 86400,))
+        live = conn.execute(
+            "SELECT COUNT(*) FROM shard_workers WHERE heartbeat_at >= ?", (now - ttl,)
+        ).fetchone()[0]
+        wanted = set(channels)
+        own = [
+            row["channel_username"]
+            for row in conn.execute(
+                "SELECT channel_username FROM channel_leases WHERE worker_id = ? ORDER BY acquired_at, channel_username",
+                (worker_id,),
+            )
+        ]
+        target = -(-len(channels) // max(live, 1))
+        keep = [channel for channel in own if channel in wanted][:target]
+        release = [channel for channel in own if channel not in keep]
+        conn.executemany(
+            "DELETE FROM channel_leases WHERE channel_username = ? AND worker_id = ?",
+            [(channel, worker_id) for channel in release],
+        )
+        conn.execute("UPDATE channel_leases SET expires_at = ? WHERE worker_id = ?", (expires_at, worker_id))
+        if len(keep) < target:
+            taken = {
+                row["channel_username"]
+                for row in conn.execute("SELECT channel_username FROM channel_leases WHERE expires_at >= ?", (now,))
+            }
+            free = [channel for channel in channels if channel not in taken][:target - len(keep)]
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO channel_leases (channel_username, worker_id, acquired_at, expires_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(channel, worker_id, now, expires_at) for channel in free],
+            )
+            keep += free
+        conn.execute(
+            """
+            INSERT INTO shard_leader (id, worker_id, expires_at) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at
+            WHERE shard_leader.worker_id = excluded.worker_id OR shard_leader.expires_at < ?
+            """,
+            (worker_id, expires_at, now),
+        )
+        leader = conn.execute("SELECT worker_id FROM shard_leader WHERE id = 1").fetchone()["worker_id"]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return keep, leader == worker_id
+
+
+def release_shard(worker_id: str) -> None:
+    """Отпустить каналы и роль ведущего при остановке, чтобы их сразу забрали другие"""
+    conn = get_db()
+    with conn:
+        conn.execute("DELETE FROM channel_leases WHERE worker_id = ?", (worker_id,))
+        conn.execute("DELETE FROM shard_leader WHERE worker_id = ?", (worker_id,))
+        conn.execute("DELETE FROM shard_workers WHERE worker_id = ?", (worker_id,))
+
+
+def get_shard_status() -> Tuple[List[sqlite3.Row], Optional[str]]:
+    """Воркеры (с числом арендованных каналов) и id ведущего — для shards.py"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT w.*, COUNT(l.channel_username) AS channels, MIN(l.expires_at) AS lease_expires_at
+        FROM shard_workers AS w
+        LEFT JOIN channel_leases AS l ON l.worker_id = w.worker_id
+        GROUP BY w.worker_id
+        ORDER BY w.worker_id
+        """
+    )
+    workers = cur.fetchall()
+    row = conn.execute("SELECT worker_id, expires_at FROM shard_leader WHERE id = 1").fetchone()
+    leader = row["worker_id"] if row and row["expires_at"] >= time.time() else None
+    return workers, leader
+
+
+def get_channel_leases() -> List[sqlite3.Row]:
+    conn = get_db()
+    return conn.execute(
+        "SELECT channel_username, worker_id, acquired_at, expires_at FROM channel_leases ORDER BY worker_id, channel_username"
+    ).fetchall()
+
+
+def get_recent_detected_posts(days: int) -> List[sqlite3.Row]:
+    """Посты за последние N дней, по которым есть результат LLM (от старых к новым).
+
+    Вердикты без основной LLM (модель-фильтр, прошедшие даты, почти-дубликаты, ошибки
+    запроса, отказы быстрой модели каскада) не берутся — то же правило, что scoring.is_labelled.
+    """
     conn = get_db()
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-    cur.execute("""
-        SELECT channel_username, post_id, post_text, extracted_data, post_date
+    cur.execute(
+        """
+        SELECT channel_username, post_id, post_text, extracted_data, sent_to_bot
         FROM processed_posts
-        WHERE is_event = 1 AND sent_to_bot = 1
-        ORDER BY processed_at DESC
-        LIMIT ?
-    """, (limit,))
+        WHERE json_valid(extracted_data)
+          AND json_type(extracted_data, '$.is_event') IS NOT NULL
+          AND json_type(extracted_data, '$.duplicate_of') IS NULL
+          AND json_type(extracted_data, '$.triage_confidence') IS NULL
+          AND NOT COALESCE(json_extract(extracted_data, '$.llm_error'), 0)
+          AND processed_at >= datetime('now', ?)
+        ORDER BY id
+        """,
+        (f"-{int(days)} days",),
+    )
     rows = cur.fetchall()
-    conn.close()
-    
-    events = []
-    for row in rows:
-        extracted_data = json.loads(row["extracted_data"]) if row["extracted_data"] else {}
-        
-        # Пропускаем события без полезных данных (дайджесты и т.д.)
-        has_useful_data = any([
-            extracted_data.get("title"),
-            extracted_data.get("date"),
-            extracted_data.get("place"),
-            extracted_data.get("link"),
-            extracted_data.get("description")
-        ])
-        
-        if not has_useful_data:
-            continue
-        
-        events.append({
-            "channel": row["channel_username"],
-            "post_id": row["post_id"],
-            "title": extracted_data.get("title") or "Без названия",
-            "text": row["post_text"],
-            "data": extracted_data,
-            "date": row["post_date"],
-        })
-    return events
+    return rows
+
+
+def get_labelled_posts() -> List[sqlite3.Row]:
+    """Посты с результатом LLM — обучающие примеры для модели-фильтра"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT channel_username, post_id, post_text, is_event, extracted_data
+        FROM processed_posts
+        WHERE extracted_data IS NOT NULL AND extracted_data != '{}'
+        """
+    )
+    return cur.fetchall()
 
 
 def add_bot_user(chat_id: int, username: Optional[str] = None, first_name: Optional[str] = None) -> None:
@@ -160,16 +1139,45 @@ def add_bot_user(chat_id: int, username: Optional[str] = None, first_name: Optio
         (chat_id, username, first_name),
     )
     conn.commit()
-    conn.close()
 
 
 def get_all_bot_users() -> List[Dict[str, Any]]:
     """Получить список всех пользователей бота"""
     conn = get_db()
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute("SELECT chat_id FROM bot_users")
     rows = cur.fetchall()
-    conn.close()
     return [{"chat_id": row["chat_id"]} for row in rows]
 
+
+def get_llm_cache_entry(cache_key: str, min_created_at: float) -> Optional[Dict[str, Any]]:
+    """Получить результат LLM из кэша, если запись не старше min_created_at"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT result FROM llm_cache WHERE cache_key = ? AND created_at >= ?",
+        (cache_key, min_created_at),
+    )
+    row = cur.fetchone()
+    return json.loads(row["result"]) if row else None
+
+
+def put_llm_cache_entry(cache_key: str, result: Dict[str, Any], created_at: float) -> None:
+    """Сохранить результат LLM в кэш"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT OR REPLACE INTO llm_cache (cache_key, result, created_at) VALUES (?, ?, ?)",
+        (cache_key, json.dumps(result, ensure_ascii=False), created_at),
+    )
+    conn.commit()
+
+
+def purge_llm_cache(min_created_at: float) -> int:
+    """Удалить из кэша записи старше min_created_at, вернуть число удалённых"""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM llm_cache WHERE created_at < ?", (min_created_at,))
+    deleted = cur.rowcount
+    conn.commit()
+    return deleted
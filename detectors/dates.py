@@ -0,0 +1,248 @@
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, List, Optional
+from zoneinfo import ZoneInfo
+
+# Локальный разбор дат в тексте поста: «15 марта», «15–16 марта», «в субботу»,
+# «завтра в 19:00», «12.04», «12.04.2025», ISO и английские «March 15», «next Friday».
+# Даты приводятся к абсолютному времени относительно даты поста — в часовом поясе
+# EVENT_TIMEZONE, в котором пишут анонсы. Если все найденные даты уже прошли,
+# пост — отчёт или новость, а не анонс, и LLM можно не спрашивать.
+
+_MONTHS = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "мая": 5, "май": 5, "июн": 6,
+    "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6, "jul": 7,
+    "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_WEEKDAYS = {
+    "пон": 0, "вто": 1, "сре": 2, "чет": 3, "пят": 4, "суб": 5, "вос": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+_RELATIVE_DAYS = {
+    "позавчера": -2, "вчера": -1, "сегодня": 0, "завтра": 1, "послезавтра": 2,
+    "yesterday": -1, "today": 0, "tonight": 0, "tomorrow": 1,
+}
+
+_RU_MONTH = (
+    r"январ[ья]|феврал[ья]|марта?|апрел[ья]|ма[яй]|июн[ья]|июл[ья]|августа?|"
+    r"сентябр[ья]|октябр[ья]|ноябр[ья]|декабр[ья]|янв|фев|апр|авг|сент?|окт|ноя|дек"
+)
+_EN_MONTH = (
+    r"january|february|march|april|may|june|july|august|september|october|november|december|"
+    r"jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec"
+)
+_DAY_SUFFIX = r"(?:-?(?:го|е|ое)|st|nd|rd|th)?"
+
+# «15 марта», «15-16 марта 2025», «1st of May»
+_DAY_MONTH_RE = re.compile(
+    rf"(?<![\w.])(\d{{1,2}}){_DAY_SUFFIX}(?:\s*[-–—]\s*(\d{{1,2}}){_DAY_SUFFIX})?\s+(?:of\s+)?"
+    rf"({_RU_MONTH}|{_EN_MONTH})\.?(?!\w)(?:\s+(\d{{4}})(?!\d))?"
+)
+# «March 15», «Mar 15-16, 2025»
+_MONTH_DAY_RE = re.compile(
+    rf"(?<!\w)({_EN_MONTH})\.?\s+(\d{{1,2}}){_DAY_SUFFIX}(?:\s*[-–—]\s*(\d{{1,2}}){_DAY_SUFFIX})?(?!\w)"
+    rf"(?:,?\s+(\d{{4}})(?!\d))?"
+)
+# «12.04.2025», «12/04/25»; без года — только «12.04» с двузначным месяцем,
+# чтобы не принимать за дату числа вроде «1.5 млн», и не после «в»/«с» («в 12.30» — время)
+_NUMERIC_RE = re.compile(
+    r"(?<![\w.,/])(\d{1,2})([./])(\d{1,2})\2(\d{4}|\d{2})(?![\w%]|[.,/]\d)"
+    r"|(?<![\w.,/])(?<!в )(?<!с )(?<!at )(\d{1,2})\.(\d{2})(?![\w%]|[.,/:]\d)"
+)
+_ISO_RE = re.compile(r"(?<![\d.])(\d{4})-(\d{2})-(\d{2})(?:[t ](\d{2}):(\d{2}))?(?!\d)")
+_RELATIVE_RE = re.compile(r"(?<!\w)(" + "|".join(_RELATIVE_DAYS) + r")(?!\w)")
+# День недели считается датой только с предлогом или уточнением («в среду», а не «среда разработки»)
+_WEEKDAY_RE = re.compile(
+    r"(?<!\w)(?:(в|во|on)\s+)?(?:(эт[уоа]|этот|следующ\w+|ближайш\w+|прошл\w+|this|next|last)\s+)?"
+    r"(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|суббот[ау]|воскресенье|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday)(?!\w)"
+)
+# Время сразу после даты: «, в 19:00», « с 18.30», « at 7pm»
+_TIME_RE = re.compile(
+    r"\s*[,—–-]?\s*(?:в|во|с|at|from|начало\s+в)?\s*"
+    r"(?:(\d{1,2})[:.](\d{2})(?!\d)|(\d{1,2})\s*(am|pm)(?!\w))"
+)
+_TIME_WINDOW = 25
+
+
+@dataclass(frozen=True)
+class DateMention:
+    """Дата из текста: позиция в тексте и локальное время (полночь, если время не указано).
+
+    certain=False — короткая запись вроде «2.10» или «2.10.15», которая может оказаться номером версии.
+    """
+    position: int
+    at: datetime
+    has_time: bool
+    certain: bool = True
+
+    def ends_at(self, grace: timedelta) -> datetime:
+        """Когда событие точно началось: конец дня, а для указанного времени — время плюс запас"""
+        if self.has_time:
+            return self.at + grace
+        return self.at + timedelta(days=1)
+
+
+def event_timezone() -> ZoneInfo:
+    return ZoneInfo(os.getenv("EVENT_TIMEZONE", "Europe/Moscow"))
+
+
+def date_filter_enabled() -> bool:
+    return os.getenv("DATE_FILTER", "1") == "1"
+
+
+def past_grace() -> timedelta:
+    """Сколько после указанного времени событие ещё может идти (DATES_PAST_GRACE_HOURS)"""
+    return timedelta(hours=float(os.getenv("DATES_PAST_GRACE_HOURS", "3")))
+
+
+def local_now() -> datetime:
+    return datetime.now(event_timezone()).replace(tzinfo=None)
+
+
+def to_local(value: Any) -> Optional[datetime]:
+    """Дата поста (datetime или ISO-строка; без пояса — UTC) в локальном времени без пояса"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(event_timezone()).replace(tzinfo=None)
+
+
+def _with_year(day: int, month: int, year: Optional[int], base: date) -> Optional[date]:
+    # Год не указан: берём ближайший к дате поста (в декабре «15 января» — следующего года)
+    try:
+        if year is not None:
+            return date(year + 2000 if year < 100 else year, month, day)
+        candidate = date(base.year, month, day)
+        if candidate < base - timedelta(days=183):
+            return date(base.year + 1, month, day)
+        if candidate > base + timedelta(days=183):
+            return date(base.year - 1, month, day)
+        return candidate
+    except ValueError:
+        return None
+
+
+def _time_after(text: str, end: int) -> Optional[time]:
+    match = _TIME_RE.match(text[end:end + _TIME_WINDOW])
+    if match is None:
+        return None
+    if match.group(1) is not None:
+        hour, minute = int(match.group(1)), int(match.group(2))
+    else:
+        hour, minute = int(match.group(3)) % 12, 0
+        if match.group(4) == "pm":
+            hour += 12
+    if hour > 23 or minute > 59:
+        return None
+    return time(hour, minute)
+
+
+def extract_dates(text: str, post_date: Any = None) -> List[DateMention]:
+    """Все даты из текста в порядке появления, в локальном времени.
+
+    Относительные даты («завтра», «в субботу») и даты без года отсчитываются от
+    даты поста (если её нет — от текущего времени).
+    """
+    base = to_local(post_date) or local_now()
+    lower = text.lower()
+    # (позиция, дата или дата со временем, где искать время после даты, certain)
+    found: List[tuple] = []
+
+    for match in _DAY_MONTH_RE.finditer(lower):
+        month = _MONTHS.get(match.group(3)[:3])
+        year = int(match.group(4)) if match.group(4) else None
+        days = [int(match.group(1))] + ([int(match.group(2))] if match.group(2) else [])
+        for day in days:
+            found.append((match.start(), _with_year(day, month, year, base.date()), match.end(), True))
+
+    for match in _MONTH_DAY_RE.finditer(lower):
+        month = _MONTHS.get(match.group(1)[:3])
+        year = int(match.group(4)) if match.group(4) else None
+        days = [int(match.group(2))] + ([int(match.group(3))] if match.group(3) else [])
+        for day in days:
+            found.append((match.start(), _with_year(day, month, year, base.date()), match.end(), True))
+
+    for match in _NUMERIC_RE.finditer(lower):
+        if match.group(1) is not None:
+            parsed = _with_year(int(match.group(1)), int(match.group(3)), int(match.group(4)), base.date())
+            # «2.10.15» с двузначным годом — скорее номер версии, чем дата
+            found.append((match.start(), parsed, match.end(), len(match.group(4)) == 4))
+        else:
+            parsed = _with_year(int(match.group(5)), int(match.group(6)), None, base.date())
+            found.append((match.start(), parsed, match.end(), False))
+
+    for match in _ISO_RE.finditer(lower):
+        parsed = _with_year(int(match.group(3)), int(match.group(2)), int(match.group(1)), base.date())
+        if parsed is not None and match.group(4) is not None:
+            hour, minute = int(match.group(4)), int(match.group(5))
+            if hour <= 23 and minute <= 59:
+                found.append((match.start(), datetime.combine(parsed, time(hour, minute)), None, True))
+                continue
+        found.append((match.start(), parsed, match.end(), True))
+
+    for match in _RELATIVE_RE.finditer(lower):
+        offset = timedelta(days=_RELATIVE_DAYS[match.group(1)])
+        found.append((match.start(), base.date() + offset, match.end(), True))
+
+    for match in _WEEKDAY_RE.finditer(lower):
+        preposition, qualifier = match.group(1), match.group(2)
+        if preposition is None and qualifier is None:
+            continue
+        delta = (_WEEKDAYS[match.group(3)[:3]] - base.weekday()) % 7
+        if qualifier and qualifier.startswith(("следующ", "next")) and delta == 0:
+            delta = 7
+        elif qualifier and qualifier.startswith(("прошл", "last")):
+            delta = delta - 7 if delta else -7
+        found.append((match.start(), base.date() + timedelta(days=delta), match.end(), True))
+
+    mentions = {}
+    for position, parsed, end, certain in found:
+        if parsed is None:
+            continue
+        if isinstance(parsed, datetime):
+            mention = DateMention(position, parsed, True, certain)
+        else:
+            at_time = _time_after(lower, end)
+            mention = DateMention(position, datetime.combine(parsed, at_time or time()), at_time is not None, certain)
+        # Одна и та же дата, найденная разными правилами, учитывается один раз
+        mentions.setdefault((mention.at, mention.has_time), mention)
+    return sorted(mentions.values(), key=lambda mention: mention.position)
+
+
+def all_past(mentions: List[DateMention], now: Optional[datetime] = None) -> bool:
+    """Все даты уже прошли (пустой список — не «прошли»: дат просто нет).
+
+    Одних только коротких записей вроде «2.10» для такого вывода мало.
+    """
+    if not any(mention.certain for mention in mentions):
+        return False
+    now = now or local_now()
+    grace = past_grace()
+    return all(mention.ends_at(grace) <= now for mention in mentions)
+
+
+def event_start(llm_date: Optional[str], text: str, post_date: Any) -> Optional[datetime]:
+    """Дата события для столбца events.event_at.
+
+    Сначала разбирается поле date из ответа LLM (там одна дата — самого события),
+    иначе берётся первая ещё не прошедшая на момент поста дата из текста.
+    """
+    if llm_date:
+        mentions = extract_dates(str(llm_date), post_date)
+        if mentions:
+            return mentions[0].at
+    base = to_local(post_date) or local_now()
+    for mention in extract_dates(text, post_date):
+        if mention.ends_at(past_grace()) > base:
+            return mention.at
+    return None
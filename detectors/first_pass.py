@@ -1,76 +1,167 @@
 import re
+from typing import Dict, Iterator, List, Tuple
 
-KEYWORDS = [
+# Ключевое слово -> регулярка с учётом словоформ. Для русских слов берём основу
+# и любые окончания (\w*), для английских — единственное и множественное число.
+# Границы слова добавляются при компиляции, поэтому "show" не ловит "showcase",
+# а "шоу" не ловит "шоурум".
+KEYWORD_PATTERNS: Dict[str, str] = {
     # Русские
-    "митап",
-    "конференция",
-    "лекция",
-    "воркшоп",
-    "встреча",
-    "вечеринка",
-    "семинар",
-    "тренинг",
-    "хакатон",
-    "фестиваль",
-    "форум",
-    "саммит",
-    "выставка",
-    "презентация",
-    "демо-день",
-    "демодень",
-    "концерт",
-    "шоу",
-    "турнир",
-    "чемпионат",
-    "круглый стол",
-    "дискуссия",
-    "панель",
-    "дебаты",
-    "мастер-класс",
-    "мастеркласс",
+    "митап": r"митап\w*",
+    "конференция": r"конференц\w*",
+    "лекция": r"лекци\w*",
+    "воркшоп": r"воркшоп\w*",
+    "встреча": r"встреч\w*",
+    "вечеринка": r"вечеринк\w*",
+    "семинар": r"семинар\w*",
+    "тренинг": r"тренинг\w*",
+    "хакатон": r"хакатон\w*",
+    "фестиваль": r"фестивал\w*",
+    "форум": r"форум\w*",
+    "саммит": r"саммит\w*",
+    "выставка": r"выставк\w*",
+    "презентация": r"презентаци\w*",
+    "демо-день": r"демо-?(?:день|дн\w+)",
+    "концерт": r"концерт\w*",
+    "шоу": r"шоу",
+    "турнир": r"турнир\w*",
+    "чемпионат": r"чемпионат\w*",
+    "круглый стол": r"кругл\w*\s+стол\w*",
+    "дискуссия": r"дискусси\w*",
+    "панель": r"панел\w*",
+    "дебаты": r"дебат\w*",
+    "мастер-класс": r"мастер-?класс\w*",
     # Английские
-    "event",
-    "meetup",
-    "workshop",
-    "party",
-    "conference",
-    "lecture",
-    "seminar",
-    "training",
-    "hackathon",
-    "festival",
-    "forum",
-    "summit",
-    "exhibition",
-    "presentation",
-    "demo day",
-    "concert",
-    "show",
-    "tournament",
-    "championship",
-    "round table",
-    "discussion",
-    "panel",
-    "debate",
-    "master class",
-    "masterclass",
-]
-
-DATE_PATTERNS = [
-    r"\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b",
-    r"\b\d{4}-\d{2}-\d{2}\b",
-    r"\bсегодня\b",
-    r"\bзавтра\b",
-    r"\bпонедельник|\bвторник|\bсреда|\bчетверг|\bпятница|\bсуббота|\bвоскресенье",
-    r"\d{1,2}\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)",
-]
+    "event": r"events?",
+    "meetup": r"meetups?",
+    "workshop": r"workshops?",
+    "party": r"part(?:y|ies)",
+    "conference": r"conferences?",
+    "lecture": r"lectures?",
+    "seminar": r"seminars?",
+    "training": r"trainings?",
+    "hackathon": r"hackathons?",
+    "festival": r"festivals?",
+    "forum": r"forums?",
+    "summit": r"summits?",
+    "exhibition": r"exhibitions?",
+    "presentation": r"presentations?",
+    "demo day": r"demo\s+days?",
+    "concert": r"concerts?",
+    "show": r"shows?",
+    "tournament": r"tournaments?",
+    "championship": r"championships?",
+    "round table": r"round\s+tables?",
+    "discussion": r"discussions?",
+    "panel": r"panels?",
+    "debate": r"debates?",
+    "master class": r"master\s*class(?:es)?",
+}
 
+KEYWORDS = list(KEYWORD_PATTERNS)
+
+# Шаблоны дат. Числовые шаблоны начинаются с цифры, остальные — с буквы: это
+# важно для быстрого сканера ниже.
+DATE_PATTERNS: Dict[str, str] = {
+    "date:dd.mm.yyyy": r"\d{1,2}[./]\d{1,2}[./]\d{2,4}",
+    "date:iso": r"\d{4}-\d{2}-\d{2}",
+    "date:day_month": (
+        r"\d{1,2}\s+(?:января|февраля|марта|апреля|мая|июня|июля|августа|"
+        r"сентября|октября|ноября|декабря)"
+    ),
+    "date:сегодня": r"сегодня",
+    "date:завтра": r"завтра",
+    "date:weekday": r"понедельник\w*|вторник\w*|сред[аеуы]|четверг\w*|пятниц\w*|суббот\w*|воскресень\w*",
+}
+
+_NUMERIC_RULES = ("date:dd.mm.yyyy", "date:iso", "date:day_month")
+
+# Грубый сканер числовых дат: кандидаты потом проверяются точными правилами
+_NUMERIC_SCANNER = (
+    r"\d(?:\d{0,3}[./-]\d|\d?\s+(?:янв|фев|мар|апр|мая|июн|июл|авг|сен|окт|ноя|дек))"
+)
+
+
+def _split_alternatives(pattern: str) -> List[str]:
+    """Разбить шаблон по '|' верхнего уровня (вне скобок и классов символов)"""
+    parts, depth, in_class, current, i = [], 0, False, "", 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            current += pattern[i:i + 2]
+            i += 2
+            continue
+        if in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            parts.append(current)
+            current = ""
+            i += 1
+            continue
+        current += char
+        i += 1
+    parts.append(current)
+    return parts
+
+
+def _compile_rules() -> Tuple[List[re.Pattern], List[Tuple[str, re.Pattern]]]:
+    """Быстрые сканеры кандидатов и точные правила с границами слова.
+
+    Сканер — одна регулярка без групп и проверок границ, где каждая альтернатива
+    начинается с буквы или цифры: sre тогда сам пропускает позиции, с которых не
+    начинается ни одно правило (по множеству первых символов), и текст проходится
+    за один вызов на стороне C. Точные правила проверяются только в найденных
+    позициях, поэтому стоимость почти не зависит от числа ключевых слов.
+    """
+    rules = [(f"kw:{name}", pattern) for name, pattern in KEYWORD_PATTERNS.items()]
+    rules += list(DATE_PATTERNS.items())
+    word_alternatives = [
+        alternative
+        for label, pattern in rules if label not in _NUMERIC_RULES
+        for alternative in _split_alternatives(pattern)
+    ]
+    scanners = [re.compile("|".join(word_alternatives)), re.compile(_NUMERIC_SCANNER)]
+    exact = [(label, re.compile(rf"(?:{pattern})(?!\w)")) for label, pattern in rules]
+    return scanners, exact
 
-def quick_check(text: str) -> bool:
-    lower = text.lower()
-    if any(k in lower for k in KEYWORDS):
-        return True
-    if any(re.search(pat, lower) for pat in DATE_PATTERNS):
-        return True
-    return False
 
+_SCANNERS, _RULES = _compile_rules()
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _iter_rules(lower: str) -> Iterator[str]:
+    for scanner in _SCANNERS:
+        pos = 0
+        while True:
+            candidate = scanner.search(lower, pos)
+            if candidate is None:
+                break
+            start = candidate.start()
+            pos = start + 1
+            if start > 0 and _is_word_char(lower[start - 1]):
+                continue
+            for label, rule in _RULES:
+                if rule.match(lower, start):
+                    yield label
+                    break
+
+
+def match_rules(text: str) -> List[str]:
+    """Какие правила сработали на тексте (без повторов, в порядке обнаружения)"""
+    fired: Dict[str, None] = {}
+    for label in _iter_rules(text.lower()):
+        fired.setdefault(label, None)
+    return list(fired)
+
+
+def quick_check(text: str) -> bool:
+    return next(_iter_rules(text.lower()), None) is not None
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from database.db import get_llm_cache_entry, put_llm_cache_entry, purge_llm_cache, run_db
+
+# Невидимые символы, которые не меняют смысл поста (zero-width, variation selectors, BOM)
+_INVISIBLE_RE = re.compile("[\u200b-\u200f\u2060-\u2064\ufe00-\ufe0f\ufeff]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: регистр, ё, невидимые символы и пробелы"""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _INVISIBLE_RE.sub("", text).lower().replace("ё", "е")
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def make_cache_key(text: str, prompt: str, model: str, mode: str = "single") -> str:
+    """Ключ кэша: хэш нормализованного текста + версия промпта + модель + вид запроса (single, stream, batch)"""
+    prompt_version = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    payload = "\0".join([model, mode, prompt_version, normalize_text(text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Двухуровневый кэш результатов LLM: LRU в памяти + таблица llm_cache в SQLite.
+
+    Обращения к SQLite идут через run_db и не блокируют event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, result = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return dict(result)
+                del self._memory[key]
+
+        result = await run_db(get_llm_cache_entry, key, now - self.ttl_seconds)
+        if result is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.db_hits += 1
+            self._remember(key, result, now)
+        return dict(result)
+
+    async def put(self, key: str, result: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, result, now)
+        await run_db(put_llm_cache_entry, key, result, now)
+
+    def _remember(self, key: str, result: Dict[str, Any], created_at: float) -> None:
+        self._memory[key] = (created_at, dict(result))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Удалить протухшие записи из SQLite"""
+        return purge_llm_cache(time.time() - self.ttl_seconds)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "memory_size": len(self._memory),
+            }
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Кэш процесса или None, если кэширование отключено (LLM_CACHE_ENABLED=0)"""
+    global _cache
+    if os.getenv("LLM_CACHE_ENABLED", "1") == "0":
+        return None
+    if _cache is None:
+        _cache = LLMCache(
+            max_entries=int(os.getenv("LLM_CACHE_SIZE", "2048")),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600,
+        )
+    return _cache
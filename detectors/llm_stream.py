@@ -0,0 +1,82 @@
+import re
+from typing import Any, Dict, Optional
+
+# Потоковый разбор ответа LLM: вердикт is_event известен задолго до конца ответа,
+# поэтому отрицательный ответ можно не дочитывать.
+
+# Схема ответа для response_format json_schema; is_event первым, чтобы модель выдала его сразу
+EVENT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "is_event": {"type": "boolean"},
+        "title": {"type": ["string", "null"]},
+        "date": {"type": ["string", "null"]},
+        "place": {"type": ["string", "null"]},
+        "link": {"type": ["string", "null"]},
+        "description": {"type": ["string", "null"]},
+    },
+    "required": ["is_event", "title", "date", "place", "link", "description"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {"name": "event_detection", "strict": True, "schema": EVENT_SCHEMA},
+}
+
+_IS_EVENT_RE = re.compile(r'"is_event"\s*:\s*(true|false)\b', re.IGNORECASE)
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+
+class StreamParser:
+    """Накапливает фрагменты ответа и замечает вердикт, как только он появился.
+
+    Рассуждения модели в <think>...</think> в ответ не попадают и не разбираются:
+    «"is_event": false» внутри хода мыслей — ещё не решение.
+    """
+
+    def __init__(self):
+        self.content = ""
+        self.verdict: Optional[bool] = None
+        self._pending = ""
+        self._in_think = False
+
+    def feed(self, delta: str) -> Optional[bool]:
+        """Добавить фрагмент; вернуть вердикт, если он уже известен"""
+        self._pending += delta
+        while self._pending:
+            marker = _THINK_CLOSE if self._in_think else _THINK_OPEN
+            index = self._pending.find(marker)
+            if index >= 0:
+                if not self._in_think:
+                    self.content += self._pending[:index]
+                self._pending = self._pending[index + len(marker):]
+                self._in_think = not self._in_think
+                continue
+            # Тег мог разрезаться границей фрагмента: его начало придерживаем
+            keep = _partial_suffix(self._pending, marker)
+            if not self._in_think:
+                self.content += self._pending[:len(self._pending) - keep]
+            self._pending = self._pending[len(self._pending) - keep:]
+            break
+        if self.verdict is None:
+            match = _IS_EVENT_RE.search(self.content)
+            if match:
+                self.verdict = match.group(1).lower() == "true"
+        return self.verdict
+
+    def finish(self) -> str:
+        """Текст ответа без рассуждений (после окончания потока)"""
+        if not self._in_think:
+            self.content += self._pending
+        self._pending = ""
+        return self.content
+
+
+def _partial_suffix(text: str, marker: str) -> int:
+    # Длина самого длинного конца text, с которого начинается marker
+    for size in range(min(len(text), len(marker) - 1), 0, -1):
+        if marker.startswith(text[-size:]):
+            return size
+    return 0
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Tuple
+
+from database.db import get_recent_detected_posts, run_db
+from detectors.llm_cache import normalize_text
+from detectors.scoring import is_labelled
+
+logger = logging.getLogger(__name__)
+
+# SimHash 64 бита, делим на 4 полосы по 16 бит: если расстояние Хэмминга <= 3,
+# хотя бы одна полоса совпадает целиком (принцип Дирихле), поэтому поиск идёт
+# только по корзинам совпавших полос, а не по всему индексу.
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+_URL_RE = re.compile(r"(?:https?://|www\.|t\.me/)\S+")
+_HASHTAG_RE = re.compile(r"[#@]\w+")
+_WORD_RE = re.compile(r"\w+")
+
+
+@dataclass
+class NearDuplicateEntry:
+    channel: str
+    post_id: int
+    simhash: int
+    result: Optional[Dict[str, Any]]
+    sent: bool
+
+
+def _tokens(text: str) -> List[str]:
+    """Слова поста без ссылок, хэштегов, упоминаний и эмодзи"""
+    text = normalize_text(text)
+    text = _URL_RE.sub(" ", text)
+    text = _HASHTAG_RE.sub(" ", text)
+    return _WORD_RE.findall(text)
+
+
+# Таблицы для bytes.translate: байт -> значение его bit-го бита (0 или 1)
+_BIT_TABLES = [bytes(byte >> bit & 1 for byte in range(256)) for bit in range(8)]
+
+
+@lru_cache(maxsize=1 << 18)
+def _feature_digest(feature: str) -> bytes:
+    # Слова и пары слов сильно повторяются между постами, поэтому хэши кэшируем
+    return hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+
+
+def simhash(tokens: List[str]) -> int:
+    """SimHash по словам и парам соседних слов"""
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    data = b"".join(map(_feature_digest, features))
+    # Голоса по каждому биту считаем столбцами байтов на стороне C, без цикла по признакам
+    value = 0
+    for position in range(HASH_BITS // 8):
+        column = data[position::8]
+        for bit in range(8):
+            if column.translate(_BIT_TABLES[bit]).count(1) * 2 > len(features):
+                value |= 1 << (8 * position + bit)
+    return value
+
+
+class NearDuplicateIndex:
+    """Индекс почти-дубликатов недавних постов в памяти (SimHash + LSH по полосам)"""
+
+    def __init__(self, max_distance: int = 3, min_tokens: int = 8, max_entries: int = 300000):
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.min_tokens = min_tokens
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int], NearDuplicateEntry]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, int], List[NearDuplicateEntry]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return key in self._entries
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        """SimHash текста или None, если текст слишком короткий для надёжного сравнения"""
+        tokens = _tokens(text)
+        if len(tokens) < self.min_tokens:
+            return None
+        return simhash(tokens)
+
+    @staticmethod
+    def _bands(value: int) -> List[Tuple[int, int]]:
+        return [(band, value >> (band * BAND_BITS) & BAND_MASK) for band in range(BANDS)]
+
+    def find(
+        self,
+        text: str,
+        sent_only: bool = False,
+        exclude: Optional[Tuple[str, int]] = None,
+    ) -> Optional[NearDuplicateEntry]:
+        """Ближайший пост в пределах max_distance; exclude — (канал, id) самого поста"""
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return None
+        best: Optional[NearDuplicateEntry] = None
+        best_distance = self.max_distance + 1
+        for band in self._bands(fingerprint):
+            for entry in self._buckets.get(band, ()):
+                if sent_only and not entry.sent:
+                    continue
+                if exclude is not None and (entry.channel, entry.post_id) == exclude:
+                    continue
+                distance = (entry.simhash ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+        return best
+
+    def add(self, channel: str, post_id: int, text: str, result: Optional[Dict[str, Any]], sent: bool = False) -> None:
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return
+        self._insert(channel, post_id, fingerprint, result, sent)
+
+    def _insert(
+        self,
+        channel: str,
+        post_id: int,
+        fingerprint: int,
+        result: Optional[Dict[str, Any]],
+        sent: bool,
+        oldest: bool = False,
+    ) -> None:
+        """oldest=True ставит запись в начало очереди вытеснения (посты из истории)"""
+        key = (channel, post_id)
+        if key in self._entries:
+            self._remove(key)
+        # Храним извлечённые поля только для событий: для остальных достаточно вердикта
+        entry = NearDuplicateEntry(channel, post_id, fingerprint, result if result and result.get("is_event") else None, sent)
+        self._entries[key] = entry
+        if oldest:
+            self._entries.move_to_end(key, last=False)
+        for band in self._bands(fingerprint):
+            self._buckets.setdefault(band, []).append(entry)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def mark_sent(self, channel: str, post_id: int) -> None:
+        entry = self._entries.get((channel, post_id))
+        if entry is not None:
+            entry.sent = True
+
+    def _remove(self, key: Tuple[str, int]) -> None:
+        entry = self._entries.pop(key)
+        for band in self._bands(entry.simhash):
+            bucket = self._buckets.get(band)
+            if bucket is None:
+                continue
+            bucket[:] = [e for e in bucket if e is not entry]
+            if not bucket:
+                del self._buckets[band]
+
+
+_index: Optional[NearDuplicateIndex] = None
+
+
+def get_index() -> NearDuplicateIndex:
+    global _index
+    if _index is None:
+        _index = NearDuplicateIndex(
+            max_distance=int(os.getenv("NEAR_DUP_MAX_DISTANCE", "3")),
+            min_tokens=int(os.getenv("NEAR_DUP_MIN_TOKENS", "8")),
+            max_entries=int(os.getenv("NEAR_DUP_MAX_ENTRIES", "300000")),
+        )
+    return _index
+
+
+async def rebuild_index(chunk_size: int = 1000) -> NearDuplicateIndex:
+    """Заполнить индекс постами из processed_posts, которые проверила LLM за последние дни.
+
+    Запускается фоном после старта: SimHash считается пачками в отдельном потоке,
+    поэтому сервис не ждёт загрузки истории. Посты, попавшие в индекс за это время,
+    не перезаписываются, а история встаёт в начало очереди вытеснения.
+    """
+    index = get_index()
+    days = int(os.getenv("NEAR_DUP_WINDOW_DAYS", "30"))
+    rows = await run_db(get_recent_detected_posts, days)
+    count = 0
+    # От новых к старым: если история не помещается в индекс, теряются самые старые посты
+    rows.reverse()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        fingerprints = await asyncio.to_thread(lambda: [index.fingerprint(row["post_text"] or "") for row in chunk])
+        for row, fingerprint in zip(chunk, fingerprints):
+            key = (row["channel_username"], row["post_id"])
+            if fingerprint is None or key in index:
+                continue
+            if len(index) >= index.max_entries:
+                break
+            result = json.loads(row["extracted_data"]) if row["extracted_data"] else {}
+            if not is_labelled(result):
+                continue
+            index._insert(*key, fingerprint, result, bool(row["sent_to_bot"]), oldest=True)
+            count += 1
+    logger.info(f"Индекс почти-дубликатов: загружено {count} постов, в индексе {len(index)}")
+    return index
@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from detectors.first_pass import match_rules
+from detectors.llm_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Логистическая регрессия на хэшированных словах и парах слов. Обучается офлайн
+# по вердиктам LLM из processed_posts и решает, стоит ли вообще звать LLM.
+HASH_DIM = 1 << 18
+DEFAULT_MODEL_PATH = Path(__file__).resolve().parents[1] / "models" / "event_gate.json.gz"
+
+_URL_RE = re.compile(r"(?:https?://|www\.|t\.me/)\S+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _bucket(feature: str) -> int:
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "little") % HASH_DIM
+
+
+def extract_features(text: str) -> Dict[int, float]:
+    """Хэшированные признаки поста: слова, пары слов, сработавшие правила first_pass"""
+    normalized = normalize_text(text)
+    tokens = _WORD_RE.findall(_URL_RE.sub(" url ", normalized))
+    features: Dict[int, float] = {}
+    names = [f"w:{t}" for t in tokens]
+    names += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    names += [f"r:{rule}" for rule in match_rules(text)]
+    for name in names:
+        index = _bucket(name)
+        features[index] = features.get(index, 0.0) + 1.0
+    # L2-нормировка, чтобы длинные посты не получали больший вес
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {k: v / norm for k, v in features.items()}
+
+
+def _sigmoid(z: float) -> float:
+    if z < -35:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class EventGate:
+    """Оценка вероятности того, что пост — анонс мероприятия"""
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0):
+        self.weights: Dict[int, float] = weights or {}
+        self.bias = bias
+
+    def score(self, text: str) -> float:
+        features = extract_features(text)
+        z = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+        return _sigmoid(z)
+
+    def fit(
+        self,
+        texts: List[str],
+        labels: List[bool],
+        epochs: int = 8,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+        seed: int = 13,
+    ) -> None:
+        """SGD по логистической потере; положительные примеры взвешиваются по частоте классов"""
+        samples = [(extract_features(t), 1.0 if y else 0.0) for t, y in zip(texts, labels)]
+        positives = sum(y for _, y in samples) or 1.0
+        negatives = (len(samples) - positives) or 1.0
+        class_weight = {1.0: len(samples) / (2 * positives), 0.0: len(samples) / (2 * negatives)}
+        rnd = random.Random(seed)
+        for epoch in range(epochs):
+            rnd.shuffle(samples)
+            rate = learning_rate / (1 + epoch)
+            for features, y in samples:
+                z = self.bias + sum(self.weights.get(k, 0.0) * v for k, v in features.items())
+                gradient = (_sigmoid(z) - y) * class_weight[y]
+                self.bias -= rate * gradient
+                for k, v in features.items():
+                    w = self.weights.get(k, 0.0)
+                    self.weights[k] = w - rate * (gradient * v + l2 * w)
+
+    def save(self, path: Path) -> None:
+        # Храним только значимые веса: модель остаётся компактной
+        weights = {str(k): round(w, 5) for k, w in self.weights.items() if abs(w) >= 1e-4}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"version": 1, "hash_dim": HASH_DIM, "bias": self.bias, "weights": weights}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+
+    @classmethod
+    def load(cls, path: Path) -> "EventGate":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("hash_dim") != HASH_DIM:
+            raise ValueError(f"Модель обучена с hash_dim={payload.get('hash_dim')}, ожидается {HASH_DIM}")
+        return cls({int(k): w for k, w in payload["weights"].items()}, payload["bias"])
+
+
+def model_path() -> Path:
+    return Path(os.getenv("SCORING_MODEL_PATH", str(DEFAULT_MODEL_PATH)))
+
+
+_gate: Optional[EventGate] = None
+_gate_mtime: Optional[float] = None
+
+
+def get_gate() -> Optional[EventGate]:
+    """Модель-фильтр или None, если она выключена (SCORING_ENABLED=0) или ещё не обучена.
+
+    Модель перечитывается, если файл обновился (после повторного обучения).
+    """
+    global _gate, _gate_mtime
+    if os.getenv("SCORING_ENABLED", "1") == "0":
+        return None
+    path = model_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if _gate is None or mtime != _gate_mtime:
+        try:
+            _gate = EventGate.load(path)
+            _gate_mtime = mtime
+            logger.info(f"Модель-фильтр загружена: {path} ({len(_gate.weights)} весов)")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить модель-фильтр {path}: {e}")
+            return None
+    return _gate
+
+
+def skip_threshold() -> float:
+    """Посты с оценкой ниже порога считаются явными «не событиями» и не идут в LLM"""
+    return float(os.getenv("SCORING_SKIP_BELOW", "0.05"))
+
+
+def is_labelled(extracted_data: Dict[str, Any]) -> bool:
+    """Есть ли у поста собственный вердикт основной LLM.
+
+    Не считаются: копия от дубликата, пропуск фильтром, ошибка запроса к LLM
+    и отказ быстрой модели каскада без проверки основной.
+    """
+    return (
+        "is_event" in extracted_data
+        and "duplicate_of" not in extracted_data
+        and not extracted_data.get("llm_error")
+        and "triage_confidence" not in extracted_data
+    )
+
+
+def split_holdout(channel: str, post_id: int, share: float = 0.2) -> bool:
+    """Детерминированно отнести пост к отложенной выборке для оценки"""
+    digest = hashlib.blake2b(f"{channel}/{post_id}".encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(digest, "little") / 2 ** 32 < share
+
+
+def evaluate(gate: EventGate, texts: List[str], labels: List[bool], threshold: float) -> Dict[str, float]:
+    """Качество фильтра на выборке: «положительный» прогноз — пост уходит в LLM"""
+    tp = fp = fn = tn = 0
+    for text, label in zip(texts, labels):
+        escalate = gate.score(text) >= threshold
+        if escalate and label:
+            tp += 1
+        elif escalate:
+            fp += 1
+        elif label:
+            fn += 1
+        else:
+            tn += 1
+    total = len(labels) or 1
+    return {
+        "threshold": threshold,
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 1.0,
+        "llm_calls_avoided": (tn + fn) / total,
+        "missed_events": float(fn),
+    }
+
+
+def load_dataset(rows) -> Tuple[List[Tuple[str, bool]], List[Tuple[str, bool]]]:
+    """Разбить размеченные строки processed_posts на обучающую и отложенную выборки"""
+    train: List[Tuple[str, bool]] = []
+    holdout: List[Tuple[str, bool]] = []
+    for row in rows:
+        data = json.loads(row["extracted_data"]) if row["extracted_data"] else {}
+        if not is_labelled(data) or not row["post_text"]:
+            continue
+        sample = (row["post_text"], bool(row["is_event"]))
+        (holdout if split_holdout(row["channel_username"], row["post_id"]) else train).append(sample)
+    return train, holdout
@@ -1,20 +1,52 @@
+import asyncio
 import json
 import os
+import random
 import re
+import time
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple, List
 import httpx
 
-from openai import OpenAI
+from openai import AsyncOpenAI, BadRequestError, UnprocessableEntityError
+
+from detectors.llm_cache import get_cache, make_cache_key
+from detectors.llm_stream import RESPONSE_FORMAT, StreamParser
+from processors.preprocess import count_tokens, prepare_text
+from monitoring.metrics import (
+    LLM_SECONDS, LLM_REQUESTS, LLM_TOKENS, LLM_CACHE_LOOKUPS,
+    CASCADE_DECISIONS, CASCADE_AGREEMENT, CASCADE_CONFIDENCE,
+)
 
 logger = logging.getLogger(__name__)
 
 PROMPT_PATH = Path(__file__).resolve().parents[1] / "prompts" / "event_detection.txt"
+BATCH_PROMPT_PATH = PROMPT_PATH.with_name("event_detection_batch.txt")
+TRIAGE_PROMPT_PATH = PROMPT_PATH.with_name("event_triage.txt")
+
+# Долгоживущий клиент: один пул соединений на процесс вместо нового на каждый вызов
+_async_client: Optional[AsyncOpenAI] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+# Клиент и семафор быстрой модели каскада (LLM_CASCADE_MODEL)
+_triage_client: Optional[AsyncOpenAI] = None
+_triage_semaphore: Optional[asyncio.Semaphore] = None
+# Принимает ли эндпоинт response_format json_schema (False — после первого отказа)
+_schema_supported = True
+# Шаблоны промптов: путь -> (mtime, текст); файл перечитывается только после изменения
+_templates: Dict[Path, Tuple[float, str]] = {}
+
+
+def _read_template(path: Path) -> str:
+    mtime = path.stat().st_mtime
+    cached = _templates.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _templates[path] = (mtime, path.read_text(encoding="utf-8"))
+    return cached[1]
 
 
 def _load_prompt() -> str:
-    return PROMPT_PATH.read_text(encoding="utf-8")
+    return _read_template(PROMPT_PATH)
 
 
 def _build_prompt(text: str) -> str:
@@ -22,71 +54,540 @@ def _build_prompt(text: str) -> str:
     return template.replace("{text}", text)
 
 
-def llm_detect(text: str) -> Dict[str, Any]:
-    prompt = _build_prompt(text)
-    api_key = os.getenv("POLZA_AI_API_KEY")
-    base_url = os.getenv("POLZA_API_BASE", "https://api.polza.ai/api/v1")
-    model = os.getenv("POLZA_MODEL", "deepseek/deepseek-r1-distill-llama-70b")
-    
-    # Инициализация клиента с явным httpx клиентом без прокси
-    http_client = httpx.Client()
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-        http_client=http_client,
-    )
+def _build_batch_prompt(texts: List[str]) -> str:
+    template = _read_template(BATCH_PROMPT_PATH)
+    posts = "\n\n".join(f"### id: {i}\n{text}" for i, text in enumerate(texts, 1))
+    return template.replace("{posts}", posts)
+
+
+def _estimate_tokens(text: str) -> int:
+    return count_tokens(text)
+
+
+def _model() -> str:
+    return os.getenv("POLZA_MODEL", "deepseek/deepseek-r1-distill-llama-70b")
+
+
+def _client_kwargs() -> Dict[str, Any]:
+    return {
+        "api_key": os.getenv("POLZA_AI_API_KEY"),
+        "base_url": os.getenv("POLZA_API_BASE", "https://api.polza.ai/api/v1"),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "2")),
+    }
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT_SECONDS", "60")), connect=10.0)
+
+
+def _limits() -> httpx.Limits:
+    max_connections = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def _get_async_client() -> AsyncOpenAI:
+    global _async_client
+    if _async_client is None:
+        # Явный httpx клиент без прокси
+        http_client = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        _async_client = AsyncOpenAI(http_client=http_client, **_client_kwargs())
+    return _async_client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+    return _semaphore
+
+
+def _cascade_model() -> Optional[str]:
+    """Быстрая модель первого прохода или None, если каскад выключен"""
+    return os.getenv("LLM_CASCADE_MODEL") or None
+
+
+def _get_triage_client() -> AsyncOpenAI:
+    global _triage_client
+    if _triage_client is None:
+        # Быстрая модель может жить на другом OpenAI-совместимом эндпоинте (в т.ч. локальном)
+        kwargs = _client_kwargs()
+        kwargs["api_key"] = os.getenv("LLM_CASCADE_API_KEY") or kwargs["api_key"] or "local"
+        kwargs["base_url"] = os.getenv("LLM_CASCADE_API_BASE") or kwargs["base_url"]
+        http_client = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        _triage_client = AsyncOpenAI(http_client=http_client, **kwargs)
+    return _triage_client
+
+
+def _get_triage_semaphore() -> asyncio.Semaphore:
+    global _triage_semaphore
+    if _triage_semaphore is None:
+        limit = os.getenv("LLM_CASCADE_MAX_CONCURRENCY") or os.getenv("LLM_MAX_CONCURRENCY", "8")
+        _triage_semaphore = asyncio.Semaphore(int(limit))
+    return _triage_semaphore
+
 
+async def close_llm_client() -> None:
+    """Закрыть пулы соединений LLM клиентов (при остановке сервиса)"""
+    global _async_client, _semaphore, _batcher, _triage_client, _triage_semaphore
+    _batcher = None
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _triage_client is not None:
+        await _triage_client.close()
+        _triage_client = None
+    _triage_semaphore = None
+    _semaphore = None
+
+
+def _empty_result() -> Dict[str, Any]:
+    return {
+        "is_event": False,
+        "title": None,
+        "date": None,
+        "place": None,
+        "link": None,
+        "description": None,
+    }
+
+
+def _error_result() -> Dict[str, Any]:
+    # Ответа LLM нет: пост не рассылается, но и обучающим примером «не событие» не считается
+    return {**_empty_result(), "llm_error": True}
+
+
+def _strip_reasoning(content: str) -> str:
+    # Рассуждающие модели (deepseek-r1) пишут ход мыслей в <think>...</think> перед ответом
+    return re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
+
+
+def _normalize_result(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "is_event": bool(parsed.get("is_event")),
+        "title": parsed.get("title"),
+        "date": parsed.get("date"),
+        "place": parsed.get("place"),
+        "link": parsed.get("link"),
+        "description": parsed.get("description"),
+    }
+
+
+def _parse_content(content: str) -> Dict[str, Any]:
+    # Пытаемся извлечь JSON из ответа (может быть обернут в markdown или текст)
+    content_clean = _strip_reasoning(content)
+    if content_clean.startswith("```"):
+        # Убираем markdown код блоки
+        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content_clean, re.DOTALL)
+        if json_match:
+            content_clean = json_match.group(1)
+    elif not content_clean.startswith("{"):
+        # Ищем JSON в тексте
+        json_match = re.search(r'\{.*\}', content_clean, re.DOTALL)
+        if json_match:
+            content_clean = json_match.group(0)
+
+    parsed = json.loads(content_clean)
+    logger.info(f"JSON распарсен успешно: {parsed}")
+    return _normalize_result(parsed)
+
+
+def _parse_batch_content(content: str, size: int) -> Dict[int, Dict[str, Any]]:
+    """Разобрать JSON массив пакетного ответа: номер поста (с 1) -> результат.
+
+    Элементы с неизвестным id или без is_event пропускаются — такие посты
+    потом проверяются по одному.
+    """
+    content_clean = _strip_reasoning(content)
+    json_match = re.search(r'\[.*\]', content_clean, re.DOTALL)
+    if json_match:
+        content_clean = json_match.group(0)
+    parsed = json.loads(content_clean)
+    if not isinstance(parsed, list):
+        raise ValueError("ожидался JSON массив")
+    results: Dict[int, Dict[str, Any]] = {}
+    for item in parsed:
+        if not isinstance(item, dict) or "is_event" not in item:
+            continue
+        try:
+            index = int(str(item.get("id")).strip())
+        except ValueError:
+            continue
+        if 1 <= index <= size:
+            results[index] = _normalize_result(item)
+    return results
+
+
+def _handle_content(content: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Разобрать ответ LLM; None — ответ не удалось разобрать (такой результат не кэшируем)"""
+    logger.info(f"LLM ответ получен (полный): {content}")
     try:
-        logger.info(f"Отправка запроса к LLM (модель: {model})")
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-        )
-        content = completion.choices[0].message.content
-        logger.info(f"LLM ответ получен (полный): {content}")
-        
-        # Пытаемся извлечь JSON из ответа (может быть обернут в markdown или текст)
-        content_clean = content.strip()
-        if content_clean.startswith("```"):
-            # Убираем markdown код блоки
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content_clean, re.DOTALL)
-            if json_match:
-                content_clean = json_match.group(1)
-        elif not content_clean.startswith("{"):
-            # Ищем JSON в тексте
-            json_match = re.search(r'\{.*\}', content_clean, re.DOTALL)
-            if json_match:
-                content_clean = json_match.group(0)
-        
-        parsed = json.loads(content_clean)
-        logger.info(f"JSON распарсен успешно: {parsed}")
-        return {
-            "is_event": bool(parsed.get("is_event")),
-            "title": parsed.get("title"),
-            "date": parsed.get("date"),
-            "place": parsed.get("place"),
-            "link": parsed.get("link"),
-            "description": parsed.get("description"),
-        }
+        return _parse_content(content or "")
     except json.JSONDecodeError as e:
-        logger.error(f"Ошибка парсинга JSON от LLM. Ответ: {content[:500] if 'content' in locals() else 'нет ответа'}. Ошибка: {e}")
-        return {
-            "is_event": False,
-            "title": None,
-            "date": None,
-            "place": None,
-            "link": None,
-            "description": None,
-        }
+        logger.error(f"Ошибка парсинга JSON от LLM. Ответ: {(content or 'нет ответа')[:500]}. Ошибка: {e}")
+        return None
     except Exception as e:
-        logger.error(f"Ошибка LLM запроса: {type(e).__name__}: {e}", exc_info=True)
-        return {
-            "is_event": False,
-            "title": None,
-            "date": None,
-            "place": None,
-            "link": None,
-            "description": None,
-        }
+        logger.error(f"Ошибка разбора ответа LLM: {type(e).__name__}: {e}")
+        return None
+
+
+def _record_request(mode: str, started: float, completion: Any = None, status: Optional[str] = None) -> None:
+    """Метрики запроса к LLM: длительность, итог и токены из usage (если API их вернул)"""
+    LLM_SECONDS.observe(time.perf_counter() - started, mode=mode)
+    LLM_REQUESTS.inc(mode=mode, status=status or ("ok" if completion is not None else "error"))
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, mode=mode, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, mode=mode, kind="completion")
+
+
+def _request_mode() -> str:
+    """Каким запросом в текущей настройке проверяется пост: single, stream или batch"""
+    if os.getenv("LLM_BATCH_MODE", "0") == "1":
+        return "batch"
+    return "stream" if _streaming_enabled() else "single"
+
+
+def _cache_key(text: str, label: str, mode: str) -> str:
+    # В ключе промпт и вид запроса, которыми получен ответ: вердикт пакетного запроса
+    # не выдаётся за ответ на одиночный промпт и наоборот
+    prompt = _read_template(BATCH_PROMPT_PATH) if mode == "batch" else _load_prompt()
+    return make_cache_key(text, prompt, label, mode)
+
+
+async def _cache_lookup(text: str, label: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Найти ответ в кэше; label — модель (или «быстрая>основная» для каскада).
+
+    Возвращает label для последующей записи (None, если кэш выключен) и найденный ответ.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None, None
+    mode = _request_mode()
+    # Пакетный режим сам проверяет по одному посты без ответа в пакете, поэтому ему подходят и одиночные ответы
+    modes = [mode, "single"] if mode == "batch" else [mode]
+    cached = None
+    for candidate in modes:
+        cached = await cache.get(_cache_key(text, label, candidate))
+        if cached is not None:
+            break
+    LLM_CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        logger.info("Результат LLM взят из кэша")
+    return label, cached
+
+
+async def _cache_store(
+    text: str, label: Optional[str], mode: str, result: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    if result is None:
+        return _error_result()
+    cache = get_cache()
+    if label is not None and cache is not None:
+        await cache.put(_cache_key(text, label, mode), result)
+    return result
+
+
+def _streaming_enabled() -> bool:
+    return os.getenv("LLM_STREAMING", "0") == "1"
+
+
+def _stream_kwargs(model: str, prompt: str) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": 0.1,
+        "stream": True,
+    }
+    if _schema_supported and os.getenv("LLM_JSON_SCHEMA", "1") == "1":
+        # Структурированный ответ и usage в последнем фрагменте потока
+        kwargs["response_format"] = RESPONSE_FORMAT
+        kwargs["stream_options"] = {"include_usage": True}
+    return kwargs
+
+
+# По этим словам в param или тексте ошибки видно, что эндпоинт отверг именно структурированный ответ,
+# а не, например, слишком длинный контекст или фильтр содержимого
+_SCHEMA_ERROR_MARKERS = ("response_format", "json_schema", "stream_options")
+
+
+def _schema_rejected(kwargs: Dict[str, Any], error: Exception) -> bool:
+    """Эндпоинт отклонил response_format: запоминаем и повторяем запрос без него"""
+    global _schema_supported
+    if "response_format" not in kwargs or not isinstance(error, (BadRequestError, UnprocessableEntityError)):
+        return False
+    details = f"{getattr(error, 'param', None) or ''} {getattr(error, 'message', None) or error}".lower()
+    if not any(marker in details for marker in _SCHEMA_ERROR_MARKERS):
+        return False
+    _schema_supported = False
+    logger.warning(f"Эндпоинт LLM не принимает response_format json_schema, дальше без него: {error}")
+    return True
+
+
+def _feed_chunk(parser: StreamParser, chunk: Any) -> Optional[bool]:
+    # Фрагменты reasoning_content и прочие поля дельты не нужны: разбираем только content
+    for choice in chunk.choices or []:
+        delta = choice.delta.content if choice.delta is not None else None
+        if delta:
+            parser.feed(delta)
+    return parser.verdict
+
+
+def _finish_stream(mode: str, started: float, parser: StreamParser, last: Any) -> Dict[str, Any]:
+    """Итог потокового запроса: ранний отказ без дочитывания или разбор полного ответа"""
+    if parser.verdict is False:
+        _record_request(mode, started, last, status="early_stop")
+        logger.info("LLM: не событие (поток остановлен после вердикта)")
+        return _empty_result()
+    _record_request(mode, started, last, status="ok")
+    return _handle_content(parser.finish())
+
+
+async def _stream_async(model: str, prompt: str, started: float) -> Optional[Dict[str, Any]]:
+    kwargs = _stream_kwargs(model, prompt)
+    client = _get_async_client()
+    try:
+        stream = await client.chat.completions.create(**kwargs)
+    except Exception as e:
+        if not _schema_rejected(kwargs, e):
+            raise
+        stream = await client.chat.completions.create(**_stream_kwargs(model, prompt))
+    parser = StreamParser()
+    last = None
+    try:
+        async for chunk in stream:
+            last = chunk if getattr(chunk, "usage", None) is not None else last
+            if _feed_chunk(parser, chunk) is False:
+                break
+    finally:
+        await stream.close()
+    return _finish_stream("stream", started, parser, last)
+
+
+async def _detect_single(text: str, label: Optional[str]) -> Dict[str, Any]:
+    prompt = _build_prompt(text)
+    model = _model()
+    if _streaming_enabled():
+        async with _get_semaphore():
+            started = time.perf_counter()
+            try:
+                logger.info(f"Отправка потокового запроса к LLM (модель: {model})")
+                result = await _stream_async(model, prompt, started)
+            except Exception as e:
+                _record_request("stream", started)
+                logger.error(f"Ошибка LLM запроса: {type(e).__name__}: {e}", exc_info=True)
+                return _error_result()
+        return await _cache_store(text, label, "stream", result)
+    async with _get_semaphore():
+        started = time.perf_counter()
+        try:
+            logger.info(f"Отправка запроса к LLM (модель: {model})")
+            completion = await _get_async_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+            )
+        except Exception as e:
+            _record_request("single", started)
+            logger.error(f"Ошибка LLM запроса: {type(e).__name__}: {e}", exc_info=True)
+            return _error_result()
+        _record_request("single", started, completion)
+    return await _cache_store(text, label, "single", _handle_content(completion.choices[0].message.content))
+
+
+async def _detect_batch(items: List[Tuple[str, Optional[str]]]) -> List[Dict[str, Any]]:
+    """Один запрос на несколько постов; посты без валидного ответа проверяются по одному"""
+    texts = [text for text, _ in items]
+    prompt = _build_batch_prompt(texts)
+    model = _model()
+    parsed: Dict[int, Dict[str, Any]] = {}
+    async with _get_semaphore():
+        started = time.perf_counter()
+        completion = None
+        try:
+            logger.info(f"Отправка пакетного запроса к LLM: {len(items)} постов (модель: {model})")
+            completion = await _get_async_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.1,
+            )
+            _record_request("batch", started, completion)
+            content = completion.choices[0].message.content or ""
+            logger.info(f"LLM пакетный ответ получен (полный): {content}")
+            parsed = _parse_batch_content(content, len(items))
+        except Exception as e:
+            if completion is None:
+                _record_request("batch", started)
+            logger.error(f"Ошибка пакетного запроса к LLM: {type(e).__name__}: {e}")
+
+    missing = [i for i in range(1, len(items) + 1) if i not in parsed]
+    if missing:
+        logger.warning(f"Пакетный ответ LLM неполный ({len(missing)} из {len(items)}), проверяю эти посты по одному")
+    fallback = await asyncio.gather(*(_detect_single(*items[i - 1]) for i in missing))
+    results = dict(zip(missing, fallback))
+    for i, result in parsed.items():
+        results[i] = await _cache_store(*items[i - 1], "batch", result)
+    return [results[i] for i in range(1, len(items) + 1)]
+
+
+class _BatchCollector:
+    """Собирает посты из всех каналов в пакетные запросы к LLM.
+
+    Пакет уходит, когда набран бюджет токенов или число постов, либо по истечении
+    короткого окна ожидания — так посты одного цикла делят общий длинный промпт.
+    """
+
+    def __init__(self, token_budget: int, max_posts: int, window_seconds: float):
+        self.token_budget = token_budget
+        self.max_posts = max_posts
+        self.window_seconds = window_seconds
+        self._pending: List[Tuple[str, Optional[str], asyncio.Future]] = []
+        self._tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, text: str, label: Optional[str]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = _estimate_tokens(text)
+        if self._pending and self._tokens + tokens > self.token_budget:
+            self._flush()
+        self._pending.append((text, label, future))
+        self._tokens += tokens
+        if len(self._pending) >= self.max_posts or self._tokens >= self.token_budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, Optional[str], asyncio.Future]]) -> None:
+        items = [(text, label) for text, label, _ in batch]
+        try:
+            if len(items) == 1:
+                results = [await _detect_single(*items[0])]
+            else:
+                results = await _detect_batch(items)
+        except Exception as e:
+            logger.error(f"Ошибка обработки пакета LLM: {type(e).__name__}: {e}", exc_info=True)
+            results = [_error_result() for _ in items]
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_batcher: Optional[_BatchCollector] = None
+
+
+def _get_batcher() -> Optional[_BatchCollector]:
+    """Сборщик пакетов или None, если пакетный режим выключен (LLM_BATCH_MODE=0)"""
+    global _batcher
+    if os.getenv("LLM_BATCH_MODE", "0") != "1":
+        return None
+    if _batcher is None:
+        _batcher = _BatchCollector(
+            token_budget=int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "6000")),
+            max_posts=int(os.getenv("LLM_BATCH_MAX_POSTS", "10")),
+            window_seconds=float(os.getenv("LLM_BATCH_WINDOW_MS", "300")) / 1000,
+        )
+    return _batcher
+
+
+def _parse_triage(content: str) -> Tuple[bool, float]:
+    match = re.search(r"\{.*\}", _strip_reasoning(content), re.DOTALL)
+    parsed = json.loads(match.group(0) if match else content)
+    try:
+        confidence = float(parsed.get("confidence"))
+    except (TypeError, ValueError):
+        # Без оценки уверенности пост считается сомнительным и уходит основной модели
+        confidence = 0.0
+    return bool(parsed.get("is_event")), min(max(confidence, 0.0), 1.0)
+
+
+async def _triage(text: str, model: str) -> Optional[Tuple[bool, float]]:
+    """Вердикт быстрой модели и её уверенность; None — запрос или разбор не удался"""
+    prompt = _read_template(TRIAGE_PROMPT_PATH).replace("{text}", text)
+    async with _get_triage_semaphore():
+        started = time.perf_counter()
+        try:
+            completion = await _get_triage_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+            )
+        except Exception as e:
+            _record_request("triage", started)
+            logger.warning(f"Ошибка запроса к быстрой модели: {type(e).__name__}: {e}")
+            return None
+        _record_request("triage", started, completion)
+    content = completion.choices[0].message.content or ""
+    try:
+        return _parse_triage(content)
+    except Exception as e:
+        logger.warning(f"Не удалось разобрать ответ быстрой модели: {type(e).__name__}: {content[:200]}")
+        return None
+
+
+async def _detect_full(text: str, label: Optional[str]) -> Dict[str, Any]:
+    batcher = _get_batcher()
+    if batcher is not None:
+        return await batcher.submit(text, label)
+    return await _detect_single(text, label)
+
+
+async def _detect_cascade(text: str, label: Optional[str], cascade_model: str) -> Dict[str, Any]:
+    """Сначала быстрая модель; основной достаются сомнительные и положительные посты.
+
+    Уверенные отрицательные ответы принимаются сразу, кроме доли LLM_CASCADE_AUDIT_RATE:
+    их всё равно проверяет основная модель, чтобы было видно, как часто быстрая ошибается.
+    """
+    triage = await _triage(text, cascade_model)
+    threshold = float(os.getenv("LLM_CASCADE_CONFIDENCE", "0.8"))
+    if triage is None:
+        decision = "error"
+    elif triage[0]:
+        decision = "positive"
+    elif triage[1] < threshold:
+        decision = "uncertain"
+    elif random.random() < float(os.getenv("LLM_CASCADE_AUDIT_RATE", "0.02")):
+        decision = "audit"
+    else:
+        CASCADE_DECISIONS.inc(decision="resolved")
+        logger.info(f"Быстрая модель: не событие (уверенность {triage[1]:.2f})")
+        # Отказ быстрой модели хранится под видом запроса основной: label каскада его уже отличает
+        resolved = {**_empty_result(), "triage_confidence": round(triage[1], 3)}
+        return await _cache_store(text, label, _request_mode(), resolved)
+    CASCADE_DECISIONS.inc(decision=decision)
+    result = await _detect_full(text, label)
+    if triage is not None:
+        verdict = "event" if result["is_event"] else "not_event"
+        agree = triage[0] == result["is_event"]
+        CASCADE_AGREEMENT.inc(decision=decision, result="agree" if agree else "disagree")
+        CASCADE_CONFIDENCE.observe(triage[1], verdict=verdict)
+    return result
+
+
+async def llm_detect_async(text: str) -> Dict[str, Any]:
+    """Асинхронный вызов LLM: не блокирует event loop, число запросов ограничено LLM_MAX_CONCURRENCY.
 
+    В пакетном режиме (LLM_BATCH_MODE=1) пост ждёт попутчиков и уходит в общем запросе.
+    С каскадом (LLM_CASCADE_MODEL) пост сначала оценивает быстрая модель.
+    """
+    text = prepare_text(text)
+    model = _model()
+    cascade_model = _cascade_model()
+    # Ответы каскада кэшируются отдельно: уверенный отказ быстрой модели — не вердикт основной
+    label, cached = await _cache_lookup(text, f"{cascade_model}>{model}" if cascade_model else model)
+    if cached is not None:
+        return cached
+    if cascade_model:
+        return await _detect_cascade(text, label, cascade_model)
+    return await _detect_full(text, label)
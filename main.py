@@ -1,21 +1,35 @@
 import asyncio
-import json
 import logging
 import os
-import threading
-from datetime import datetime, timedelta
-from pathlib import Path
-from typing import List, Dict, Any
+import signal
+import time
+from typing import List, Dict, Any, Set
 
 from dotenv import load_dotenv
 from telegram.ext import Application
+from telethon.errors import FloodWaitError
 
-from database.db import init_db, is_post_processed, add_processed_post, mark_as_sent
-from detectors.first_pass import quick_check
-from detectors.second_pass import llm_detect
-from processors.formatter import format_event_message
-from tg_client.reader import init_client, fetch_new_posts
-from tg_client.bot import init_bot, send_message
+from database.db import (
+    init_db,
+    close_db,
+    get_channel_cursor,
+    get_post_state,
+    get_pipeline_backlog,
+    purge_deliveries,
+    run_db,
+)
+from detectors.second_pass import close_llm_client
+from detectors.llm_cache import get_cache
+from detectors.near_duplicate import rebuild_index
+from monitoring.metrics import CYCLE_SECONDS, QUEUE_SIZE
+from monitoring.server import start_metrics_server
+from pipeline.stages import Pipeline
+from polling.channels import ChannelListWatcher, load_channels
+from polling.leases import ShardCoordinator, sharding_enabled
+from polling.scheduler import AdaptiveScheduler
+from tg_client.entities import is_available, resolve_channels
+from tg_client.reader import init_client, fetch_new_posts, get_request_budget, session_name, subscribe_channels
+from tg_client.bot import init_bot
 from bot_handler import setup_bot_handlers
 
 
@@ -25,80 +39,109 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-CHANNELS_PATH = Path(__file__).resolve().parent / "channels.json"
+_channel_locks: Dict[str, asyncio.Lock] = {}
 
 
-def load_channels() -> List[str]:
-    if not CHANNELS_PATH.exists():
-        return []
-    try:
-        data = json.loads(CHANNELS_PATH.read_text(encoding="utf-8"))
-        return [c.strip().lstrip("@") for c in data if c.strip()]
-    except Exception:
-        return []
-
-
-async def process_channel(client, bot, channel: str) -> None:
-    posts = await fetch_new_posts(client, channel, limit=10)
-    logger.info("Канал %s: найдено %s новых постов", channel, len(posts))
-
-    # Игнорируем посты старше 7 дней
-    cutoff_date = datetime.now() - timedelta(days=7)
-    
-    for post in posts:
-        post_id = post["id"]
-        text = post["text"]
-        date_str = post["date"]
-        source_link = f"https://t.me/{channel}/{post_id}"
-
-        if is_post_processed(channel, post_id):
-            continue
-        
-        # Проверяем дату поста - игнорируем старые посты
+def _channel_lock(channel: str) -> asyncio.Lock:
+    """Посты одного канала обрабатываются строго по очереди (опрос и push не пересекаются)"""
+    lock = _channel_locks.get(channel)
+    if lock is None:
+        lock = _channel_locks[channel] = asyncio.Lock()
+    return lock
+
+
+async def process_channel(client, pipeline: Pipeline, channel: str) -> int:
+    """Прочитать новые посты канала и поставить их в очередь проверки; вернуть их число"""
+    async with _channel_lock(channel):
+        last_post_id = await run_db(get_channel_cursor, channel)
+        posts, last_id = await fetch_new_posts(client, channel, limit=10, min_id=last_post_id)
+        logger.info("Канал %s: найдено %s новых постов", channel, len(posts))
+        # Курсор — по последнему прочитанному сообщению, включая медиа без текста
+        await pipeline.stage_posts(channel, posts, cursor=last_id)
+        return len(posts)
+
+
+async def handle_pushed_post(client, pipeline: Pipeline, channel: str, post: Dict[str, Any], edited: bool) -> None:
+    """Обработать пост, пришедший апдейтом от Telegram (режим INGESTION_MODE=push)"""
+    async with _channel_lock(channel):
+        last_post_id = await run_db(get_channel_cursor, channel)
+        if last_post_id is not None and post["id"] <= last_post_id:
+            if edited and post["text"]:
+                await _reprocess_edited_post(pipeline, channel, post)
+            return
+        if last_post_id is not None and post["id"] > last_post_id + 1:
+            # Между курсором и апдейтом есть пропуск (например, после переподключения) — добираем историю
+            logger.info(f"Канал {channel}: пропуск после поста {last_post_id}, дочитываю историю")
+            posts, _ = await fetch_new_posts(client, channel, min_id=last_post_id)
+        else:
+            posts = [post] if post["text"] else []
+        await pipeline.stage_posts(channel, posts, cursor=post["id"])
+
+
+async def _reprocess_edited_post(pipeline: Pipeline, channel: str, post: Dict[str, Any]) -> None:
+    # Перепроверяем только посты, которые раньше не признали событием: разосланное не трогаем
+    state = await run_db(get_post_state, channel, post["id"])
+    if state is not None and (state["is_event"] or state["sent_to_bot"]):
+        return
+    logger.info(f"Канал {channel}, пост {post['id']}: пост отредактирован, проверяю заново")
+    await pipeline.stage_posts(channel, [post], replace=True)
+
+
+class ChannelPoller:
+    """Параллельный опрос каналов: не больше `max_concurrent` каналов одновременно.
+
+    FloodWaitError по каналу откладывает только этот канал: он пропускается в
+    обычных циклах и опрашивается отдельной задачей, когда истечёт ожидание.
+    """
+
+    def __init__(self, client, pipeline: Pipeline, max_concurrent: int):
+        self.client = client
+        self.pipeline = pipeline
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        self._retry_tasks: Dict[str, asyncio.Task] = {}
+        self._active: Set[str] = set()
+        self._stopping = False
+
+    def stop(self) -> None:
+        """Не начинать новых опросов: уже идущие дорабатывают, отложенные повторы снимаются"""
+        self._stopping = True
+        for task in self._retry_tasks.values():
+            task.cancel()
+        self._retry_tasks.clear()
+
+    async def _poll(self, channel: str) -> None:
+        self._active.add(channel)
         try:
-            if isinstance(date_str, str):
-                post_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-            else:
-                post_date = date_str
-            if isinstance(post_date, datetime):
-                # Убираем timezone для сравнения
-                post_date_naive = post_date.replace(tzinfo=None) if post_date.tzinfo else post_date
-                if post_date_naive < cutoff_date:
-                    logger.info(f"Канал {channel}, пост {post_id}: пост слишком старый ({post_date_naive}), пропускаю")
-                    add_processed_post(channel, post_id, date_str, text, False, {})
-                    continue
-        except Exception as e:
-            logger.warning(f"Канал {channel}, пост {post_id}: не удалось распарсить дату {date_str}: {e}")
-            # Продолжаем обработку, если не удалось распарсить дату
-
-        if not quick_check(text):
-            logger.info(f"Канал {channel}, пост {post_id}: не прошёл first_pass (быстрая проверка)")
-            add_processed_post(channel, post_id, date_str, text, False, {})
-            continue
-
-        logger.info(f"Канал {channel}, пост {post_id}: прошёл first_pass, вызываю LLM...")
-        result = llm_detect(text)
-        is_event = bool(result.get("is_event"))
-        add_processed_post(channel, post_id, date_str, text, is_event, result)
-
-        if is_event:
-            # Проверяем, что есть хотя бы какая-то полезная информация
-            # Если все поля пустые (null), то это не полноценное событие (например, дайджест)
-            has_useful_data = any([
-                result.get("title"),
-                result.get("date"),
-                result.get("place"),
-                result.get("link"),
-                result.get("description")
-            ])
-            
-            if has_useful_data:
-                message = format_event_message(result, source_link)
-                await send_message(bot, message)
-                mark_as_sent(channel, post_id)
-            else:
-                logger.info(f"Канал {channel}, пост {post_id}: событие без полезных данных (дайджест?), пропускаю отправку в бот")
-                # Не отправляем, но помечаем как обработанное
+            async with self._semaphore:
+                if self._stopping:
+                    return
+                await process_channel(self.client, self.pipeline, channel)
+        except FloodWaitError as e:
+            self._reschedule(channel, e.seconds)
+        except Exception as exc:
+            logger.exception("Ошибка обработки канала %s: %s", channel, exc)
+        finally:
+            self._active.discard(channel)
+
+    def _reschedule(self, channel: str, seconds: int) -> None:
+        logger.warning(f"Канал {channel}: FloodWait {seconds} с, повторю только этот канал позже")
+        if channel not in self._retry_tasks and not self._stopping:
+            self._retry_tasks[channel] = asyncio.create_task(self._retry_later(channel, seconds))
+
+    async def _retry_later(self, channel: str, seconds: int) -> None:
+        await asyncio.sleep(seconds)
+        self._retry_tasks.pop(channel, None)
+        await self._poll(channel)
+
+    async def run_cycle(self, channels: List[str]) -> None:
+        ready = [
+            c for c in channels
+            if c not in self._retry_tasks and c not in self._active and is_available(c)
+        ]
+        skipped = len(channels) - len(ready)
+        if skipped:
+            logger.info(f"Пропускаю {skipped} каналов (FloodWait, ещё обрабатываются или недоступны)")
+        await asyncio.gather(*(self._poll(c) for c in ready))
 
 
 async def worker():
@@ -109,45 +152,180 @@ async def worker():
     else:
         poll_interval_minutes = float(os.getenv("POLL_INTERVAL_MINUTES", "30"))
         poll_interval_seconds = poll_interval_minutes * 60
-    channels = load_channels()
-    if not channels:
+    all_channels = load_channels()
+    if not all_channels:
         logger.warning("Нет каналов в channels.json")
 
+    # Сколько ждать завершения начатой работы при остановке сервиса
+    shutdown_timeout = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "30"))
+
     client = await init_client()
     logger.info("Telethon клиент подключен")
-    
-    # Создаем Application для обработки команд бота
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    if bot_token:
-        application = Application.builder().token(bot_token).build()
-        setup_bot_handlers(application)
-        
-        # Запускаем бота для обработки команд в отдельном потоке
-        def run_bot():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                application.run_polling(drop_pending_updates=True, stop_signals=None)
-            except Exception as e:
-                logger.error(f"Ошибка в боте: {e}", exc_info=True)
-            finally:
-                loop.close()
-        
-        bot_thread = threading.Thread(target=run_bot, daemon=True)
-        bot_thread.start()
-        logger.info("Бот запущен для обработки команд")
-    
-    # Создаем простой Bot для отправки сообщений (для обратной совместимости)
+    session = session_name()
+
+    metrics_server = await start_metrics_server()
+    # История для поиска почти-дубликатов загружается фоном и не задерживает старт
+    index_task = asyncio.create_task(rebuild_index())
+
+    # Один Bot с общим пулом соединений на всё: рассылку конвейера и ответы на команды.
+    # Application работает в этом же event loop, что и Telethon, — отдельных потоков нет.
     bot = init_bot()
-    logger.info("Сервис запущен, начинаю обработку каналов...")
+    application = Application.builder().bot(bot).build()
+    setup_bot_handlers(application)
+    await application.initialize()
+    # Проверка и рассылка идут своими воркерами и не задерживают опрос каналов
+    pipeline = Pipeline(bot)
+
+    async def start_bot_polling() -> None:
+        if application.running:
+            return
+        await application.start()
+        await application.updater.start_polling(drop_pending_updates=True)
+        logger.info("Бот запущен для обработки команд")
+
+    async def stop_bot_polling() -> None:
+        # Команды, которые уже обрабатываются, application.stop() дожидается
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+
+    async def on_leadership(leader: bool) -> None:
+        # Бот и рассылка — только у ведущего: один getUpdates на токен и общий лимит отправок
+        if leader:
+            await start_bot_polling()
+            # Отправки прежнего ведущего моложе срока аренды не трогаем: он может их ещё дорабатывать
+            await pipeline.start(reclaim_older_than=coordinator.ttl, shared=True)
+        else:
+            await stop_bot_polling()
+            await pipeline.stop(shutdown_timeout)
+
+    coordinator = None
+    if sharding_enabled():
+        # Каналы делятся между воркерами; apply_channels назначается ниже, до первого пульса
+        coordinator = ShardCoordinator(session, on_assign=lambda assigned: apply_channels(assigned),
+                                       on_leadership=on_leadership)
+        channels = await coordinator.start(all_channels)
+    else:
+        channels = list(all_channels)
+        await start_bot_polling()
+        await pipeline.start()
+    await resolve_channels(client, session, channels, get_request_budget())
+
+    max_concurrent = int(os.getenv("MAX_CONCURRENT_CHANNELS", "4"))
+    poller = ChannelPoller(client, pipeline, max_concurrent)
+    scheduler = None
+    unsubscribe = None
+    push_mode = os.getenv("INGESTION_MODE", "poll") == "push"
+
+    if push_mode:
+        # Посты приходят апдейтами сразу после публикации, а редкий опрос
+        # только добирает то, что могло потеряться при переподключениях
+        async def on_push(channel: str, post: Dict[str, Any], edited: bool) -> None:
+            try:
+                await handle_pushed_post(client, pipeline, channel, post, edited)
+            except FloodWaitError as e:
+                logger.warning(f"Канал {channel}: FloodWait {e.seconds} с при обработке апдейта, доберу при опросе")
+            except Exception as exc:
+                logger.exception("Ошибка обработки апдейта канала %s: %s", channel, exc)
+
+        unsubscribe = subscribe_channels(client, channels, on_push)
+        poll_interval_seconds = float(os.getenv("PUSH_SWEEP_INTERVAL_MINUTES", "60")) * 60
+        logger.info("Режим push: подписка на апдейты каналов, опрос раз в %.0f мин", poll_interval_seconds / 60)
+    elif os.getenv("POLL_SCHEDULE", "fixed") == "adaptive":
+        # У каждого канала своё время опроса; цикл ниже только пишет состояние очередей
+        scheduler = AdaptiveScheduler(lambda channel: process_channel(client, pipeline, channel), max_concurrent)
+        await scheduler.start(channels)
 
-    while True:
+    async def apply_channels(new_channels: List[str]) -> None:
+        nonlocal unsubscribe
+        added = sorted(set(new_channels) - set(channels))
+        removed = sorted(set(channels) - set(new_channels))
+        if not added and not removed:
+            return
+        logger.info(f"Список каналов изменён: добавлены {added or '-'}, удалены {removed or '-'}")
+        await resolve_channels(client, session, new_channels, get_request_budget())
+        # Список меняется на месте: цикл опроса ниже читает его при каждом проходе
+        channels[:] = new_channels
+        if scheduler is not None:
+            await scheduler.set_channels(channels)
+        if unsubscribe is not None:
+            unsubscribe()
+            unsubscribe = subscribe_channels(client, channels, on_push)
+
+    if coordinator is not None:
+        # Новый channels.json перераспределяется между воркерами, свои каналы приходят в apply_channels
+        watcher = ChannelListWatcher(coordinator.set_channels)
+        coordinator.start_heartbeat()
+    else:
+        watcher = ChannelListWatcher(apply_channels)
+    watcher.start()
+
+    # SIGTERM/SIGINT не прерывают работу на полуслове: цикл ниже выходит, и сервис
+    # останавливается по порядку, дожидаясь начатых опросов, проверок и отправок
+    stopping = asyncio.Event()
+
+    def request_stop(signame: str) -> None:
+        if not stopping.is_set():
+            logger.info(f"Получен {signame}, завершаю работу...")
+            stopping.set()
+            poller.stop()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            for channel in channels:
-                await process_channel(client, bot, channel)
-        except Exception as exc:
-            logger.exception("Ошибка цикла: %s", exc)
-        await asyncio.sleep(poll_interval_seconds)
+            loop.add_signal_handler(sig, request_stop, sig.name)
+        except NotImplementedError:
+            # Windows: остаётся KeyboardInterrupt
+            pass
+
+    logger.info(f"Сервис запущен, начинаю обработку каналов (параллельно: {max_concurrent})...")
+
+    try:
+        while not stopping.is_set():
+            if scheduler is None:
+                started = time.monotonic()
+                try:
+                    await poller.run_cycle(channels)
+                except Exception as exc:
+                    logger.exception("Ошибка цикла: %s", exc)
+                elapsed = time.monotonic() - started
+                CYCLE_SECONDS.observe(elapsed)
+                logger.info(f"Цикл обработки каналов занял {elapsed:.1f} с")
+            backlog = await run_db(get_pipeline_backlog)
+            for queue, size in backlog.items():
+                QUEUE_SIZE.set(size, queue=queue)
+            logger.info(f"Очереди конвейера: {backlog}")
+            cache = get_cache()
+            if cache is not None:
+                logger.info(f"Кэш LLM: {cache.stats()}")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        # Сначала перестаём брать новую работу, затем дожидаемся начатой и закрываем соединения
+        index_task.cancel()
+        await watcher.stop()
+        if coordinator is not None:
+            await coordinator.stop_heartbeat()
+        if unsubscribe is not None:
+            unsubscribe()
+        poller.stop()
+        if scheduler is not None:
+            await scheduler.stop(shutdown_timeout)
+        await stop_bot_polling()
+        await pipeline.stop(shutdown_timeout)
+        # Закрывает и пул соединений общего Bot
+        await application.shutdown()
+        if coordinator is not None:
+            await coordinator.stop()
+        await client.disconnect()
+        if metrics_server is not None:
+            metrics_server.close()
+        await close_llm_client()
+        close_db()
+        logger.info("Сервис остановлен")
 
 
 def main():
@@ -156,6 +334,10 @@ def main():
     if not env_loaded:
         load_dotenv("env.sample")
     init_db()
+    cache = get_cache()
+    if cache is not None:
+        logger.info(f"Кэш LLM: удалено устаревших записей: {cache.purge_expired()}")
+    logger.info(f"Исходящие: удалено завершённых записей: {purge_deliveries(30)}")
     asyncio.run(worker())
 
 
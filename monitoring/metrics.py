@@ -0,0 +1,245 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Минимальная реализация метрик в формате Prometheus без внешних зависимостей.
+# Запись — одно обращение к словарю под блокировкой; текст для /metrics
+# собирается только во время опроса, поэтому без опроса накладные расходы почти нулевые.
+
+LabelValues = Tuple[str, ...]
+
+# Границы корзин по умолчанию (секунды): от миллисекунд для first_pass до минут для LLM
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return header + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def items(self) -> Dict[LabelValues, float]:
+        """Значения по всем комбинациям меток"""
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """Текущее значение (размер очереди и т.п.)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    """Распределение длительностей по корзинам (cumulative, как в Prometheus)"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # На каждую комбинацию меток: счётчики по корзинам (+Inf последней), сумма, число
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+            entry[1][1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self, **labels: str) -> Optional[Tuple[List[int], float, int]]:
+        """Счётчики по корзинам, сумма и число наблюдений (для отчётов бенчмарков)"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None:
+                return None
+            return list(entry[0]), entry[1][0], int(entry[1][1])
+
+    def merged(self) -> Tuple[List[int], float, int]:
+        """То же, что snapshot, но суммарно по всем значениям меток"""
+        counts = [0] * (len(self.buckets) + 1)
+        total, count = 0.0, 0
+        with self._lock:
+            for bucket_counts, (entry_total, entry_count) in self._values.values():
+                counts = [a + b for a, b in zip(counts, bucket_counts)]
+                total += entry_total
+                count += int(entry_count)
+        return counts, total, count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины), суммарно по всем меткам"""
+        counts, _, count = self.merged()
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return lower
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), list(totals)) for key, (counts, totals) in self._values.items()]
+        lines = []
+        for key, counts, (total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {_format_value(count)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Метрики стадий обработки
+
+FETCH_SECONDS = Histogram(
+    "tgparser_fetch_seconds", "Время чтения новых сообщений канала через Telethon", ["channel"]
+)
+POSTS_FETCHED = Counter("tgparser_posts_fetched_total", "Получено постов", ["channel"])
+FIRST_PASS_SECONDS = Histogram(
+    "tgparser_first_pass_seconds", "Время быстрой проверки поста (first_pass)"
+)
+POSTS_CLASSIFIED = Counter(
+    "tgparser_posts_classified_total",
+    "Итог проверки поста: too_old, no_rules, past_dates, duplicate, gate_skip, event, not_event, retry, error",
+    ["outcome"],
+)
+LLM_SECONDS = Histogram("tgparser_llm_request_seconds", "Длительность запроса к LLM", ["mode"])
+LLM_REQUESTS = Counter("tgparser_llm_requests_total", "Запросы к LLM", ["mode", "status"])
+LLM_TOKENS = Counter("tgparser_llm_tokens_total", "Токены LLM по данным API", ["mode", "kind"])
+LLM_INPUT_TOKENS_SAVED = Counter(
+    "tgparser_llm_input_tokens_saved_total", "Токены текста постов, убранные предобработкой перед LLM"
+)
+CASCADE_DECISIONS = Counter(
+    "tgparser_llm_cascade_decisions_total",
+    "Решения каскада: resolved (ответ быстрой модели), uncertain, positive, audit (проверка), error",
+    ["decision"],
+)
+CASCADE_AGREEMENT = Counter(
+    "tgparser_llm_cascade_agreement_total", "Совпадение вердиктов быстрой и основной модели", ["decision", "result"]
+)
+CASCADE_CONFIDENCE = Histogram(
+    "tgparser_llm_cascade_confidence",
+    "Уверенность быстрой модели по итоговому вердикту основной модели",
+    ["verdict"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0),
+)
+LLM_CACHE_LOOKUPS = Counter("tgparser_llm_cache_lookups_total", "Обращения к кэшу LLM", ["result"])
+DB_SECONDS = Histogram("tgparser_db_seconds", "Время операций с БД в потоке БД", ["op"])
+SEND_SECONDS = Histogram("tgparser_send_seconds", "Время доставки сообщения одному получателю", ["outcome"])
+CYCLE_SECONDS = Histogram(
+    "tgparser_cycle_seconds", "Длительность цикла опроса каналов", buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+QUEUE_SIZE = Gauge("tgparser_queue_size", "Размер очередей конвейера", ["queue"])
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import logging
+from typing import Optional
+
+from monitoring.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else ""
+        if path.split("?", 1)[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", b"not found\n", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server() -> Optional[asyncio.AbstractServer]:
+    """Запустить HTTP-эндпоинт /metrics в текущем event loop (METRICS_PORT=0 — выключен)"""
+    port = int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
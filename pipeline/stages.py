@@ -0,0 +1,382 @@
+import asyncio
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+from database.db import (
+    run_db,
+    WriteBatch,
+    claim_fetched_posts,
+    claim_due_deliveries,
+    complete_deliveries,
+    reset_pipeline_claims,
+)
+from detectors.dates import all_past, date_filter_enabled, event_start, extract_dates, local_now
+from detectors.first_pass import match_rules
+from detectors.second_pass import llm_detect_async
+from detectors.scoring import get_gate, is_labelled, skip_threshold
+from detectors.near_duplicate import get_index as get_near_duplicate_index
+from monitoring.metrics import FIRST_PASS_SECONDS, POSTS_CLASSIFIED
+from processors.formatter import format_event_message
+from tg_client.bot import BroadcastStats, get_recipients, try_deliver, DELIVERY_SENT, DELIVERY_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Конвейер из трёх стадий, связанных очередями в SQLite:
+#   получение → processed_posts (stage = fetched) → проверка → deliveries (pending) → отправка.
+# Каждая стадия разбирает свою очередь своими воркерами, поэтому медленная рассылка
+# не тормозит чтение каналов, а прерванная работа продолжается после перезапуска.
+
+
+def has_useful_data(result: Dict[str, Any]) -> bool:
+    # Если все поля пустые (null), то это не полноценное событие (например, дайджест)
+    return any([
+        result.get("title"),
+        result.get("date"),
+        result.get("place"),
+        result.get("link"),
+        result.get("description")
+    ])
+
+
+def with_event_at(result: Dict[str, Any], text: str, post_date: Any) -> Dict[str, Any]:
+    """Результат LLM с нормализованным началом события — для сортировки и отбора предстоящих"""
+    started = event_start(result.get("date"), text, post_date)
+    return {**result, "event_at": started.isoformat(timespec="minutes") if started else None}
+
+
+def _is_too_old(channel: str, post_id: int, date_str: Any, cutoff_date: datetime) -> bool:
+    try:
+        if isinstance(date_str, str):
+            post_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        else:
+            post_date = date_str
+        if isinstance(post_date, datetime):
+            # Убираем timezone для сравнения
+            post_date_naive = post_date.replace(tzinfo=None) if post_date.tzinfo else post_date
+            if post_date_naive < cutoff_date:
+                logger.info(f"Канал {channel}, пост {post_id}: пост слишком старый ({post_date_naive}), пропускаю")
+                return True
+    except Exception as e:
+        logger.warning(f"Канал {channel}, пост {post_id}: не удалось распарсить дату {date_str}: {e}")
+        # Продолжаем обработку, если не удалось распарсить дату
+    return False
+
+
+class Pipeline:
+    """Стадии проверки и рассылки с собственными воркерами.
+
+    Воркеры засыпают, когда очередь пуста, и просыпаются по notify_*() из
+    предыдущей стадии (или по таймауту — для отложенных повторов отправки).
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.classify_workers = int(os.getenv("PIPELINE_CLASSIFY_WORKERS", "2"))
+        self.classify_batch = int(os.getenv("PIPELINE_CLASSIFY_BATCH", "10"))
+        self.delivery_workers = int(os.getenv("PIPELINE_DELIVERY_WORKERS", "4"))
+        self.delivery_batch = int(os.getenv("PIPELINE_DELIVERY_BATCH", "10"))
+        self.delivery_max_attempts = int(os.getenv("PIPELINE_DELIVERY_MAX_ATTEMPTS", "6"))
+        # Через сколько секунд взятая, но не завершённая работа считается зависшей
+        self.claim_timeout = float(os.getenv("PIPELINE_CLAIM_TIMEOUT_SECONDS", "900"))
+        # После стольких неудачных проверок подряд (LLM недоступна) пост закрывается без вердикта
+        self.classify_max_attempts = int(os.getenv("PIPELINE_CLASSIFY_MAX_ATTEMPTS", "5"))
+        # При шардировании посты ставят в очередь другие процессы и notify_classify() до
+        # воркеров ведущего не доходит: очередь проверяется по таймеру с этим периодом
+        self.shared_poll_seconds = float(os.getenv("PIPELINE_SHARED_POLL_SECONDS", "5"))
+        self._classify_wakeup = asyncio.Event()
+        self._delivery_wakeup = asyncio.Event()
+        self._reclaim_wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self, reclaim_older_than: float = 0.0, shared: bool = False) -> None:
+        """Запустить воркеры.
+
+        reclaim_older_than — вернуть в очереди только работу, взятую раньше, чем столько
+        секунд назад (новый ведущий не трогает то, что прежний, возможно, ещё отправляет);
+        shared — очередь пополняют и другие процессы, её нужно проверять чаще.
+        """
+        self._stopping = False
+        posts, deliveries = await run_db(reset_pipeline_claims, reclaim_older_than)
+        if posts or deliveries:
+            logger.info(f"Конвейер: возобновляю прерванную работу (постов: {posts}, отправок: {deliveries})")
+        classify_idle = self.shared_poll_seconds if shared else 60.0
+        self._tasks = [
+            asyncio.create_task(self._run(self._classify_step, self._classify_wakeup, idle=classify_idle))
+            for _ in range(max(1, self.classify_workers))
+        ]
+        self._tasks += [
+            asyncio.create_task(self._run(self._delivery_step, self._delivery_wakeup, idle=5.0))
+            for _ in range(max(1, self.delivery_workers))
+        ]
+        self._tasks.append(
+            asyncio.create_task(self._run(self._reclaim_step, self._reclaim_wakeup, idle=self.claim_timeout / 3))
+        )
+        # При старте в очередях может остаться работа с прошлого запуска
+        self.notify_classify()
+        self.notify_delivery()
+        logger.info(
+            f"Конвейер запущен: воркеров проверки {self.classify_workers}, рассылки {self.delivery_workers}"
+        )
+
+    async def stop(self, timeout: float = 0.0) -> None:
+        """Остановить воркеры: новую работу они не берут, взятую дорабатывают до timeout секунд.
+
+        Прерванная по таймауту работа вернётся в очереди при следующем старте.
+        """
+        self._stopping = True
+        self.notify_classify()
+        self.notify_delivery()
+        self._reclaim_wakeup.set()
+        if self._tasks and timeout > 0:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            if pending:
+                logger.warning(f"Конвейер: {len(pending)} воркеров не успели доработать за {timeout:.0f} с")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify_classify(self) -> None:
+        self._classify_wakeup.set()
+
+    def notify_delivery(self) -> None:
+        self._delivery_wakeup.set()
+
+    async def _run(self, step, wakeup: asyncio.Event, idle: float) -> None:
+        while not self._stopping:
+            # Сброс до выборки: сигнал, пришедший во время выборки, не потеряется
+            wakeup.clear()
+            try:
+                claimed = await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception("Ошибка стадии конвейера: %s", exc)
+                claimed = False
+            if claimed:
+                # В очереди может остаться ещё работа — будим остальных воркеров
+                wakeup.set()
+                continue
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=idle)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stage_posts(
+        self,
+        channel: str,
+        posts: List[Dict[str, Any]],
+        cursor: Optional[int] = None,
+        replace: bool = False,
+    ) -> None:
+        """Сохранить полученные посты в очередь на проверку и сдвинуть курсор канала.
+
+        cursor — до какого id сдвинуть курсор (по умолчанию — максимальный id из posts).
+        replace — поставить в очередь заново ранее сохранённые посты (после редактирования).
+        """
+        batch = WriteBatch()
+        if posts and not replace:
+            cursor = max([post["id"] for post in posts] + ([cursor] if cursor is not None else []))
+        if cursor is not None:
+            # Курсор сдвигается в той же транзакции, что и постановка постов в очередь
+            batch.set_cursor(channel, cursor)
+        for post in posts:
+            batch.stage_post(channel, post["id"], post["date"], post["text"], replace=replace)
+        await batch.flush_async()
+        if posts:
+            self.notify_classify()
+
+    async def _reclaim_step(self) -> bool:
+        """Вернуть в очереди работу, зависшую дольше claim_timeout (например, после ошибки посреди пачки)"""
+        posts, deliveries = await run_db(reset_pipeline_claims, self.claim_timeout)
+        if posts or deliveries:
+            logger.warning(f"Конвейер: возвращаю зависшую работу (постов: {posts}, отправок: {deliveries})")
+            self.notify_classify()
+            self.notify_delivery()
+        return False
+
+    async def _classify_step(self) -> bool:
+        rows = await run_db(claim_fetched_posts, self.classify_batch, time.time())
+        if not rows:
+            return False
+        await self.classify(rows)
+        return True
+
+    async def classify(self, rows) -> None:
+        """first_pass → прошедшие даты → почти-дубликаты → модель-фильтр → LLM; события уходят в исходящие"""
+        # Игнорируем посты старше 7 дней
+        cutoff_date = datetime.now() - timedelta(days=7)
+        near_duplicates = get_near_duplicate_index()
+        gate = get_gate()
+        check_dates = date_filter_enabled()
+        now = local_now()
+        batch = WriteBatch()
+        candidates = []
+
+        for row in rows:
+            channel, post_id, text = row["channel_username"], row["post_id"], row["post_text"] or ""
+            if _is_too_old(channel, post_id, row["post_date"], cutoff_date):
+                batch.set_verdict(channel, post_id, False, {})
+                POSTS_CLASSIFIED.inc(outcome="too_old")
+                continue
+
+            with FIRST_PASS_SECONDS.time():
+                rules = match_rules(text)
+            if not rules:
+                logger.info(f"Канал {channel}, пост {post_id}: не прошёл first_pass (быстрая проверка)")
+                batch.set_verdict(channel, post_id, False, {})
+                POSTS_CLASSIFIED.inc(outcome="no_rules")
+                continue
+
+            if check_dates:
+                mentions = extract_dates(text, row["post_date"])
+                if all_past(mentions, now):
+                    # Все даты в посте уже прошли: это отчёт или новость, а не анонс
+                    past = [mention.at.isoformat(sep=" ", timespec="minutes") for mention in mentions]
+                    logger.info(f"Канал {channel}, пост {post_id}: все даты в прошлом ({', '.join(past)}), LLM не вызываю")
+                    batch.set_verdict(channel, post_id, False, {"past_dates": past})
+                    POSTS_CLASSIFIED.inc(outcome="past_dates")
+                    continue
+
+            duplicate = near_duplicates.find(text, exclude=(channel, post_id))
+            if duplicate is not None:
+                # Почти-дубликат уже известного поста: берём прежний результат и не рассылаем повторно
+                logger.info(
+                    f"Канал {channel}, пост {post_id}: почти-дубликат поста "
+                    f"{duplicate.channel}/{duplicate.post_id}, LLM не вызываю"
+                )
+                result = dict(duplicate.result or {"is_event": False})
+                result["duplicate_of"] = f"{duplicate.channel}/{duplicate.post_id}"
+                # В индекс не добавляем: группу похожих постов в нём уже представляет исходный
+                batch.set_verdict(channel, post_id, bool(result.get("is_event")), result)
+                POSTS_CLASSIFIED.inc(outcome="duplicate")
+                continue
+
+            if gate is not None:
+                score = gate.score(text)
+                if score < skip_threshold():
+                    # Модель уверена, что это не анонс: экономим вызов LLM
+                    logger.info(f"Канал {channel}, пост {post_id}: оценка модели-фильтра {score:.3f}, LLM не вызываю")
+                    batch.set_verdict(channel, post_id, False, {"gate_score": round(score, 4)})
+                    POSTS_CLASSIFIED.inc(outcome="gate_skip")
+                    continue
+
+            logger.info(f"Канал {channel}, пост {post_id}: прошёл first_pass ({', '.join(rules)}), вызываю LLM...")
+            candidates.append(row)
+
+        # Все запросы к LLM по пачке идут параллельно, результаты обрабатываем в порядке постов
+        # Ошибка по одному посту не должна оставлять всю пачку в стадии classifying
+        results = await asyncio.gather(
+            *(llm_detect_async(row["post_text"]) for row in candidates), return_exceptions=True
+        )
+        recipients = await run_db(get_recipients) if candidates else []
+
+        queued = 0
+        for row, result in zip(candidates, results):
+            channel, post_id, text = row["channel_username"], row["post_id"], row["post_text"]
+            if isinstance(result, Exception) or result.get("llm_error"):
+                if isinstance(result, Exception):
+                    logger.error(
+                        f"Канал {channel}, пост {post_id}: ошибка проверки: {type(result).__name__}: {result}",
+                        exc_info=result,
+                    )
+                    result = {"llm_error": True}
+                self._retry_or_fail(batch, row, result)
+                continue
+            is_event = bool(result.get("is_event"))
+            if is_event:
+                result = with_event_at(result, text, row["post_date"])
+            batch.set_verdict(channel, post_id, is_event, result)
+            POSTS_CLASSIFIED.inc(outcome="event" if is_event else "not_event")
+            # Пока шли запросы к LLM, почти такой же пост мог уже уйти в рассылку из другого канала
+            sent_duplicate = near_duplicates.find(text, sent_only=True) if is_event else None
+            # Ошибка LLM и отказ быстрой модели каскада — не вердикт, который можно раздавать дубликатам
+            if is_labelled(result):
+                near_duplicates.add(channel, post_id, text, result)
+
+            if sent_duplicate is not None:
+                logger.info(
+                    f"Канал {channel}, пост {post_id}: почти-дубликат уже разосланного поста "
+                    f"{sent_duplicate.channel}/{sent_duplicate.post_id}, пропускаю отправку"
+                )
+                continue
+            if not is_event:
+                continue
+            if not has_useful_data(result):
+                logger.info(f"Канал {channel}, пост {post_id}: событие без полезных данных (дайджест?), пропускаю отправку в бот")
+                continue
+            if not recipients:
+                logger.warning(f"Канал {channel}, пост {post_id}: нет получателей рассылки")
+                continue
+            near_duplicates.mark_sent(channel, post_id)
+            message = format_event_message(result, f"https://t.me/{channel}/{post_id}")
+            batch.enqueue_delivery(channel, post_id, recipients, message)
+            batch.add_event(channel, post_id, row["post_date"], result)
+            queued += 1
+
+        # Вердикты и исходящие сохраняются одной транзакцией: событие не потеряется между стадиями
+        await batch.flush_async()
+        if queued:
+            self.notify_delivery()
+
+    def _retry_or_fail(self, batch: WriteBatch, row, result: Dict[str, Any]) -> None:
+        # Временный сбой LLM не должен стоить поста: повторяем с паузой 1, 2, 4 ... мин (до часа)
+        channel, post_id = row["channel_username"], row["post_id"]
+        attempts = row["classify_attempts"] + 1
+        if attempts >= self.classify_max_attempts:
+            logger.error(f"Канал {channel}, пост {post_id}: LLM не ответила за {attempts} попыток, пост закрыт без вердикта")
+            batch.set_verdict(channel, post_id, False, result)
+            POSTS_CLASSIFIED.inc(outcome="error")
+            return
+        delay = min(3600, 60 * 2 ** (attempts - 1))
+        logger.warning(f"Канал {channel}, пост {post_id}: проверка не удалась (попытка {attempts}), повтор через {delay} с")
+        batch.retry_verdict(channel, post_id, time.time() + delay)
+        POSTS_CLASSIFIED.inc(outcome="retry")
+
+    async def _delivery_step(self) -> bool:
+        rows = await run_db(claim_due_deliveries, self.delivery_batch, time.time())
+        if not rows:
+            return False
+        outcomes = await asyncio.gather(
+            *(try_deliver(self.bot, self._chat_id(row["chat_id"]), row["message"]) for row in rows)
+        )
+        sent: List[int] = []
+        retry: List[Tuple[int, float, str]] = []
+        failed: List[Tuple[int, str]] = []
+        for row, outcome in zip(rows, outcomes):
+            attempts = row["attempts"] + 1
+            if outcome == DELIVERY_SENT:
+                sent.append(row["id"])
+            elif outcome == DELIVERY_REJECTED or attempts >= self.delivery_max_attempts:
+                logger.error(
+                    f"Канал {row['channel_username']}, пост {row['post_id']}: "
+                    f"не доставлено в {row['chat_id']} ({outcome}, попыток {attempts})"
+                )
+                failed.append((row["id"], outcome))
+            else:
+                # Экспоненциальная пауза между повторами: 30 с, 1 мин, 2 мин ... до часа
+                retry.append((row["id"], time.time() + min(3600, 30 * 2 ** (attempts - 1)), outcome))
+        finished = await run_db(complete_deliveries, sent, retry, failed)
+        for post in finished:
+            stats = BroadcastStats(
+                total=post["total"],
+                sent=post["sent"],
+                failed=post["failed"],
+                retries=post["retries"],
+                duration=post["duration"] or 0.0,
+                failed_chats=post["failed_chats"],
+            )
+            logger.info(f"Канал {post['channel_username']}, пост {post['post_id']}: рассылка завершена, {stats}")
+        return True
+
+    @staticmethod
+    def _chat_id(value: str):
+        # chat_id хранится строкой: числовые id возвращаем числом, @username — как есть
+        try:
+            return int(value)
+        except ValueError:
+            return value
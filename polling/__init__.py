@@ -0,0 +1 @@
+# Polling package
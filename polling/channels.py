@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHANNELS_PATH = Path(__file__).resolve().parents[1] / "channels.json"
+
+
+def load_channels(path: Path = CHANNELS_PATH) -> List[str]:
+    if not path.exists():
+        return []
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return [c.strip().lstrip("@") for c in data if c.strip()]
+    except Exception:
+        return []
+
+
+class ChannelListWatcher:
+    """Следит за channels.json и передаёт новый список каналов работающему сервису.
+
+    Файл проверяется по mtime раз в CHANNELS_RELOAD_SECONDS. Битый или пустой файл
+    (например, сохранённый редактором наполовину) игнорируется до следующего изменения.
+    """
+
+    def __init__(self, on_change: Callable[[List[str]], Awaitable[None]], path: Path = CHANNELS_PATH):
+        self.path = path
+        self.on_change = on_change
+        self.interval = float(os.getenv("CHANNELS_RELOAD_SECONDS", "30"))
+        self._mtime = self._current_mtime()
+        self._task: Optional[asyncio.Task] = None
+
+    def _current_mtime(self) -> Optional[float]:
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+    def start(self) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            mtime = self._current_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+            channels = load_channels(self.path)
+            if not channels:
+                self._mtime = mtime
+                logger.warning(f"{self.path.name} изменён, но список каналов пуст или не читается — оставляю прежний")
+                continue
+            try:
+                await self.on_change(channels)
+            except Exception as exc:
+                # mtime не запоминаем: список применится повторно при следующей проверке
+                logger.exception("Ошибка применения нового списка каналов: %s", exc)
+                continue
+            self._mtime = mtime
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import socket
+import time
+import logging
+from typing import Awaitable, Callable, List, Optional
+
+from database.db import run_db, sync_shard, release_shard
+from monitoring.metrics import FETCH_SECONDS, POSTS_FETCHED
+
+logger = logging.getLogger(__name__)
+
+# Шардирование (SHARDING=1): несколько процессов, у каждого своя сессия Telethon
+# (TELEGRAM_SESSION) и свой WORKER_ID, делят каналы из channels.json через аренду
+# в общей SQLite. Аренда продлевается пульсом; каналы умершего воркера после
+# LEASE_TTL_SECONDS забирают остальные. Бот и рассылку ведёт один воркер — ведущий.
+
+
+def worker_id() -> str:
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def sharding_enabled() -> bool:
+    return os.getenv("SHARDING", "0") == "1"
+
+
+class ShardCoordinator:
+    """Пульс воркера: продлевает аренду, перераспределяет каналы и следит за ролью ведущего"""
+
+    def __init__(
+        self,
+        session_name: str,
+        on_assign: Callable[[List[str]], Awaitable[None]],
+        on_leadership: Callable[[bool], Awaitable[None]],
+    ):
+        self.worker_id = worker_id()
+        self.session_name = session_name
+        self.on_assign = on_assign
+        self.on_leadership = on_leadership
+        self.heartbeat = float(os.getenv("LEASE_HEARTBEAT_SECONDS", "20"))
+        self.ttl = float(os.getenv("LEASE_TTL_SECONDS", "90"))
+        self.started_at = time.time()
+        self.channels: List[str] = []
+        self.assigned: List[str] = []
+        self.leader = False
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def start(self, channels: List[str]) -> List[str]:
+        """Первый пульс; вернуть каналы, доставшиеся этому воркеру.
+
+        Дальнейшие пульсы идут после start_heartbeat(), когда сервис готов принимать изменения.
+        """
+        self.channels = list(channels)
+        self.assigned, leader = await self._sync()
+        logger.info(f"Шард {self.worker_id}: каналов {len(self.assigned)} из {len(channels)}")
+        await self._set_leader(leader)
+        return list(self.assigned)
+
+    def start_heartbeat(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def set_channels(self, channels: List[str]) -> None:
+        """Новый общий список каналов (после изменения channels.json)"""
+        self.channels = list(channels)
+        await self.tick()
+
+    async def stop_heartbeat(self) -> None:
+        """Остановить пульс, не отдавая аренду (на время завершения начатой работы)"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def stop(self) -> None:
+        await self.stop_heartbeat()
+        await run_db(release_shard, self.worker_id)
+
+    async def _sync(self):
+        stats = {
+            "polls": FETCH_SECONDS.merged()[2],
+            "posts_fetched": int(sum(POSTS_FETCHED.items().values())),
+        }
+        return await run_db(
+            sync_shard, self.worker_id, self.session_name, self.channels, stats, self.started_at, time.time(), self.ttl
+        )
+
+    async def tick(self) -> None:
+        async with self._lock:
+            assigned, leader = await self._sync()
+            if set(assigned) != set(self.assigned):
+                gained = len(set(assigned) - set(self.assigned))
+                lost = len(set(self.assigned) - set(assigned))
+                logger.info(f"Шард {self.worker_id}: +{gained} / -{lost} каналов, всего {len(assigned)}")
+                self.assigned = assigned
+                await self.on_assign(list(assigned))
+            await self._set_leader(leader)
+
+    async def _set_leader(self, leader: bool) -> None:
+        if leader != self.leader:
+            self.leader = leader
+            logger.info(f"Шард {self.worker_id}: {'стал ведущим' if leader else 'больше не ведущий'}")
+            await self.on_leadership(leader)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.tick()
+            except Exception as exc:
+                # Пропущенный пульс не страшен, пока не истекла аренда
+                logger.exception("Шард %s: ошибка пульса: %s", self.worker_id, exc)
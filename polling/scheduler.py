@@ -0,0 +1,219 @@
+import asyncio
+import os
+import random
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from telethon.errors import FloodWaitError
+
+from database.db import run_db, get_channel_schedules, save_channel_schedule, get_last_event_time
+from tg_client.entities import is_available
+
+logger = logging.getLogger(__name__)
+# APScheduler пишет INFO на каждый запуск задачи — при сотнях каналов это шум
+logging.getLogger("apscheduler").setLevel(logging.WARNING)
+
+# Адаптивный опрос: у каждого канала своё время следующего опроса.
+# Частота постов оценивается скользящим средним (EWMA), интервал подбирается так,
+# чтобы к следующему опросу набиралось около SCHEDULE_TARGET_POSTS новых постов,
+# и ограничен SCHEDULE_MIN_MINUTES..SCHEDULE_MAX_MINUTES. Каналы, недавно
+# публиковавшие события, опрашиваются вдвое чаще; после ошибок и FloodWait
+# интервал растёт экспоненциально. Недоступные каналы (удалены, стали приватными)
+# снимаются с расписания и возвращаются, когда следующее разрешение каналов их найдёт.
+
+PollFunc = Callable[[str], Awaitable[int]]
+
+
+class AdaptiveScheduler:
+    """Расписание опроса каналов на APScheduler: одна отложенная задача на канал"""
+
+    def __init__(self, poll: PollFunc, max_concurrent: int):
+        self._poll_channel = poll
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        self.min_interval = float(os.getenv("SCHEDULE_MIN_MINUTES", "5")) * 60
+        self.max_interval = float(os.getenv("SCHEDULE_MAX_MINUTES", "240")) * 60
+        self.target_posts = float(os.getenv("SCHEDULE_TARGET_POSTS", "1"))
+        self.alpha = float(os.getenv("SCHEDULE_EWMA_ALPHA", "0.3"))
+        self.event_boost_seconds = float(os.getenv("SCHEDULE_EVENT_BOOST_DAYS", "14")) * 86400
+        # Пропущенный запуск (например, цикл был занят) выполняется сразу, а не отбрасывается
+        self._scheduler = AsyncIOScheduler(
+            timezone=timezone.utc,
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": None},
+        )
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._running: Set[asyncio.Task] = set()
+        # Каналы, снятые с расписания как недоступные
+        self._unavailable: Set[str] = set()
+        self._stopping = False
+
+    async def start(self, channels: List[str]) -> None:
+        """Восстановить расписание из БД; просроченные каналы разнести по первой минуте"""
+        saved = {row["channel_username"]: dict(row) for row in await run_db(get_channel_schedules)}
+        self._scheduler.start()
+        now = time.time()
+        overdue = []
+        for channel in channels:
+            state = saved.get(channel) or {"errors": 0}
+            self._states[channel] = state
+            if not is_available(channel):
+                self._unavailable.add(channel)
+            elif state.get("next_poll_at") and state["next_poll_at"] > now:
+                self._schedule(channel, state["next_poll_at"])
+            else:
+                overdue.append(channel)
+        window = min(self.min_interval, 60.0)
+        for i, channel in enumerate(overdue):
+            self._schedule(channel, now + window * i / max(len(overdue), 1))
+        logger.info(
+            f"Адаптивный опрос: {len(channels)} каналов, сразу опрашиваю {len(overdue)}, "
+            f"недоступно {len(self._unavailable)}, интервал {self.min_interval / 60:.0f}–{self.max_interval / 60:.0f} мин"
+        )
+
+    async def set_channels(self, channels: List[str]) -> None:
+        """Применить новый список каналов: новые опрашиваются сразу, удалённые снимаются с расписания.
+
+        Вызывается после разрешения каналов, поэтому снова доступные каналы тоже возвращаются в расписание.
+        """
+        removed = set(self._states) - set(channels)
+        for channel in removed:
+            self._states.pop(channel, None)
+            self._unavailable.discard(channel)
+            if self._scheduler.get_job(channel) is not None:
+                self._scheduler.remove_job(channel)
+        added = [channel for channel in channels if channel not in self._states]
+        if added:
+            saved = {row["channel_username"]: dict(row) for row in await run_db(get_channel_schedules)}
+            now = time.time()
+            for channel in added:
+                self._states[channel] = saved.get(channel) or {"errors": 0}
+                if is_available(channel):
+                    self._schedule(channel, now)
+                else:
+                    self._unavailable.add(channel)
+        revived = sorted(channel for channel in self._unavailable if is_available(channel))
+        for channel in revived:
+            self._unavailable.discard(channel)
+            self._schedule(channel, time.time())
+        if added or removed or revived:
+            logger.info(
+                f"Адаптивный опрос: добавлено каналов {len(added)}, удалено {len(removed)}, "
+                f"снова доступно {len(revived)}"
+            )
+
+    def shutdown(self) -> None:
+        if self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    async def stop(self, timeout: float) -> None:
+        """Не запускать новые опросы и дождаться начатых (не дольше timeout секунд).
+
+        Ждём до shutdown(): APScheduler при остановке отменяет выполняющиеся задачи.
+        """
+        self._stopping = True
+        if self._scheduler.running:
+            self._scheduler.pause()
+        if self._running:
+            _, pending = await asyncio.wait(list(self._running), timeout=timeout)
+            if pending:
+                logger.warning(f"Адаптивный опрос: {len(pending)} опросов не успели завершиться за {timeout:.0f} с")
+        self.shutdown()
+
+    def _schedule(self, channel: str, at: float) -> None:
+        self._scheduler.add_job(
+            self._run,
+            "date",
+            run_date=datetime.fromtimestamp(at, timezone.utc),
+            args=[channel],
+            id=channel,
+            replace_existing=True,
+        )
+
+    async def _run(self, channel: str) -> None:
+        task = asyncio.current_task()
+        self._running.add(task)
+        try:
+            await self._poll(channel)
+        finally:
+            self._running.discard(task)
+
+    async def _poll(self, channel: str) -> None:
+        new_posts, error, flood_seconds = 0, None, 0
+        async with self._semaphore:
+            if self._stopping:
+                # Опрос ждал своей очереди, а сервис уже останавливается: время опроса остаётся прежним
+                return
+            try:
+                new_posts = await self._poll_channel(channel)
+            except FloodWaitError as e:
+                flood_seconds = e.seconds
+                error = f"FloodWait {e.seconds} с"
+            except Exception as exc:
+                logger.exception("Ошибка обработки канала %s: %s", channel, exc)
+                error = f"{type(exc).__name__}: {exc}"
+        try:
+            last_event_at = await run_db(get_last_event_time, channel)
+            state = self.plan(self._states.get(channel, {"errors": 0}), time.time(), new_posts, error,
+                              flood_seconds, last_event_at)
+            self._states[channel] = state
+            await run_db(save_channel_schedule, channel, state)
+        except Exception as exc:
+            # Расписание не должно теряться из-за ошибки БД: повторим через минимальный интервал
+            logger.exception("Канал %s: не удалось сохранить расписание: %s", channel, exc)
+            state = {**self._states.get(channel, {}), "next_poll_at": time.time() + self.min_interval}
+        if channel not in self._states or self._stopping:
+            # Канал убрали из channels.json, пока он опрашивался, или сервис останавливается
+            return
+        if not is_available(channel):
+            # Канал удалён или стал приватным: опрашивать его бесполезно до следующего разрешения каналов
+            self._unavailable.add(channel)
+            logger.warning(f"Канал {channel} недоступен, снят с расписания опроса")
+            return
+        self._schedule(channel, state["next_poll_at"])
+        if error:
+            minutes = (state["next_poll_at"] - time.time()) / 60
+            logger.warning(f"Канал {channel}: {error}, следующий опрос через {minutes:.1f} мин")
+
+    def plan(
+        self,
+        state: Dict[str, Any],
+        now: float,
+        new_posts: int,
+        error: Optional[str],
+        flood_seconds: int,
+        last_event_at: Optional[float],
+    ) -> Dict[str, Any]:
+        """Новое состояние канала после опроса: оценка частоты, интервал и время следующего опроса"""
+        state = dict(state)
+        if error is None:
+            last_poll_at = state.get("last_poll_at")
+            if last_poll_at and now > last_poll_at:
+                observed = new_posts * 3600 / (now - last_poll_at)
+                rate = state.get("rate")
+                state["rate"] = observed if rate is None else self.alpha * observed + (1 - self.alpha) * rate
+            if new_posts:
+                state["last_post_at"] = now
+            state.update(last_poll_at=now, errors=0, last_error=None)
+            if state.get("rate") is None:
+                # Частота ещё неизвестна — второй опрос скоро, чтобы её оценить
+                interval = self.min_interval
+            elif state["rate"] > 0:
+                interval = self.target_posts * 3600 / state["rate"]
+            else:
+                interval = self.max_interval
+            if last_event_at and now - last_event_at < self.event_boost_seconds:
+                interval /= 2
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            state["interval"] = interval
+            # Небольшой разброс, чтобы каналы с одинаковым интервалом не опрашивались одновременно
+            delay = interval * random.uniform(0.9, 1.1)
+        else:
+            state["errors"] = (state.get("errors") or 0) + 1
+            state["last_error"] = error
+            interval = state.get("interval") or self.min_interval
+            delay = min(self.max_interval, interval * 2 ** state["errors"])
+            delay = max(delay, flood_seconds + random.uniform(1, 5))
+        state["next_poll_at"] = now + delay
+        return state
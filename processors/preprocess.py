@@ -0,0 +1,153 @@
+import os
+import re
+import unicodedata
+import logging
+from typing import List, Tuple
+
+from monitoring.metrics import LLM_INPUT_TOKENS_SAVED
+
+logger = logging.getLogger(__name__)
+
+# Подготовка текста поста перед LLM: убираем то, что стоит токенов, но не несёт
+# информации о мероприятии (подвалы каналов, хвосты хэштегов, повторы эмодзи и
+# ссылок), и укладываем текст в бюджет токенов.
+
+_ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\xad]")
+_URL_RE = re.compile(r"(?:https?://|www\.|t\.me/)[^\s<>()\"']+", re.IGNORECASE)
+_HASHTAG_RE = re.compile(r"#\w+")
+_HASHTAG_LINE_RE = re.compile(r"^(?:\s*#\w+[\s,.;|·•]*)+$")
+_DECORATION_LINE_RE = re.compile(r"^[\s\-—–_=~*•·.|/\\─━═➖▪\ufe0f]{3,}$")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_SPACES_RE = re.compile(r"[ \t\xa0]{2,}")
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Типовые подвалы каналов: строка целиком удаляется
+BOILERPLATE_PATTERNS = [
+    r"подпи(?:шись|шитесь|сывайтесь|сывайся)\b.*",
+    r"(?:наш|мой)\s+(?:канал|чат|бот)\b.*",
+    r"(?:поддержать|поддержи)\s+(?:канал|проект)\b.*",
+    r"(?:поставь|ставь)(?:те)?\s+(?:лайк|реакци)\w*.*",
+    r"реклама\s*[.,]?\s*(?:ооо|ип|инн|erid)\b.*",
+    r"erid\s*[:：]\s*\w+.*",
+    r"(?:предложить\s+новость|по\s+вопросам\s+рекламы|сотрудничество)\s*[:：—-].*",
+    r"(?:subscribe|follow\s+us)\b.*",
+    r"@\w+\s*$",
+]
+_BOILERPLATE_RE = re.compile(r"^\s*(?:" + "|".join(BOILERPLATE_PATTERNS) + r")$", re.IGNORECASE)
+
+# Сколько хэштегов оставить: первые несловарные теги иногда описывают тему поста
+KEEP_HASHTAGS = 3
+
+
+def _piece_tokens(piece: str) -> int:
+    if len(piece) == 1:
+        return 1
+    return 1 + (len(piece) - 1) // (4 if piece.isascii() else 3)
+
+
+def count_tokens(text: str) -> int:
+    """Приблизительное число токенов: слова режутся на куски по 4 символа латиницы
+    или 3 символа кириллицы (как в BPE-словарях типичных моделей), знаки — по одному.
+    """
+    return sum(_piece_tokens(match.group()) for match in _TOKEN_RE.finditer(text))
+
+
+def token_budget() -> int:
+    """Сколько токенов текста поста отправлять в LLM (LLM_INPUT_TOKEN_BUDGET, 0 — без ограничения)"""
+    return int(os.getenv("LLM_INPUT_TOKEN_BUDGET", "1500"))
+
+
+def _collapse_symbol_runs(text: str) -> str:
+    # Повторы одного и того же эмодзи/символа (🔥🔥🔥, ‼‼) схлопываются в один
+    result: List[str] = []
+    previous = ""
+    for char in text:
+        if char == previous and unicodedata.category(char) in ("So", "Sk", "Po") and not char.isascii():
+            continue
+        if char == "\ufe0f" and result and result[-1] == "\ufe0f":
+            continue
+        result.append(char)
+        previous = char if char != "\ufe0f" else previous
+    return "".join(result)
+
+
+def _dedupe_urls(text: str) -> str:
+    seen = set()
+
+    def _replace(match: re.Match) -> str:
+        url = match.group().rstrip(".,;:!?")
+        tail = match.group()[len(url):]
+        key = url.lower().rstrip("/")
+        if key in seen:
+            return tail
+        seen.add(key)
+        return url + tail
+
+    return _URL_RE.sub(_replace, text)
+
+
+def _strip_lines(text: str) -> str:
+    lines = text.split("\n")
+    kept = [
+        line for line in lines
+        if not _BOILERPLATE_RE.match(line) and not _DECORATION_LINE_RE.match(line)
+    ]
+    # Хвост из строк с одними хэштегами: оставляем только первые KEEP_HASHTAGS тегов
+    tail_tags: List[str] = []
+    while kept and (not kept[-1].strip() or _HASHTAG_LINE_RE.match(kept[-1])):
+        tail_tags = _HASHTAG_RE.findall(kept.pop()) + tail_tags
+    if tail_tags:
+        kept.append(" ".join(tail_tags[:KEEP_HASHTAGS]))
+    return "\n".join(kept)
+
+
+def normalize(text: str) -> str:
+    """Нормализовать пост и убрать шум, не трогая содержательный текст"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = _ZERO_WIDTH_RE.sub("", text)
+    text = _strip_lines(text)
+    text = _collapse_symbol_runs(text)
+    text = _dedupe_urls(text)
+    text = _SPACES_RE.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def truncate(text: str, budget: int) -> str:
+    """Уложить текст в бюджет токенов: начало поста (название, дата) и его конец
+    (обычно ссылка на регистрацию) сохраняются, середина заменяется на «[…]».
+    """
+    if budget <= 0 or count_tokens(text) <= budget:
+        return text
+    # Позиции концов токенов, чтобы резать по границе токена, а не посреди слова
+    spans: List[Tuple[int, int]] = []
+    total = 0
+    for match in _TOKEN_RE.finditer(text):
+        total += _piece_tokens(match.group())
+        spans.append((total, match.end()))
+    head_budget = int(budget * 0.8)
+    tail_budget = budget - head_budget - 2
+    head_end = 0
+    for tokens, end in spans:
+        if tokens > head_budget:
+            break
+        head_end = end
+    # Хвост начинается после конца токена, за которым остаётся не больше tail_budget токенов
+    tail_start = len(text)
+    for tokens, end in reversed(spans):
+        if total - tokens > tail_budget or end <= head_end:
+            break
+        tail_start = end
+    tail = text[tail_start:].lstrip() if tail_budget > 0 else ""
+    return f"{text[:head_end].rstrip()} […] {tail}".rstrip()
+
+
+def prepare_text(text: str) -> str:
+    """Текст поста для LLM: нормализация, очистка и обрезка по LLM_INPUT_TOKEN_BUDGET"""
+    before = count_tokens(text)
+    prepared = truncate(normalize(text), token_budget())
+    after = count_tokens(prepared)
+    if before > after:
+        LLM_INPUT_TOKENS_SAVED.inc(before - after)
+        logger.info(f"Предобработка поста: {before} → {after} токенов (сэкономлено {before - after})")
+    return prepared
@@ -0,0 +1,50 @@
+"""Состояние шардирования каналов между воркерами (SHARDING=1).
+
+python shards.py              — воркеры: каналы, пульс, роль ведущего, производительность
+python shards.py --channels   — плюс какой воркер читает каждый канал
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+from database.db import init_db, get_shard_status, get_channel_leases
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", action="store_true", help="показать аренду каждого канала")
+    args = parser.parse_args()
+
+    if not load_dotenv():
+        load_dotenv("env.sample")
+    init_db()
+    ttl = float(os.getenv("LEASE_TTL_SECONDS", "90"))
+    workers, leader = get_shard_status()
+    if not workers:
+        print("Нет зарегистрированных воркеров: сервис не запущен с SHARDING=1")
+        return
+    now = time.time()
+    print(f"{'воркер':<28}{'сессия':<18}{'каналов':>8}{'пульс, с':>10}{'опросов':>9}{'постов':>9}{'постов/мин':>12}")
+    for w in workers:
+        uptime_minutes = max(now - w["started_at"], 1) / 60
+        state = " ведущий" if w["worker_id"] == leader else ""
+        if now - w["heartbeat_at"] > ttl:
+            state += " НЕ ОТВЕЧАЕТ"
+        print(
+            f"{w['worker_id']:<28}{w['session_name'] or '-':<18}{w['channels']:>8}"
+            f"{now - w['heartbeat_at']:>10.0f}{w['polls']:>9}{w['posts_fetched']:>9}"
+            f"{w['posts_fetched'] / uptime_minutes:>12.1f}{state}"
+        )
+    if leader is None:
+        print("Ведущего нет: бот и рассылка не работают, пока его роль не заберёт живой воркер")
+    if args.channels:
+        print()
+        for lease in get_channel_leases():
+            expired = " (аренда истекла)" if lease["expires_at"] < now else ""
+            print(f"{lease['channel_username']:<40}{lease['worker_id']}{expired}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Расписание адаптивного опроса каналов (POLL_SCHEDULE=adaptive).
+
+python show_schedule.py            — ближайшие опросы всех каналов
+python show_schedule.py --limit 20 — только первые 20
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from database.db import init_db, get_channel_schedules
+
+
+def _ago(now: float, at) -> str:
+    if not at:
+        return "-"
+    hours = (now - at) / 3600
+    return f"{hours:.1f} ч" if hours < 48 else f"{hours / 24:.0f} дн"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=0, help="сколько каналов показать (0 — все)")
+    args = parser.parse_args()
+
+    if not load_dotenv():
+        load_dotenv("env.sample")
+    init_db()
+    rows = get_channel_schedules()
+    if args.limit:
+        rows = rows[:args.limit]
+    if not rows:
+        print("Расписание пустое: сервис ещё не опрашивал каналы в режиме POLL_SCHEDULE=adaptive")
+        return
+    now = time.time()
+    print(f"{'канал':<32}{'через, мин':>11}{'интервал':>10}{'постов/сут':>12}{'посл. пост':>12}"
+          f"{'посл. событие':>15}  ошибки")
+    for row in rows:
+        next_in = (row["next_poll_at"] - now) / 60 if row["next_poll_at"] else 0
+        interval = f"{row['interval'] / 60:.0f} мин" if row["interval"] else "-"
+        rate = f"{row['rate'] * 24:.1f}" if row["rate"] is not None else "-"
+        errors = f"{row['errors']} ({row['last_error']})" if row["errors"] else ""
+        print(
+            f"{row['channel_username']:<32}{max(next_in, 0):>11.1f}{interval:>10}{rate:>12}"
+            f"{_ago(now, row['last_post_at']):>12}{_ago(now, row['last_event_at']):>15}  {errors}"
+        )
+
+
+if __name__ == "__main__":
+    main()
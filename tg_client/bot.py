@@ -1,46 +1,145 @@
+import asyncio
 import os
+import random
+import time
 import logging
-from typing import Optional, List
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Union
 
 from telegram import Bot
+from telegram.request import HTTPXRequest
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
 from database.db import get_all_bot_users
+from monitoring.metrics import SEND_SECONDS
+from tg_client.ratelimit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
+ChatId = Union[int, str]
+
+# Исход одной доставки: отправлено, временная ошибка (можно повторить позже), отказ
+DELIVERY_SENT = "sent"
+DELIVERY_RETRY = "retry"
+DELIVERY_REJECTED = "rejected"
+
+
+@dataclass
+class BroadcastStats:
+    """Итоги рассылки одного поста по всем получателям (из очереди deliveries)"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    duration: float = 0.0
+    failed_chats: List[ChatId] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f"доставлено {self.sent}/{self.total}, ошибок {self.failed}, "
+            f"повторов {self.retries}, за {self.duration:.1f} с"
+        )
+
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+_global_bucket: Optional[TokenBucket] = None
+_chat_buckets: Dict[ChatId, TokenBucket] = {}
+# После RetryAfter Telegram ждёт паузы от всего бота, а не только от одного чата
+_paused_until = 0.0
+
 
 def init_bot() -> Bot:
+    """Единственный Bot процесса: через него идут и рассылка, и ответы на команды.
+
+    Пул соединений (BOT_CONNECTION_POOL_SIZE) общий для всех отправок; getUpdates
+    держит соединение на время long polling, поэтому у него свой запрос и пул рассылки он не занимает.
+    """
     token = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    return Bot(token=token)
+    pool_size = int(os.getenv("BOT_CONNECTION_POOL_SIZE", "32"))
+    # Соединение из пула ждём дольше стандартной секунды: при всплеске рассылки оно освободится
+    request = HTTPXRequest(connection_pool_size=pool_size, pool_timeout=30.0)
+    return Bot(token=token, request=request)
+
+
+def _get_global_bucket() -> TokenBucket:
+    global _global_bucket
+    if _global_bucket is None:
+        rate = float(os.getenv("BROADCAST_MESSAGES_PER_SECOND", "25"))
+        _global_bucket = TokenBucket(rate=rate, capacity=rate)
+    return _global_bucket
+
 
+def _get_chat_bucket(chat_id: ChatId) -> TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        rate = float(os.getenv("BROADCAST_PER_CHAT_PER_SECOND", "1"))
+        bucket = _chat_buckets[chat_id] = TokenBucket(rate=rate, capacity=1)
+    return bucket
 
-async def send_message(bot: Bot, text: str, chat_id: Optional[str] = None) -> None:
-    """Отправить сообщение конкретному пользователю или всем пользователям бота"""
-    if chat_id:
-        # Отправка конкретному пользователю
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+async def _wait_for_pause() -> None:
+    delay = _paused_until - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def try_deliver(bot: Bot, chat_id: ChatId, text: str) -> str:
+    """Отправить сообщение в один чат с учётом лимитов, RetryAfter и повторов с джиттером.
+
+    Возвращает DELIVERY_SENT, DELIVERY_RETRY (попытки исчерпаны, ошибка временная)
+    или DELIVERY_REJECTED (чат недоступен, повтор не поможет).
+    """
+    global _paused_until
+    max_attempts = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "4"))
+    for attempt in range(1, max_attempts + 1):
+        await _wait_for_pause()
+        await _get_chat_bucket(chat_id).acquire()
+        await _get_global_bucket().acquire()
         try:
-            await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+            await _send_once(bot, chat_id, text)
+            return DELIVERY_SENT
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e) + random.uniform(0, 1)
+            _paused_until = max(_paused_until, time.monotonic() + delay)
+            logger.warning(f"Telegram просит подождать {delay:.1f} с (чат {chat_id}, попытка {attempt})")
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+            logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
+            return DELIVERY_REJECTED
+        except NetworkError as e:
+            delay = min(30.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+            logger.warning(f"Сетевая ошибка отправки в {chat_id} ({e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения пользователю {chat_id}: {e}")
-        return
-    
-    # Отправка всем пользователям бота
+            return DELIVERY_RETRY
+    logger.error(f"Не удалось отправить сообщение в {chat_id} за {max_attempts} попыток")
+    return DELIVERY_RETRY
+
+
+async def _send_once(bot: Bot, chat_id: ChatId, text: str) -> None:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+        outcome = "sent"
+    except RetryAfter:
+        outcome = "retry_after"
+        raise
+    finally:
+        SEND_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+
+def get_recipients() -> List[ChatId]:
+    """Получатели рассылки: все пользователи бота, а если их нет — TELEGRAM_BOT_CHAT_ID"""
     users = get_all_bot_users()
-    
-    # Если есть пользователи в БД, отправляем всем
     if users:
-        for user in users:
-            try:
-                await bot.send_message(chat_id=user["chat_id"], text=text, disable_web_page_preview=True)
-            except Exception as e:
-                logger.error(f"Ошибка отправки сообщения пользователю {user['chat_id']}: {e}")
-        logger.info(f"Сообщение отправлено {len(users)} пользователям")
-    else:
-        # Fallback: если нет пользователей в БД, отправляем в TELEGRAM_BOT_CHAT_ID
-        fallback_chat = os.getenv("TELEGRAM_BOT_CHAT_ID", "")
-        if fallback_chat:
-            try:
-                await bot.send_message(chat_id=fallback_chat, text=text, disable_web_page_preview=True)
-                logger.info(f"Сообщение отправлено в fallback чат {fallback_chat}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки сообщения в fallback чат: {e}")
+        return [user["chat_id"] for user in users]
+    fallback_chat = os.getenv("TELEGRAM_BOT_CHAT_ID", "")
+    return [fallback_chat] if fallback_chat else []
 
@@ -0,0 +1,139 @@
+import logging
+from typing import Any, Dict, List, Union
+
+from telethon import TelegramClient
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    FloodWaitError,
+    UsernameInvalidError,
+    UsernameNotOccupiedError,
+)
+from telethon.tl.types import Channel, InputPeerChannel
+
+from database.db import run_db, get_channel_entities, save_channel_entities
+from tg_client.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Каналы читаются по InputPeerChannel(id, access_hash) из SQLite, а не по username:
+# так не нужен ResolveUsernameRequest с его жёсткими лимитами, а переименованный
+# канал продолжает читаться по id. access_hash привязан к аккаунту, поэтому
+# записи хранятся отдельно для каждой сессии Telethon.
+
+# Ошибки, после которых канал считается недоступным (удалён, закрыт, нет такого username)
+UNAVAILABLE_ERRORS = (ChannelPrivateError, ChannelInvalidError, UsernameNotOccupiedError, UsernameInvalidError)
+
+_entities: Dict[str, Dict[str, Any]] = {}
+_session_name = ""
+
+
+def _usernames(entity: Channel) -> List[str]:
+    names = [entity.username] if entity.username else []
+    names += [u.username for u in (getattr(entity, "usernames", None) or []) if u.active]
+    return [name.lower() for name in names]
+
+
+def _entity_fields(channel: str, entity: Channel) -> Dict[str, Any]:
+    usernames = _usernames(entity)
+    return {
+        "channel_id": entity.id,
+        "access_hash": entity.access_hash,
+        "title": entity.title,
+        "current_username": entity.username,
+        "status": "ok" if channel.lower() in usernames else "renamed",
+        "note": None,
+    }
+
+
+def _missing(note: str) -> Dict[str, Any]:
+    return {"channel_id": None, "access_hash": None, "title": None, "current_username": None,
+            "status": "missing", "note": note}
+
+
+def get_peer(channel: str) -> Union[InputPeerChannel, str]:
+    """Чем читать канал: InputPeerChannel, если он известен, иначе username"""
+    entity = _entities.get(channel)
+    if entity and entity.get("channel_id") and entity.get("access_hash") is not None:
+        return InputPeerChannel(entity["channel_id"], entity["access_hash"])
+    return channel
+
+
+def channel_ids() -> Dict[int, str]:
+    """id канала -> username из channels.json (для разбора апдейтов)"""
+    return {entity["channel_id"]: channel for channel, entity in _entities.items() if entity.get("channel_id")}
+
+
+def is_available(channel: str) -> bool:
+    return _entities.get(channel, {}).get("status") != "missing"
+
+
+async def mark_unavailable(channel: str, error: Exception) -> None:
+    """Запомнить, что канал недоступен; он снова проверяется при следующем разрешении"""
+    entity = _entities.get(channel, {})
+    if entity.get("status") == "missing":
+        return
+    note = f"{type(error).__name__}"
+    logger.warning(f"Канал {channel} недоступен ({note}): удалён, стал приватным или сменил username")
+    _entities[channel] = {**_missing(note), **{k: entity.get(k) for k in ("channel_id", "access_hash", "title")}}
+    await run_db(save_channel_entities, _session_name, {channel: _entities[channel]})
+
+
+async def resolve_channels(client: TelegramClient, session_name: str, channels: List[str], budget: TokenBucket) -> None:
+    """Получить id и access_hash каналов: из БД, затем одним проходом по диалогам аккаунта,
+    и только для оставшихся — по username (по одному запросу с учётом бюджета).
+
+    Отмечает переименованные (канал найден по id, username другой) и недоступные каналы.
+    """
+    global _session_name
+    _session_name = session_name
+    _entities.update(await run_db(get_channel_entities, session_name))
+    wanted = {channel.lower(): channel for channel in channels}
+    by_id = {entity["channel_id"]: channel for channel, entity in _entities.items()
+             if entity.get("channel_id") and channel in channels}
+    changed: Dict[str, Dict[str, Any]] = {}
+
+    await budget.acquire()
+    async for dialog in client.iter_dialogs():
+        entity = dialog.entity
+        if not isinstance(entity, Channel) or entity.access_hash is None:
+            continue
+        channel = by_id.get(entity.id)
+        if channel is None:
+            channel = next((wanted[name] for name in _usernames(entity) if name in wanted), None)
+        if channel is not None:
+            changed[channel] = _entity_fields(channel, entity)
+
+    for channel in channels:
+        known = _entities.get(channel, {})
+        if channel in changed or (known.get("channel_id") and known.get("status") != "missing"):
+            continue
+        await budget.acquire()
+        try:
+            entity = await client.get_entity(channel)
+        except FloodWaitError as e:
+            # Остальные каналы пока читаются по username; разрешим их при следующей перезагрузке
+            logger.warning(f"FloodWait {e.seconds} с при разрешении каналов, остальные — позже")
+            break
+        except (ValueError, *UNAVAILABLE_ERRORS) as e:
+            changed[channel] = _missing(type(e).__name__)
+            continue
+        if isinstance(entity, Channel):
+            changed[channel] = _entity_fields(channel, entity)
+        else:
+            changed[channel] = _missing("не канал")
+
+    updated = {channel: fields for channel, fields in changed.items()
+               if {k: _entities.get(channel, {}).get(k) for k in fields} != fields}
+    for channel, fields in updated.items():
+        if fields["status"] == "renamed":
+            logger.warning(
+                f"Канал {channel} переименован в @{fields['current_username']}: читаю по id, обновите channels.json"
+            )
+        elif fields["status"] == "missing":
+            logger.warning(f"Канал {channel} не найден ({fields['note']})")
+    _entities.update(changed)
+    if updated:
+        await run_db(save_channel_entities, session_name, updated)
+    resolved = sum(1 for channel in channels if _entities.get(channel, {}).get("channel_id"))
+    logger.info(f"Каналы: известны id у {resolved} из {len(channels)}, обновлено записей: {len(updated)}")
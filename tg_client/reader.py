@@ -1,21 +1,43 @@
 import os
+import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
 
-from telethon import TelegramClient
+from telethon import TelegramClient, events, utils
 from telethon.tl.types import Message
 
-from database.db import is_post_processed
+from monitoring.metrics import FETCH_SECONDS, POSTS_FETCHED
+from tg_client.entities import UNAVAILABLE_ERRORS, channel_ids, get_peer, mark_unavailable
+from tg_client.ratelimit import TokenBucket
 
 
 SESSION_NAME = "tg_session"
 
 
+def session_name() -> str:
+    """Имя файла сессии Telethon: у каждого воркера в режиме шардирования своё (TELEGRAM_SESSION)"""
+    return os.getenv("TELEGRAM_SESSION", SESSION_NAME)
+
+
+_request_budget: Optional[TokenBucket] = None
+
+
+def get_request_budget() -> TokenBucket:
+    """Общий бюджет запросов аккаунта к Telegram API (создаётся после загрузки .env)"""
+    global _request_budget
+    if _request_budget is None:
+        _request_budget = TokenBucket(
+            rate=float(os.getenv("TELEGRAM_REQUESTS_PER_MINUTE", "30")) / 60,
+            capacity=float(os.getenv("TELEGRAM_REQUESTS_BURST", "5")),
+        )
+    return _request_budget
+
+
 async def init_client() -> TelegramClient:
     api_id = int(os.getenv("TELEGRAM_API_ID", "0"))
     api_hash = os.getenv("TELEGRAM_API_HASH", "")
     phone = os.getenv("TELEGRAM_PHONE", "")
-    client = TelegramClient(SESSION_NAME, api_id, api_hash)
+    client = TelegramClient(session_name(), api_id, api_hash)
     await client.connect()
     if not await client.is_user_authorized():
         await client.start(phone=phone)
@@ -30,13 +52,85 @@ def _message_to_dict(msg: Message) -> Dict[str, Any]:
     }
 
 
-async def fetch_new_posts(client: TelegramClient, channel_username: str, limit: int = 50) -> List[Dict[str, Any]]:
+async def fetch_new_posts(
+    client: TelegramClient,
+    channel_username: str,
+    limit: int = 50,
+    min_id: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Новые посты канала от старых к новым и id самого нового прочитанного сообщения.
+
+    Если известен курсор `min_id`, читаем все сообщения после него постранично
+    вперёд, пока не догоним ленту (ничего не теряется после простоя). Для нового
+    канала без курсора берём последние `limit` сообщений. В посты попадают только
+    сообщения с текстом, а id учитывает и медиа без подписи, и служебные сообщения:
+    курсор сдвигается по нему, чтобы такой хвост ленты не перечитывался.
+    """
+    budget = get_request_budget()
     posts: List[Dict[str, Any]] = []
-    async for msg in client.iter_messages(channel_username, limit=limit):
-        if not msg.message:
-            continue
-        if is_post_processed(channel_username, msg.id):
-            continue
-        posts.append(_message_to_dict(msg))
-    return list(reversed(posts))
+    await budget.acquire()
+    started = time.perf_counter()
+    peer = get_peer(channel_username)
+    if min_id is None:
+        messages = client.iter_messages(peer, limit=limit)
+    else:
+        messages = client.iter_messages(peer, min_id=min_id, reverse=True)
+    seen = 0
+    last_id: Optional[int] = None
+    try:
+        async for msg in messages:
+            seen += 1
+            # Telethon запрашивает историю страницами по 100 сообщений
+            if seen % 100 == 0:
+                await budget.acquire()
+            last_id = max(last_id or 0, msg.id)
+            if not getattr(msg, "message", None):
+                continue
+            posts.append(_message_to_dict(msg))
+    except UNAVAILABLE_ERRORS as e:
+        await mark_unavailable(channel_username, e)
+        raise
+    if min_id is None:
+        posts.reverse()
+    FETCH_SECONDS.observe(time.perf_counter() - started, channel=channel_username)
+    POSTS_FETCHED.inc(len(posts), channel=channel_username)
+    return posts, last_id
+
+
+PushCallback = Callable[[str, Dict[str, Any], bool], Awaitable[None]]
+
+
+def subscribe_channels(client: TelegramClient, channels: List[str], callback: PushCallback) -> Callable[[], None]:
+    """Подписаться на новые и отредактированные посты каналов; вернуть функцию отписки.
+
+    callback(channel_username, post, edited) вызывается сразу при получении апдейта
+    от Telegram, без опроса истории.
+    """
+    by_username = {c.lower(): c for c in channels}
+    by_id = {channel_id: c for channel_id, c in channel_ids().items() if c in channels}
+
+    async def _dispatch(event, edited: bool) -> None:
+        # Канал узнаём по id (переживает переименование), username — для ещё не разрешённых
+        channel = by_id.get(utils.resolve_id(event.chat_id)[0])
+        if channel is None:
+            chat = await event.get_chat()
+            channel = by_username.get((getattr(chat, "username", None) or "").lower())
+        if channel is None:
+            return
+        await callback(channel, _message_to_dict(event.message), edited)
+
+    async def _on_new(event) -> None:
+        await _dispatch(event, edited=False)
+
+    async def _on_edit(event) -> None:
+        await _dispatch(event, edited=True)
+
+    peers = [get_peer(c) for c in channels]
+    client.add_event_handler(_on_new, events.NewMessage(chats=peers))
+    client.add_event_handler(_on_edit, events.MessageEdited(chats=peers))
+
+    def unsubscribe() -> None:
+        client.remove_event_handler(_on_new)
+        client.remove_event_handler(_on_edit)
 
+    return unsubscribe
@@ -0,0 +1,61 @@
+"""Обучение и оценка модели-фильтра перед LLM.
+
+python train_gate.py train      — обучить на вердиктах LLM из processed_posts и сохранить модель
+python train_gate.py evaluate   — качество сохранённой модели на отложенной выборке
+"""
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+from database.db import init_db, get_labelled_posts
+from detectors.scoring import EventGate, evaluate, load_dataset, model_path, skip_threshold
+
+THRESHOLDS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3)
+
+
+def _report(gate: EventGate, holdout) -> None:
+    texts = [t for t, _ in holdout]
+    labels = [y for _, y in holdout]
+    print(f"Отложенная выборка: {len(holdout)} постов, событий: {sum(labels)}")
+    print("порог   precision  recall  пропущено_событий  вызовов_LLM_сэкономлено")
+    current = skip_threshold()
+    for threshold in sorted(set(THRESHOLDS) | {current}):
+        m = evaluate(gate, texts, labels, threshold)
+        mark = "  <- SCORING_SKIP_BELOW" if threshold == current else ""
+        print(
+            f"{threshold:5.2f}   {m['precision']:9.3f}  {m['recall']:6.3f}  "
+            f"{int(m['missed_events']):17d}  {m['llm_calls_avoided']:22.1%}{mark}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Модель-фильтр перед LLM")
+    parser.add_argument("command", choices=["train", "evaluate"])
+    parser.add_argument("--epochs", type=int, default=8)
+    args = parser.parse_args()
+
+    if not load_dotenv():
+        load_dotenv("env.sample")
+    init_db()
+    train, holdout = load_dataset(get_labelled_posts())
+    path = model_path()
+
+    if args.command == "train":
+        if not train:
+            print("Нет размеченных постов в processed_posts")
+            sys.exit(1)
+        gate = EventGate()
+        gate.fit([t for t, _ in train], [y for _, y in train], epochs=args.epochs)
+        gate.save(path)
+        print(f"Модель сохранена: {path} ({len(gate.weights)} весов, обучено на {len(train)} постах)")
+    else:
+        if not path.exists():
+            print(f"Модель не найдена: {path}. Сначала запустите: python train_gate.py train")
+            sys.exit(1)
+        gate = EventGate.load(path)
+    _report(gate, holdout)
+
+
+if __name__ == "__main__":
+    main()